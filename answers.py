@@ -0,0 +1,97 @@
+import html
+import re
+import unicodedata
+
+strictness_levels = ['strict', 'normal', 'lenient']
+default_strictness = 'normal'
+
+# allowed edit distance per character of the expected answer
+distance_ratio = {
+    'strict': 0,
+    'normal': 0.2,
+    'lenient': 0.34
+}
+
+articles = {'a', 'an', 'the'}
+number_words = {
+    'zero': '0', 'one': '1', 'two': '2', 'three': '3', 'four': '4', 'five': '5', 'six': '6', 'seven': '7',
+    'eight': '8', 'nine': '9', 'ten': '10', 'eleven': '11', 'twelve': '12', 'thirteen': '13', 'fourteen': '14',
+    'fifteen': '15', 'sixteen': '16', 'seventeen': '17', 'eighteen': '18', 'nineteen': '19', 'twenty': '20'
+}
+
+tag_regex = re.compile(r'<[^>]+>')
+parenthesis_regex = re.compile(r'\([^)]*\)')
+# "Burma (or Myanmar)" names an alternative, a title like "To Be or Not to Be" only contains the word
+or_alternative_regex = re.compile(r'\(\s*or\s+([^)]*)\)', re.IGNORECASE)
+# a spaced slash, or one between words like "Lion/Tiger", but not AC/DC, TCP/IP, 24/7 or 1/2
+slash_alternative_regex = re.compile(r'\s+/\s+|(?<=[^\W\d_]{3})/(?=[^\W\d_]{3})')
+separator_regex = re.compile(r'[^\w\s]|_')
+
+
+def normalize(text):
+    text = tag_regex.sub(' ', html.unescape(text)).replace('&', ' and ')
+    if not text.isascii():
+        text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    tokens = separator_regex.sub(' ', text.lower()).split()
+    return tuple(number_words.get(t, t) for t in tokens if t not in articles)
+
+
+def bounded_distance(a, b, limit):
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if len(a) > len(b):
+        a, b = b, a
+
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        low = max(1, i - limit)
+        high = min(len(b), i + limit)
+        if low > 1:
+            current[low - 1] = limit + 1
+        for j in range(low, high + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != b[j - 1]))
+        if high < len(b):
+            current[high + 1:] = [limit + 1] * (len(b) - high)
+        if min(current[low - 1:high + 1]) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class AnswerKey:
+    __slots__ = ('variants',)
+
+    def __init__(self, answer):
+        # the whole answer always matches, its alternatives are accepted as well
+        alternatives = [answer] + or_alternative_regex.findall(answer)
+        parts = slash_alternative_regex.split(answer)
+        if len(parts) > 1:
+            alternatives.extend(parts)
+
+        variants = set()
+        for alternative in alternatives:
+            variants.add(' '.join(normalize(alternative)))
+            variants.add(' '.join(normalize(parenthesis_regex.sub(' ', alternative))))
+        variants.discard('')
+        self.variants = tuple(variants)
+
+    def matches(self, given, strictness=default_strictness):
+        given_tokens = normalize(given)
+        text = ' '.join(given_tokens)
+        if not text:
+            return False
+        if text in self.variants:
+            return True
+
+        ratio = distance_ratio[strictness]
+        for variant in self.variants:
+            limit = int(len(variant) * ratio)
+            if limit and bounded_distance(text, variant, limit) <= limit:
+                return True
+            # lenient matching accepts e.g. only the last name of a person
+            if strictness == 'lenient':
+                tokens = variant.split()
+                if len(tokens) > 1 and set(given_tokens) <= set(tokens) and tokens[-1] in given_tokens:
+                    return True
+        return False
@@ -0,0 +1,30 @@
+import timeit
+
+from answers import AnswerKey, strictness_levels
+
+samples = [
+    ('The Beatles', 'beatles'),
+    ('<i>The Old Man and the Sea</i>', 'old man and the see'),
+    ('John F. Kennedy', 'kennedy'),
+    ('(Franklin) Roosevelt', 'Franklin Delano Roosevelt'),
+    ('Crème brûlée', 'creme brulee'),
+    ('Mississippi', 'missisippi'),
+    ('Antidisestablishmentarianism', 'something completely different'),
+    ('Seven', '7')
+]
+
+
+def main(number=20000):
+    build = timeit.timeit(lambda: [AnswerKey(answer) for answer, _ in samples], number=number // 10)
+    print('build key: {:8.2f} us'.format(build / (number // 10) / len(samples) * 1e6))
+
+    keys = [(AnswerKey(answer), given) for answer, given in samples]
+    for strictness in strictness_levels:
+        elapsed = timeit.timeit(lambda: [key.matches(given, strictness) for key, given in keys], number=number)
+        matched = sum(key.matches(given, strictness) for key, given in keys)
+        print('match {:8}: {:8.2f} us ({}/{} matched)'.format(
+            strictness, elapsed / number / len(keys) * 1e6, matched, len(keys)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+import bot
+import metrics
+from cache import GameStateCache
+from fakes import FakeGateway, FakeQuestionApi
+from guilds import GuildActors
+from history import GuildHistories
+from jeopardy import DatabaseGame, JeopardyGame, TriviaGame, supported_values
+from media import MediaUploads
+from outbox import Outbox
+from pool import BoardPool
+from sqlite import SQLiteInstance
+from timers import TimerScheduler
+
+unlimited_rate = (10 ** 9, 1.0)
+
+# lower is better for all results except throughput
+higher_is_better = {'commands_per_second'}
+
+
+def fill_question_bank(bank, category_count):
+    with bank.conn:
+        for category_id in range(1, category_count + 1):
+            bank.save_category(category_id, 'category {}'.format(category_id))
+            bank.insert_questions([(category_id, 'question {} {} {}'.format(category_id, value, i),
+                                    'answer {}'.format(i), value) for value in supported_values for i in range(3)])
+
+
+def open_backend(name, directory):
+    if name == 'sqlite':
+        return SQLiteInstance(os.path.join(directory, 'games.db'))
+    if name == 'sqlite-journal':
+        return SQLiteInstance(os.path.join(directory, 'journal.db'), journal=True)
+    if name == 'mongodb':
+        import mongomock
+        from mongo import MongoInstance
+
+        return MongoInstance('mongodb://localhost', client=mongomock.MongoClient())
+    raise ValueError('unknown backend {}'.format(name))
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0
+
+
+def written_bytes():
+    return sum(total for _, total, _ in metrics.storage_bytes.values.values())
+
+
+async def run_backend(backend, args, directory):
+    db = open_backend(backend, directory)
+    bot.db = db
+    bot.state = GameStateCache(db, max_size=args.guilds * 2, flush_interval=args.flush_interval)
+    bot.guild_actors = GuildActors(bot.state)
+    bot.histories = GuildHistories(db)
+    # the scripted players answer right away, so the timers are scheduled and cancelled but never run
+    bot.timers = TimerScheduler(bot.question_timeout)
+    bot.media_uploads = MediaUploads(DatabaseGame.question_bank)
+    bot.outbox = Outbox(window=0, channel_rate=unlimited_rate, global_rate=unlimited_rate)
+    bot.pool = BoardPool(size=0)
+    bot.pool.register('db', DatabaseGame.create)
+    bot.pool.register('jeopardy', JeopardyGame.create)
+    bot.pool.register('trivia', TriviaGame.create)
+
+    gateway = FakeGateway(bot.bot, data_source=args.source, seed=args.seed)
+    written = written_bytes()
+    started = time.perf_counter()
+    await gateway.run(args.guilds, args.rounds, concurrency=args.concurrency)
+    elapsed = time.perf_counter() - started
+    written = written_bytes() - written
+
+    # tracing slows everything down, so the memory of games that stay open is measured in a separate run
+    tracemalloc.start()
+    memory = tracemalloc.get_traced_memory()[0]
+    guilds = await FakeGateway(bot.bot, data_source=args.source, seed=args.seed).run(
+        args.memory_guilds, args.rounds, end=False, first=args.guilds, concurrency=args.concurrency)
+    memory = tracemalloc.get_traced_memory()[0] - memory
+    tracemalloc.stop()
+
+    await bot.guild_actors.close()
+    await bot.outbox.close()
+    await bot.state.close()
+    await bot.histories.close()
+    db.close()
+
+    return {
+        'commands': gateway.commands,
+        'errors': gateway.errors,
+        'commands_per_second': gateway.commands / elapsed,
+        'p50_ms': percentile(gateway.latencies, 0.5) * 1000,
+        'p99_ms': percentile(gateway.latencies, 0.99) * 1000,
+        'bytes_per_command': written / max(gateway.commands, 1),
+        'memory_per_game': memory / max(len(guilds), 1)
+    }
+
+
+def compare(results, baseline, tolerance):
+    regressions = list()
+    for backend, values in results.items():
+        for name, value in values.items():
+            previous = baseline.get(backend, {}).get(name)
+            if not previous or name in ('commands', 'errors'):
+                continue
+            change = (value - previous) / previous
+            if (change < -tolerance) if name in higher_is_better else (change > tolerance):
+                regressions.append('{} {}: {:.2f} -> {:.2f} ({:+.0%})'.format(backend, name, previous, value, change))
+    return regressions
+
+
+async def run(args):
+    api = FakeQuestionApi()
+    await api.start()
+    api.patch_urls()
+
+    results = dict()
+    with tempfile.TemporaryDirectory() as directory:
+        bank = SQLiteInstance(os.path.join(directory, 'questions.db'))
+        fill_question_bank(bank, args.categories)
+        DatabaseGame.question_bank = bank
+        try:
+            for backend in args.backends:
+                results[backend] = await run_backend(backend, args, directory)
+        finally:
+            bank.close()
+            await bot.fetcher.close()
+            await api.close()
+    return results
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--guilds', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=100, help='guilds playing at the same time')
+    # real players take longer between commands than the flush interval, so by default every change is written
+    parser.add_argument('--flush-interval', type=float, dest='flush_interval', default=0)
+    parser.add_argument('--memory-guilds', type=int, dest='memory_guilds', default=200)
+    parser.add_argument('--categories', type=int, default=200)
+    parser.add_argument('--source', choices=['db', 'jeopardy', 'trivia'], default='db')
+    parser.add_argument('--backends', nargs='+', choices=['sqlite', 'sqlite-journal', 'mongodb'],
+                        default=['sqlite', 'mongodb'])
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', type=str, help='write the results to this json file')
+    parser.add_argument('--baseline', type=str, help='fail if the results are worse than in this json file')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    results = asyncio.run(run(args))
+    for backend, values in results.items():
+        print('{:8} {:7d} commands ({} errors), {:8.0f} commands/s, p50 {:6.2f} ms, p99 {:6.2f} ms, '
+              '{:6.0f} bytes/command, {:7.0f} bytes/game'.format(
+                  backend, values['commands'], values['errors'], values['commands_per_second'], values['p50_ms'],
+                  values['p99_ms'], values['bytes_per_command'], values['memory_per_game']))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('regression: ' + regression)
+        if regressions:
+            sys.exit(1)
+
+    if any(values['errors'] for values in results.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
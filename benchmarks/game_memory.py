@@ -0,0 +1,50 @@
+import random
+import tracemalloc
+
+from jeopardy import Game, DatabaseGame, supported_values
+from state import board_document, state_document, load_game_data
+from players import PlayerRegistry
+
+
+def random_board(category_count=5):
+    words = ['river', 'capital', 'novel', 'element', 'planet', 'composer', 'painter', 'island', 'empire', 'ocean']
+    return [{'title': ' '.join(random.sample(words, 2)).upper(),
+             'clues': [{'question': 'This {} is known for its {} and {}'.format(*random.sample(words, 3)),
+                        'answer': ' '.join(random.sample(words, 2)), 'value': value} for value in supported_values]}
+            for _ in range(category_count)]
+
+
+def build_games(count):
+    games = list()
+    for game_id in range(count):
+        game = DatabaseGame(game_id)
+        game.load_categories(random_board())
+        for category, value in random.sample(list(game.clues), k=10):
+            game.get_new_question(category, value)
+            game.get_answer()
+        games.append(game)
+    return games
+
+
+def memory_per_game(count):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    games = build_games(count)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / count, games
+
+
+def main(count=2000):
+    memory, games = memory_per_game(count)
+    print('memory per game: {:8.0f} bytes ({} games)'.format(memory, count))
+
+    game_data = {'game': games[0], 'players': PlayerRegistry(), 'active_player': None, 'objection_possible': False,
+                 'timer': None}
+    board, state = board_document(game_data), state_document(game_data)
+    restored = load_game_data(0, board, state)['game']
+    assert isinstance(restored, Game) and restored.dump_state() == games[0].dump_state()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+answered_cell = '----'
+column_separator = '  '
+
+
+class BoardRenderer:
+    def __init__(self, titles, values):
+        titles = ['{}. {}'.format(i, title) for i, title in enumerate(titles, 1)]
+        widths = [max(len(title), len(answered_cell), *(len(str(v)) for v in values)) for title in titles]
+
+        self.offsets = list()
+        offset = 0
+        for width in widths:
+            self.offsets.append(offset)
+            offset += width + len(column_separator)
+
+        self.widths = widths
+        self.header = column_separator.join(t.ljust(w) for t, w in zip(titles, widths)).rstrip()
+        self.separator = column_separator.join('-' * w for w in widths)
+        self.lines = [column_separator.join(str(v).ljust(w) for w in widths).rstrip() for v in values]
+        self.rendered = None
+
+    def set_cell(self, column, row, text):
+        start = self.offsets[column]
+        width = self.widths[column]
+        line = self.lines[row].ljust(start + width)
+        self.lines[row] = (line[:start] + text.ljust(width) + line[start + width:]).rstrip()
+        self.rendered = None
+
+    def render(self):
+        if self.rendered is None:
+            self.rendered = '\n'.join([self.header, self.separator] + self.lines)
+        return self.rendered
@@ -1,13 +1,27 @@
+import asyncio
 import logging
 import os
 import re
 import sys
+import time
 from argparse import ArgumentParser
 
-from discord import DiscordException
+from discord import DiscordException, Intents
 from discord.ext import commands
 
-from jeopardy import JeopardyGame, TriviaGame, DatabaseGame, CustomGame
+import metrics
+from answers import default_strictness, strictness_levels
+from cache import GameStateCache, IdleGameSweeper, default_game_ttl
+from fetch import fetcher
+from guilds import GuildActors, GuildBusy, default_queue_size
+from history import GuildHistories
+from outbox import Outbox
+from jeopardy import JeopardyGame, TriviaGame, DatabaseGame, CustomGame, CustomQuestionsError
+from media import MediaUploads
+from players import PlayerRegistry
+from pool import BoardPool, default_pool_size
+from sync import CategoryIndexCrawler, default_crawl_interval
+from timers import TimerScheduler
 
 answer_regex_filter = [
     (re.compile(r'!answer '), ''),
@@ -16,258 +30,416 @@ answer_regex_filter = [
 
 players_str = 'Currently these people are registered:\n{players}'
 no_game_running = "You don't have any games running. Maybe try starting one with !start"
+guild_busy = 'Slow down please, I am still working on your previous commands.'
+
+default_answer_time = 30
+default_steal_time = 15
 
 point_emoji_list = ['1️⃣', '2️⃣', '3️⃣', '4️⃣', '5️⃣', '6️⃣', '7️⃣', '8️⃣', '9️⃣']
 
-bot = commands.Bot(command_prefix='!')
+
+class TriviCordBot(commands.AutoShardedBot):
+    async def close(self):
+        await shutdown()
+        await super().close()
+
+
+async def shutdown():
+    if metrics_server is not None:
+        await metrics_server.close()
+    if timers is not None:
+        await timers.close()
+    if sweeper is not None:
+        await sweeper.close()
+    if crawler is not None:
+        await crawler.close()
+    if state is not None:
+        await guild_actors.close()
+        await outbox.close()
+        await state.close()
+        await histories.close()
+        db.close()
+        if DatabaseGame.question_bank is not db:
+            DatabaseGame.question_bank.close()
+    await pool.close()
+    await fetcher.close()
+
+
+bot = TriviCordBot(command_prefix='!', intents=Intents.default())
 db = None
+state = None
+guild_actors = None
+histories = None
+sweeper = None
+crawler = None
+timers = None
+media_uploads = None
+metrics_server = None
+answer_strictness = default_strictness
+answer_time = default_answer_time
+steal_time = default_steal_time
+pool = BoardPool()
+outbox = Outbox()
+pool.register('jeopardy', JeopardyGame.create)
+pool.register('trivia', TriviaGame.create)
+pool.register('db', DatabaseGame.create)
 
 
 @bot.event
 async def on_ready():
     logging.info(f'{bot.user.name} has connected to Discord!')
+    pool.start()
+    await start_timers()
+    if sweeper is not None:
+        sweeper.start()
+    if crawler is not None:
+        crawler.start()
+    if metrics_server is not None and metrics_server.server is None:
+        await metrics_server.start()
+
+
+@bot.event
+async def on_command(ctx):
+    ctx.started = time.perf_counter()
+
+
+@bot.event
+async def on_command_completion(ctx):
+    command_done(ctx, 'ok')
+
+
+@bot.event
+async def on_command_error(ctx, error):
+    if isinstance(error, commands.CommandNotFound):
+        logging.debug('unknown command in guild {}: {}'.format(ctx.guild.id if ctx.guild else None, error))
+        return
+    if ctx.command is None:
+        return
+    if isinstance(error, commands.UserInputError):
+        logging.debug('invalid arguments for command {}: {}'.format(ctx.command.name, error))
+        await outbox.send(ctx.channel, "Sorry, I didn't understand that. Use it like this:\n!{} {}".format(
+            ctx.command.qualified_name, ctx.command.signature).rstrip())
+        command_done(ctx, 'invalid')
+        return
+    logging.error('command {} failed in guild {}'.format(ctx.command.name, ctx.guild.id if ctx.guild else None),
+                  exc_info=getattr(error, 'original', error))
+    command_done(ctx, 'error')
 
 
 @bot.event
 async def on_reaction_add(reaction, user):
     logging.debug('reaction added')
-    if not user.bot:
-        game_data = db.get_game(reaction.message.guild.id)
-        if game_data:
-            if reaction.emoji == '\U0001f3ae':
-                if user.name not in [p['name'] for p in game_data['players']]:
-                    game_data['players'].append({'name': user.name, 'points': 0})
-                    db.save_game(reaction.message.guild.id, game_data)
-                    message = 'Welcome to the game {player}!'.format(player=user.name)
-                    logging.debug('player {} joined the game {}'.format(user.name, reaction.message.guild.id))
+    if not user.bot and reaction.emoji == '\U0001f3ae':
+        guild_id = reaction.message.guild.id
 
-                    await reaction.message.channel.send(message)
+        async def handle(session):
+            game_data = session.data
+            if game_data and game_data['players'].identify(user.id, user.display_name, user.name) is None:
+                game_data['players'].add(user.id, user.display_name)
+                session.save(game_data)
+                logging.debug('player {} joined the game {}'.format(user.id, guild_id))
+
+                outbox.send(reaction.message.channel, user.display_name, key='welcome', merge=welcome_message)
+                outbox.update_board(reaction.message.channel, board_message(game_data))
+
+        try:
+            await guild_actors.submit(guild_id, handle)
+        except GuildBusy:
+            logging.debug('dropped reaction in busy guild {}'.format(guild_id))
 
 
 @bot.event
 async def on_reaction_remove(reaction, user):
     logging.debug('reaction removed')
-    if not user.bot:
-        game_data = db.get_game(reaction.message.guild.id)
-        if game_data:
-            if reaction.emoji == '\U0001f3ae':
-                if user.name in [p['name'] for p in game_data['players']]:
-                    for i, player in enumerate(game_data['players']):
-                        if player['name'] == user.name:
-                            game_data['players'].pop(i)
-                    db.save_game(reaction.message.guild.id, game_data)
-                    message = 'Ok {player}, you are not longer in the game.'.format(player=user.name)
-                    logging.debug('player {} removed from the game {}'.format(user.name, reaction.message.guild.id))
+    if not user.bot and reaction.emoji == '\U0001f3ae':
+        guild_id = reaction.message.guild.id
 
-                    await reaction.message.channel.send(message)
+        async def handle(session):
+            game_data = session.data
+            if game_data and game_data['players'].identify(user.id, user.display_name, user.name) is not None:
+                game_data['players'].remove(user.id)
+                session.save(game_data)
+                logging.debug('player {} removed from the game {}'.format(user.id, guild_id))
 
+                outbox.send(reaction.message.channel, user.display_name, key='goodbye', merge=goodbye_message)
+                outbox.update_board(reaction.message.channel, board_message(game_data))
 
-@bot.command(name='start', help='Starts a game of jeopardy')
-async def start(ctx, data_source='trivia'):
-    game_data = db.get_game(ctx.guild.id)
-    if not game_data:
+        try:
+            await guild_actors.submit(guild_id, handle)
+        except GuildBusy:
+            logging.debug('dropped reaction in busy guild {}'.format(guild_id))
 
-        await ctx.send('welcome to TriviCord, please give me a second to gather some questions...')
-        await ctx.trigger_typing()
-        game_data = dict()
 
-        if data_source.lower() == 'jeopardy':
-            game = JeopardyGame(ctx.guild.id)
-        elif data_source.lower() == 'trivia':
-            game = TriviaGame(ctx.guild.id)
-        elif data_source.lower() == 'db':
-            game = DatabaseGame(ctx.guild.id)
-        elif data_source.lower() == 'custom':
+@bot.command(name='start', help='Starts a game of jeopardy')
+async def start(ctx, data_source='trivia'):
+    async def handle(session):
+        game_data = session.data
+        if not game_data:
+
+            await outbox.send(ctx.channel, 'welcome to TriviCord, please give me a second to gather some questions...')
+            await ctx.trigger_typing()
+            game_data = dict()
+
+            try:
+                history = await histories.get(ctx.guild.id)
+                if data_source.lower() in pool.factories:
+                    game = await pool.get(data_source.lower(), ctx.guild.id, history)
+                elif data_source.lower() == 'custom':
+
+                    attachments = ctx.message.attachments
+
+                    if len(attachments) > 0:
+                        game = await CustomGame.create(ctx.guild.id, attachments[0].url, history=history)
+                    else:
+                        await outbox.send(ctx.channel, 'Please provide a csv file with the questions')
+                        return
+                else:
+                    raise DiscordException()
+            except CustomQuestionsError as e:
+                message = 'Sorry, I could not use your questions:\n'
+                message += '\n'.join('- ' + error for error in e.errors[:10])
+                if len(e.errors) > 10:
+                    message += '\n... and {} more'.format(len(e.errors) - 10)
+                await outbox.send(ctx.channel, message)
+                return
+            except (ConnectionError, LookupError):
+                logging.exception('could not gather questions for guild {}'.format(ctx.guild.id))
+                await outbox.send(ctx.channel, 'Sorry, I could not gather enough questions. Please try again later.')
+                return
 
-            attachments = ctx.message.attachments
+            logging.info('starting new game in guild {} with data_source {}'.format(ctx.guild.id, data_source.lower()))
 
-            if len(attachments) > 0:
-                game = CustomGame(ctx.guild.id, attachments[0].url)
-            else:
-                await ctx.send('Please provide a csv file with the questions')
-                return
+            game_data['game'] = game
+            game_data['players'] = PlayerRegistry()
+            game_data['active_player'] = None
+            game_data['objection_possible'] = False
+            game_data['timer'] = None
+            session.save(game_data)
+            send_message = await outbox.update_board(ctx.channel, board_message(game_data), new=True)
+            if send_message is not None:
+                await send_message.add_reaction('\U0001f3ae')
         else:
-            raise DiscordException()
-
-        logging.info('starting new game in guild {} with data_source {}'.format(ctx.guild.id, data_source.lower()))
-
-        game_data['game'] = game
-        game_data['players'] = list()
-        # game_data['players'].append({'name': ctx.author.name, 'points': 0})
-        game_data['active_player'] = None
-        game_data['objection_possible'] = False
-        message = '```{board}```'.format(board=game_data['game'].get_board())
-        message += players_str.format(players='\n'.join(['- ' + p['name'] for p in game_data['players']]))
-        message += '\n\nto add more players, each player may send !enter or add the \U0001f3ae reaction'
-        db.save_game(ctx.guild.id, game_data)
-        send_message = await ctx.send(message)
-        await send_message.add_reaction('\U0001f3ae')
-    else:
-        message = "There is already a game running. Type !end to end the game."
-        await ctx.send(message)
+            message = "There is already a game running. Type !end to end the game."
+            await outbox.send(ctx.channel, message)
+
+    await in_guild(ctx, handle)
 
 
 @bot.command(name='enter', help='enter the game')
 async def enter(ctx):
-    game_data = db.get_game(ctx.guild.id)
-    if game_data:
-        if ctx.author.name not in [p['name'] for p in game_data['players']]:
-            game_data['players'].append({'name': ctx.author.name, 'points': 0})
-            message = 'Welcome to the game {player}!'.format(player=ctx.author.name)
-            logging.debug('player {} joined the game {}'.format(ctx.author.name, ctx.guild.id))
+    async def handle(session):
+        game_data = session.data
+        if game_data:
+            if game_data['players'].identify(ctx.author.id, ctx.author.display_name, ctx.author.name) is None:
+                game_data['players'].add(ctx.author.id, ctx.author.display_name)
+                message = 'Welcome to the game {player}!'.format(player=ctx.author.display_name)
+                logging.debug('player {} joined the game {}'.format(ctx.author.id, ctx.guild.id))
+            else:
+                message = 'You are already registered, {player}.'.format(player=ctx.author.display_name)
+
+            message += '\n' + players_str.format(players=player_names(game_data['players']))
+            session.save(game_data)
+            outbox.update_board(ctx.channel, board_message(game_data))
         else:
-            message = 'You are already registered, {player}.'.format(player=ctx.author.name)
+            message = no_game_running
 
-        message += '\n' + players_str.format(
-            players='\n'.join(['- ' + p['name'] for p in game_data['players']]))
-        db.save_game(ctx.guild.id, game_data)
-    else:
-        message = no_game_running
+        await outbox.send(ctx.channel, message)
 
-    await ctx.send(message)
+    await in_guild(ctx, handle)
 
 
 @bot.command(name='players', help='get the current board')
 async def players(ctx):
-    game_data = db.get_game(ctx.guild.id)
+    game_data = await state.get_game(ctx.guild.id)
     if game_data:
-        message = players_str.format(players='\n'.join(['- ' + p['name'] for p in game_data['players']]))
+        message = players_str.format(players=player_names(game_data['players']))
     else:
         message = no_game_running
 
-    await ctx.send(message)
+    await outbox.send(ctx.channel, message)
 
 
 @bot.command(name='choose', help='choose category and value')
 async def choose(ctx, category: int, value: int):
     category -= 1
-    game_data = db.get_game(ctx.guild.id)
-    if game_data:
-        game = game_data['game']
 
-        if (category, value) not in game.answered_clue_values:
-            message = 'Here comes your question:\n' + game.get_new_question(category, value)
-            game_data['active_player'] = ctx.author.name
+    async def handle(session):
+        game_data = session.data
+        media = None
+        if game_data:
+            game = game_data['game']
+
+            if not game.has_clue(category, value):
+                message = 'There is no such question, please select one from the list\n```{board}```' \
+                    .format(board=game.get_board())
+            elif not game.is_answered(category, value):
+                message = 'Here comes your question:\n' + game.get_new_question(category, value)
+                game_data['active_player'] = ctx.author.id
+                if answer_time:
+                    set_timer(ctx.guild.id, game_data, 'answer', answer_time, ctx.channel.id)
+                    message += '\nYou have {} seconds to answer.'.format(answer_time)
+                else:
+                    clear_timer(ctx.guild.id, game_data)
+                session.save(game_data)
+                await histories.record(ctx.guild.id, game.current_clue)
+                media = game.current_clue.media
+            else:
+                message = 'That question was already chosen, please select another one from the list\n```{board}```' \
+                    .format(board=game.get_board())
         else:
-            message = 'That question was already chosen, please select another one from the list\n```{board}```' \
-                .format(board=game.get_board())
-        db.save_game(ctx.guild.id, game_data)
-    else:
-        message = no_game_running
+            message = no_game_running
+
+        if media is not None:
+            await media_uploads.send(outbox, ctx.channel, message, media)
+        else:
+            await outbox.send(ctx.channel, message)
 
-    await ctx.send(message)
+    await in_guild(ctx, handle)
 
 
 @bot.command(name='answer', help='answer to your current question')
 async def give_answer(ctx, player_answer: str):
-    game_data = db.get_game(ctx.guild.id)
-    if game_data:
-        game = game_data['game']
-        if game_data['active_player'] == ctx.author.name:
-            answer = answer_filter(game.get_answer())
+    async def handle(session):
+        game_data = session.data
+        if game_data:
+            game = game_data['game']
+            game_data['players'].identify(ctx.author.id, ctx.author.display_name, ctx.author.name)
             player_answer = answer_filter(ctx.message.content)
-
-            if answer.lower() == player_answer.lower():
-                points = game.current_clue['value']
-                total = 0
-                for p in game_data['players']:
-                    if p['name'] == ctx.author.name:
-                        index = game_data['players'].index(p)
-                        game_data['players'][index]['points'] += points
-                        total = game_data['players'][index]['points']
-
-                message = "That's correct! You earned {points} points.\nYou have {total} points in total!".format(
-                    points=points, total=total)
-                game_data['objection_possible'] = False
+            stealing = game_data['active_player'] is None and can_steal(game_data, ctx.author.id)
+
+            if stealing and not game.check_answer(player_answer, answer_strictness):
+                # a wrong guess doesn't give the answer away to the others
+                phase, deadline, channel_id = game_data['timer'][:3]
+                excluded = excluded_players(game_data['timer']) + [ctx.author.id]
+                game_data['timer'] = [phase, deadline, channel_id, excluded]
+                session.save(game_data)
+                message = "That's not it. Anyone else?"
+
+            elif game_data['active_player'] == ctx.author.id or stealing:
+                answer = answer_filter(game.get_answer())
+
+                if game.check_answer(player_answer, answer_strictness):
+                    points = game.current_clue.value
+                    total = game_data['players'].add_points(ctx.author.id, points) or 0
+
+                    message = "That's correct! You earned {points} points.\nYou have {total} points in total!".format(
+                        points=points, total=total)
+                    game_data['objection_possible'] = False
+                else:
+                    message = 'Your not quite right. The correct answer would be:\n' + answer
+                    game_data['objection_possible'] = True
+
+                game_data['active_player'] = None
+                clear_timer(ctx.guild.id, game_data)
+
+                session.save(game_data)
+                outbox.update_board(ctx.channel, board_message(game_data))
+
+            elif game_data['timer'] is not None and game_data['timer'][0] == 'steal':
+                if ctx.author.id in game_data['players']:
+                    message = 'You already had your chance at this question.'
+                else:
+                    message = 'Only players can answer, send !enter to join the game.'
+
+            elif game_data['active_player'] is not None:
+                active_player = game_data['players'].get(game_data['active_player'])
+                message = "Sorry, it's not your turn. {active_player} has to answer.".format(
+                    active_player=active_player.name if active_player else 'Someone else')
+                message += '\n```{board}```'.format(board=game.get_board())
             else:
-                message = 'Your not quite right. The correct answer would be:\n' + answer
-                game_data['objection_possible'] = True
-
-            game_data['active_player'] = None
-
-            db.save_game(ctx.guild.id, game_data)
+                message = 'Currently there is no open question.' + \
+                          ' Please use !choose <Category Number> <Question Value> to get a new question!'
+                message += '\n```{board}```'.format(board=game.get_board())
 
-        elif game_data['active_player'] is not None:
-            message = "Sorry, it's not your turn. {active_player} has to answer.".format(
-                active_player=game_data['active_player'])
         else:
-            message = 'Currently there is no open question.' + \
-                      ' Please use !choose <Category Number> <Question Value> to get a new question!'
+            message = no_game_running
 
-        message += '\n```{board}```'.format(board=game.get_board())
+        await outbox.send(ctx.channel, message)
 
-    else:
-        message = no_game_running
-
-    await ctx.send(message)
+    await in_guild(ctx, handle)
 
 
 @bot.command(name='board', help='get the current board')
 async def board(ctx):
-    game_data = db.get_game(ctx.guild.id)
+    game_data = await state.get_game(ctx.guild.id)
     if game_data:
         game = game_data['game']
         message = 'Here is your board:\n```{board}```'.format(board=game.get_board())
     else:
         message = no_game_running
 
-    await ctx.send(message)
+    await outbox.send(ctx.channel, message)
 
 
 @bot.command(name='points', help='get the current points of all players')
 async def get_points(ctx):
-    game_data = db.get_game(ctx.guild.id)
+    game_data = await state.get_game(ctx.guild.id)
     if game_data:
-        game = game_data['game']
         message = "Here are the points:\n"
-        player_list = sorted(game_data['players'], key=lambda p: p['points'], reverse=True)
-        message += '\n'.join(['- {}: {}'.format(p['name'], p['points']) for p in player_list])
+        message += '\n'.join(['- {}: {}'.format(p.name, p.points) for p in game_data['players'].top()])
     else:
         message = no_game_running
 
-    await ctx.send(message)
+    await outbox.send(ctx.channel, message)
 
 
 @bot.command(name='end', help='end the game')
 async def end(ctx):
-    game_data = db.get_game(ctx.guild.id)
-    if game_data:
-        player_list = sorted(game_data['players'], key=lambda p: p['points'], reverse=True)
-        message = f'Congratulations **{player_list[0]["name"]}**, you have won the match with a score of **{player_list[0]["points"]}**!\U0001f389\U0001f389\U0001f389'
-        message += '\n\n'
-        for i, player in enumerate(player_list[:9]):
-            message += f"{point_emoji_list[i]} {player['name']} ({player['points']})\n"
-        db.delete_game(ctx.guild.id)
-        message += '\nEnding your game now'
-    else:
-        message = no_game_running
+    async def handle(session):
+        game_data = session.data
+        if game_data:
+            player_list = game_data['players'].top(len(point_emoji_list))
+            if player_list:
+                message = f'Congratulations **{player_list[0].name}**, you have won the match with a score of **{player_list[0].points}**!\U0001f389\U0001f389\U0001f389'
+                message += '\n\n'
+            else:
+                message = ''
+            for i, player in enumerate(player_list):
+                message += f"{point_emoji_list[i]} {player.name} ({player.points})\n"
+            session.delete()
+            timers.cancel(ctx.guild.id)
+            outbox.forget_board(ctx.channel)
+            await histories.save(ctx.guild.id)
+            message += '\nEnding your game now'
+        else:
+            message = no_game_running
+
+        await outbox.send(ctx.channel, message)
 
-    await ctx.send(message)
+    await in_guild(ctx, handle)
 
 
 @bot.command(name='objection', help='get points if you think you are right')
 async def objection(ctx):
-    game_data = db.get_game(ctx.guild.id)
-    if game_data:
-        if game_data['objection_possible']:
-            game = game_data['game']
-            points = game.current_clue['value']
-            total = 0
-            for p in game_data['players']:
-                if p['name'] == ctx.author.name:
-                    index = game_data['players'].index(p)
-                    game_data['players'][index]['points'] += points
-                    total = game_data['players'][index]['points']
-            message = "Okay, I'm sorry!\nYou earned {points} points.\nYou have {total} points in total!".format(
-                points=points, total=total)
-            game_data['objection_possible'] = False
-            db.save_game(ctx.guild.id, game_data)
+    async def handle(session):
+        game_data = session.data
+        if game_data:
+            if game_data['objection_possible']:
+                game = game_data['game']
+                points = game.current_clue.value
+                game_data['players'].identify(ctx.author.id, ctx.author.display_name, ctx.author.name)
+                total = game_data['players'].add_points(ctx.author.id, points) or 0
+                message = "Okay, I'm sorry!\nYou earned {points} points.\nYou have {total} points in total!".format(
+                    points=points, total=total)
+                game_data['objection_possible'] = False
+                session.save(game_data)
+            else:
+                message = "Sorry, no objection possible now"
         else:
-            message = "Sorry, no objection possible now"
-    else:
-        message = no_game_running
+            message = no_game_running
+
+        await outbox.send(ctx.channel, message)
 
-    await ctx.send(message)
+    await in_guild(ctx, handle)
+
+
+@bot.command(name='forget', help='forget which questions this server has already played')
+async def forget(ctx):
+    async def handle(session):
+        await histories.reset(ctx.guild.id)
+        await outbox.send(ctx.channel, 'I forgot all questions you have played, they can come up again now')
+
+    await in_guild(ctx, handle)
 
 
 '''
@@ -299,17 +471,169 @@ def create_embed(title, description, field_values):
 '''
 
 
+def set_timer(guild_id, game_data, phase, seconds, channel_id, excluded=()):
+    # the timer keeps the players that can't answer in the steal phase
+    deadline = time.time() + seconds
+    game_data['timer'] = [phase, deadline, channel_id, list(excluded)]
+    timers.schedule(guild_id, deadline)
+
+
+def can_steal(game_data, player_id):
+    timer = game_data['timer']
+    if timer is None or timer[0] != 'steal' or player_id not in game_data['players']:
+        return False
+    return player_id not in excluded_players(timer)
+
+
+def excluded_players(timer):
+    # timers of older versions have no list of excluded players
+    return list(timer[3]) if len(timer) > 3 else []
+
+
+def clear_timer(guild_id, game_data):
+    game_data['timer'] = None
+    timers.cancel(guild_id)
+
+
+async def start_timers():
+    # questions that were running before a restart get the rest of their time, or run out right away
+    if timers.task is None:
+        for guild_id, deadline in await db.get_deadlines():
+            # the other workers run the timers of their own guilds
+            if owns_guild(guild_id):
+                timers.schedule(guild_id, deadline)
+        timers.start()
+
+
+def owns_guild(guild_id):
+    return bot.shard_ids is None or (guild_id >> 22) % bot.shard_count in bot.shard_ids
+
+
+async def question_timeout(guild_id):
+    async def handle(session):
+        game_data = session.data
+        # the question was answered or got a new timer in the meantime
+        if not game_data or not game_data['timer'] or game_data['timer'][1] > time.time():
+            return
+        phase, channel_id = game_data['timer'][0], game_data['timer'][2]
+        game = game_data['game']
+
+        if phase == 'answer' and steal_time:
+            active_player = game_data['players'].get(game_data['active_player'])
+            message = "Time is up{name}! Every other player can answer now, the first one has {seconds} seconds." \
+                .format(name=', ' + active_player.name if active_player else '', seconds=steal_time)
+            excluded = [game_data['active_player']] if game_data['active_player'] is not None else []
+            game_data['active_player'] = None
+            set_timer(guild_id, game_data, 'steal', steal_time, channel_id, excluded)
+        else:
+            message = 'Time is up! The correct answer would have been:\n' + answer_filter(game.get_answer())
+            game_data['active_player'] = None
+            game_data['objection_possible'] = False
+            game_data['timer'] = None
+        session.save(game_data)
+
+        channel = bot.get_channel(channel_id)
+        if channel is not None:
+            await outbox.send(channel, message)
+            if game_data['timer'] is None:
+                outbox.update_board(channel, board_message(game_data))
+
+    try:
+        await guild_actors.submit(guild_id, handle)
+    except GuildBusy:
+        timers.schedule(guild_id, time.time() + timers.wheel.tick)
+
+
+async def in_guild(ctx, handler):
+    try:
+        await guild_actors.submit(ctx.guild.id, handler)
+    except GuildBusy:
+        await outbox.send(ctx.channel, guild_busy)
+
+
+def command_done(ctx, outcome):
+    started = getattr(ctx, 'started', None)
+    if started is not None:
+        metrics.command_seconds.observe(time.perf_counter() - started, command=ctx.command.name)
+    metrics.commands_total.inc(command=ctx.command.name, outcome=outcome)
+
+
+def register_gauges():
+    metrics.active_games.set_function(lambda: sum(1 for g in state.games.values() if g))
+    metrics.guild_queue_rejections.set_function(lambda: guild_actors.rejected)
+    metrics.outbox_messages.set_function(lambda: {('sent',): outbox.sent, ('edited',): outbox.edited,
+                                                  ('coalesced',): outbox.coalesced})
+    if sweeper is not None:
+        metrics.expired_games.set_function(lambda: sweeper.expired)
+    metrics.pool_boards.set_function(lambda: {(source,): stats['size'] for source, stats in pool.stats().items()})
+
+
+def board_message(game_data):
+    message = '```{board}```'.format(board=game_data['game'].get_board())
+    message += players_str.format(players=player_names(game_data['players']))
+    message += '\n\nto add more players, each player may send !enter or add the \U0001f3ae reaction'
+    return message
+
+
+def welcome_message(names):
+    return 'Welcome to the game {players}!'.format(players=', '.join(names))
+
+
+def goodbye_message(names):
+    return 'Ok {players}, you are not longer in the game.'.format(players=', '.join(names))
+
+
+def player_names(registry):
+    return '\n'.join(['- ' + p.name for p in registry])
+
+
 def answer_filter(answer):
     for regex, sub in answer_regex_filter:
         answer = regex.sub(sub, answer)
     return answer
 
 
+async def run_fake_gateway(shard_ids, shard_count, guild_count, rounds):
+    from fakes import FakeGateway
+    try:
+        if metrics_server is not None:
+            await metrics_server.start()
+        await start_timers()
+        gateway = FakeGateway(bot, shard_ids, shard_count)
+        await gateway.run(guild_count, rounds)
+    finally:
+        await shutdown()
+    if gateway.errors:
+        sys.exit(1)
+
+
 def main():
     parser = ArgumentParser()
     parser.add_argument('--token', '-t', type=str, dest='token')
     parser.add_argument('--database-type', '-d', type=str, dest='db_type')
     parser.add_argument('--database-uri', '-u', type=str, dest='db_uri')
+    parser.add_argument('--question-database', '-q', type=str, dest='question_db')
+    parser.add_argument('--pool-size', type=int, dest='pool_size')
+    parser.add_argument('--answer-strictness', choices=strictness_levels, dest='answer_strictness')
+    parser.add_argument('--journal', action='store_true', dest='journal',
+                        help='record game events in a journal instead of rewriting the state (sqlite only)')
+    parser.add_argument('--game-ttl', type=float, dest='game_ttl',
+                        help='days after which games without activity are removed, 0 keeps them')
+    parser.add_argument('--expired-games', choices=['archive', 'delete'], dest='expired_games')
+    parser.add_argument('--crawl-interval', type=float, dest='crawl_interval',
+                        help='seconds between the pages of the jservice category index crawler, 0 disables it')
+    parser.add_argument('--answer-time', type=int, dest='answer_time',
+                        help='seconds to answer a chosen question, 0 lets questions stay open')
+    parser.add_argument('--steal-time', type=int, dest='steal_time',
+                        help='seconds in which everyone can answer after the time to answer ran out, 0 skips it')
+    parser.add_argument('--guild-queue-size', type=int, dest='guild_queue_size', default=default_queue_size)
+    parser.add_argument('--metrics-port', type=int, dest='metrics_port')
+    parser.add_argument('--metrics-host', type=str, dest='metrics_host', default='127.0.0.1')
+    parser.add_argument('--workers', '-w', type=int, dest='workers')
+    parser.add_argument('--shard-count', type=int, dest='shard_count')
+    parser.add_argument('--shard-ids', type=str, dest='shard_ids')
+    parser.add_argument('--fake-guilds', type=int, dest='fake_guilds', default=0)
+    parser.add_argument('--fake-rounds', type=int, dest='fake_rounds', default=10)
     parser.add_argument('--verbose', '-v', action='count', default=0)
 
     args = parser.parse_args()
@@ -324,11 +648,21 @@ def main():
     else:
         db_uri = args.db_uri
 
+    if not args.question_db:
+        question_db = os.getenv('QUESTION_DB')
+    else:
+        question_db = args.question_db
+
     if not args.token:
         token = os.getenv('DISCORD_TOKEN')
     else:
         token = args.token
 
+    if args.pool_size is None:
+        pool.size = int(os.getenv('POOL_SIZE', default_pool_size))
+    else:
+        pool.size = args.pool_size
+
     if args.verbose == 1:
         level = logging.INFO
     elif args.verbose >= 2:
@@ -338,18 +672,68 @@ def main():
 
     logging.basicConfig(level=level)
 
-    global db
+    workers = args.workers if args.workers is not None else int(os.getenv('WORKERS', 1))
+    shard_count = args.shard_count or int(os.getenv('SHARD_COUNT', 0)) or None
+    if workers > 1 and args.shard_ids is None:
+        from runner import Supervisor, worker_arguments
+        asyncio.run(Supervisor(workers, shard_count or workers, worker_arguments(sys.argv[1:])).run())
+        return
+
+    shard_ids = [int(s) for s in args.shard_ids.split(',')] if args.shard_ids else None
+    if shard_count:
+        bot.shard_count = shard_count
+    if shard_ids is not None:
+        bot.shard_ids = shard_ids
+
+    global db, state, guild_actors, histories, sweeper, crawler, timers, media_uploads, metrics_server, \
+        answer_strictness, answer_time, steal_time
+    answer_strictness = args.answer_strictness or os.getenv('ANSWER_STRICTNESS', default_strictness)
+    answer_time = args.answer_time if args.answer_time is not None \
+        else int(os.getenv('ANSWER_TIME', default_answer_time))
+    steal_time = args.steal_time if args.steal_time is not None else int(os.getenv('STEAL_TIME', default_steal_time))
+
     if db_type.lower() == 'mongodb':
         from mongo import MongoInstance
         db = MongoInstance(db_uri)
     elif db_type.lower() == 'sqlite':
         from sqlite import SQLiteInstance
-        db = SQLiteInstance(db_uri)
+        db = SQLiteInstance(db_uri, journal=args.journal or os.getenv('JOURNAL', '').lower() in ('1', 'true'))
     else:
         logging.error('Unknown database type {}'.format(db_type))
         sys.exit(1)
 
-    bot.run(token)
+    if db_type.lower() == 'sqlite' and not question_db:
+        DatabaseGame.question_bank = db
+    else:
+        from sqlite import SQLiteInstance
+        DatabaseGame.question_bank = SQLiteInstance(question_db or 'games.db')
+    JeopardyGame.category_index = DatabaseGame.question_bank
+    media_uploads = MediaUploads(DatabaseGame.question_bank)
+
+    state = GameStateCache(db)
+    guild_actors = GuildActors(state, args.guild_queue_size)
+    histories = GuildHistories(db)
+    timers = TimerScheduler(question_timeout)
+    # all shards share the databases, so only the worker with the first shard expires games and crawls jservice
+    if not shard_ids or 0 in shard_ids:
+        game_ttl = args.game_ttl if args.game_ttl is not None \
+            else float(os.getenv('GAME_TTL', default_game_ttl / 86400))
+        expired_games = args.expired_games or os.getenv('EXPIRED_GAMES', 'archive')
+        sweeper = IdleGameSweeper(state, game_ttl * 86400, expired_games == 'archive')
+        crawl_interval = args.crawl_interval if args.crawl_interval is not None \
+            else float(os.getenv('CRAWL_INTERVAL', default_crawl_interval))
+        crawler = CategoryIndexCrawler(DatabaseGame.question_bank, crawl_interval)
+    register_gauges()
+
+    metrics_port = args.metrics_port if args.metrics_port is not None else int(os.getenv('METRICS_PORT', 0))
+    if metrics_port:
+        # every worker of a supervisor serves its own metrics on the following ports
+        metrics_server = metrics.MetricsServer(args.metrics_host, metrics_port + (shard_ids[0] if shard_ids else 0))
+
+    if args.fake_guilds:
+        asyncio.run(run_fake_gateway(shard_ids, shard_count or 1, args.fake_guilds, args.fake_rounds))
+    else:
+        bot.run(token)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+from collections import OrderedDict
+
+from storage import StaleGameError
+
+default_max_size = 1000
+default_flush_interval = 2
+default_game_ttl = 30 * 24 * 3600
+default_sweep_interval = 3600
+
+
+class GameStateCache:
+    def __init__(self, db, max_size=default_max_size, flush_interval=default_flush_interval):
+        self.db = db
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.games = OrderedDict()
+        self.dirty = set()
+        # evicted games that are not written yet, so a failed write is retried and a reload doesn't miss them
+        self.unwritten = dict()
+        self.flush_task = None
+        self.flush_waiting = False
+        self.closed = False
+        self.evictions = set()
+
+    async def get_game(self, guild_id):
+        if guild_id in self.games:
+            self.games.move_to_end(guild_id)
+            return self.games[guild_id]
+        if guild_id in self.unwritten:
+            self.put(guild_id, self.unwritten[guild_id])
+            return self.games[guild_id]
+
+        game_data = await self.db.get_game(guild_id)
+        if guild_id not in self.games:
+            self.put(guild_id, game_data)
+        return self.games[guild_id]
+
+    async def save_game(self, guild_id, game_data):
+        self.put(guild_id, game_data)
+        self.dirty.add(guild_id)
+        self.schedule_flush()
+
+    async def delete_game(self, guild_id):
+        self.put(guild_id, None)
+        self.dirty.discard(guild_id)
+        self.unwritten.pop(guild_id, None)
+        await self.db.delete_game(guild_id)
+
+    def discard(self, guild_ids):
+        # games that were changed since they were stored aren't idle
+        for guild_id in guild_ids:
+            if guild_id not in self.dirty:
+                self.games.pop(guild_id, None)
+
+    def put(self, guild_id, game_data):
+        self.games[guild_id] = game_data
+        self.games.move_to_end(guild_id)
+        self.unwritten.pop(guild_id, None)
+
+        while len(self.games) > self.max_size:
+            evicted, evicted_data = self.games.popitem(last=False)
+            if evicted in self.dirty:
+                self.unwritten[evicted] = evicted_data
+                task = asyncio.get_running_loop().create_task(self.write(evicted, evicted_data))
+                self.evictions.add(task)
+                task.add_done_callback(self.evictions.discard)
+            logging.debug('evicted game state of guild {} from cache'.format(evicted))
+
+    def schedule_flush(self):
+        if self.closed:
+            return
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.get_running_loop().create_task(self.delayed_flush())
+
+    async def delayed_flush(self):
+        # games saved or failed while a flush is writing are flushed by the next round
+        while self.dirty and not self.closed:
+            self.flush_waiting = True
+            try:
+                await asyncio.sleep(self.flush_interval)
+            finally:
+                self.flush_waiting = False
+            await self.flush()
+
+    async def flush(self):
+        dirty, self.dirty = self.dirty, set()
+        await asyncio.gather(*[self.write(guild_id, self.games[guild_id] if guild_id in self.games
+                                          else self.unwritten[guild_id])
+                               for guild_id in dirty if guild_id in self.games or guild_id in self.unwritten])
+        if dirty:
+            logging.debug('flushed game state of {} guilds'.format(len(dirty)))
+
+    async def write(self, guild_id, game_data):
+        self.dirty.discard(guild_id)
+        try:
+            await self.db.save_game(guild_id, game_data)
+        except StaleGameError as e:
+            # the stored game wins, the guild loads it again with its next command
+            logging.warning('dropped game state of guild {}: {}'.format(guild_id, e))
+            if self.games.get(guild_id) is game_data:
+                del self.games[guild_id]
+            if self.unwritten.get(guild_id) is game_data:
+                del self.unwritten[guild_id]
+        except Exception:
+            logging.exception('could not save game state of guild {}'.format(guild_id))
+            self.dirty.add(guild_id)
+            self.schedule_flush()
+        else:
+            if self.unwritten.get(guild_id) is game_data:
+                del self.unwritten[guild_id]
+
+    async def close(self):
+        self.closed = True
+        if self.flush_task is not None:
+            # a flush that already took the dirty games has to finish, the final flush doesn't see them anymore
+            if self.flush_waiting:
+                self.flush_task.cancel()
+            await asyncio.gather(self.flush_task, return_exceptions=True)
+        await asyncio.gather(*self.evictions)
+        await self.flush()
+
+
+class IdleGameSweeper:
+    """Removes or archives the stored games of guilds that didn't play for longer than the time to live.
+
+    It also removes old journal events, which are kept for a limited time even if games never expire.
+    """
+
+    def __init__(self, state, ttl=default_game_ttl, archive=True, interval=default_sweep_interval):
+        self.state = state
+        self.ttl = ttl
+        self.archive = archive
+        self.interval = interval
+        self.task = None
+        self.expired = 0
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        while True:
+            try:
+                if self.ttl:
+                    await self.sweep()
+                await self.prune()
+            except Exception:
+                logging.exception('could not expire idle games')
+            await asyncio.sleep(self.interval)
+
+    async def sweep(self):
+        # the storage expires a limited batch at a time, so a large backlog is worked off without blocking it
+        while True:
+            expired = await self.state.db.expire_games(self.ttl, self.archive)
+            self.state.discard(expired)
+            self.expired += len(expired)
+            if not expired:
+                return
+            await asyncio.sleep(0)
+
+    async def prune(self):
+        while await self.state.db.prune_events():
+            await asyncio.sleep(0)
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
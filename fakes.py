@@ -0,0 +1,283 @@
+import asyncio
+import itertools
+import logging
+import random
+import time
+
+from jeopardy import supported_values, category_count, categories_url, category_url
+
+join_emoji = '\U0001f3ae'
+
+
+class FakeUser:
+    def __init__(self, user_id, name, bot=False):
+        self.id = user_id
+        self.name = name
+        self.display_name = name
+        self.bot = bot
+
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+
+
+class FakeAttachment:
+    def __init__(self, url):
+        self.url = url
+
+
+class FakeMessage:
+    ids = itertools.count(1)
+
+    def __init__(self, channel, author, content, attachments=()):
+        self.id = next(FakeMessage.ids)
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.attachments = list(attachments)
+        self.reactions = list()
+        self.edits = 0
+        self.pinned = False
+
+    async def add_reaction(self, emoji):
+        self.reactions.append(emoji)
+
+    async def edit(self, content=None, **kwargs):
+        self.content = content
+        self.edits += 1
+
+    async def pin(self):
+        self.pinned = True
+
+    async def unpin(self):
+        self.pinned = False
+
+
+class FakeReaction:
+    def __init__(self, message, emoji):
+        self.message = message
+        self.emoji = emoji
+
+
+class FakeChannel:
+    def __init__(self, guild, bot_user):
+        self.id = guild.id
+        self.guild = guild
+        self.bot_user = bot_user
+        self.sent = list()
+
+    async def send(self, content=None, file=None, **kwargs):
+        attachments = list()
+        if file is not None:
+            attachments.append(FakeAttachment('https://cdn.example/{}/{}/{}'.format(self.id, len(self.sent),
+                                                                                   file.filename)))
+        message = FakeMessage(self, self.bot_user, content, attachments)
+        self.sent.append(message)
+        return message
+
+
+class FakeContext:
+    def __init__(self, channel, author, content, attachments=()):
+        self.guild = channel.guild
+        self.channel = channel
+        self.author = author
+        self.message = FakeMessage(channel, author, content, attachments)
+        self.command = None
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+    async def trigger_typing(self):
+        pass
+
+
+def shard_for(guild_id, shard_count):
+    return (guild_id >> 22) % shard_count
+
+
+class FakeGateway:
+    """Drives scripted games into the bot's handlers instead of connecting to Discord.
+
+    Like the real gateway, it only delivers events of guilds that belong to the given shards.
+    """
+
+    def __init__(self, bot, shard_ids=None, shard_count=1, data_source='db', seed=None):
+        self.bot = bot
+        self.shard_ids = set(range(shard_count) if shard_ids is None else shard_ids)
+        self.shard_count = shard_count
+        self.data_source = data_source
+        self.random = random.Random(seed)
+        self.bot_user = FakeUser(0, 'TriviCord', bot=True)
+        self.commands = 0
+        self.errors = 0
+        self.latencies = list()
+
+    def guilds(self, count, first=0):
+        guild_ids = ((i << 22) | 1 for i in range(first, first + count))
+        return [FakeGuild(g) for g in guild_ids if shard_for(g, self.shard_count) in self.shard_ids]
+
+    async def invoke(self, channel, author, name, *args, attachments=()):
+        content = ' '.join(['!' + name, *map(str, args)])
+        ctx = FakeContext(channel, author, content, attachments)
+        ctx.command = self.bot.get_command(name)
+        self.commands += 1
+        started = time.perf_counter()
+        await self.dispatch('command', ctx)
+        try:
+            await ctx.command.callback(ctx, *args)
+        except Exception as e:
+            self.errors += 1
+            logging.exception('fake command {} failed in guild {}'.format(content, channel.guild.id))
+            await self.dispatch('command_error', ctx, e)
+        else:
+            await self.dispatch('command_completion', ctx)
+        self.latencies.append(time.perf_counter() - started)
+        return ctx
+
+    async def dispatch(self, event, *args):
+        handler = getattr(self.bot, 'on_' + event, None)
+        if handler is not None:
+            await handler(*args)
+
+    async def react(self, message, user, added=True):
+        event = self.bot.on_reaction_add if added else self.bot.on_reaction_remove
+        self.commands += 1
+        try:
+            await event(FakeReaction(message, join_emoji), user)
+        except Exception:
+            self.errors += 1
+            logging.exception('fake reaction failed in guild {}'.format(message.guild.id))
+
+    async def play(self, guild, rounds, end=True):
+        channel = FakeChannel(guild, self.bot_user)
+        players = [FakeUser(guild.id * 10 + i, 'player{}'.format(i)) for i in range(1, 4)]
+
+        await self.invoke(channel, players[0], 'start', self.data_source)
+        board = next((m for m in reversed(channel.sent) if join_emoji in m.reactions), None)
+        await self.invoke(channel, players[0], 'enter')
+        if board is not None:
+            await self.react(board, players[1])
+            await self.react(board, players[2])
+            await self.react(board, players[2], added=False)
+
+        cells = [(c, v) for c in range(1, category_count + 1) for v in supported_values]
+        for player, (category, value) in zip(itertools.cycle(players[:2]), self.random.sample(cells, k=rounds)):
+            await self.invoke(channel, player, 'choose', category, value)
+            await self.invoke(channel, player, 'answer', self.random.choice(['something', 'nothing', 'what']))
+            if self.random.random() < 0.2:
+                await self.invoke(channel, player, 'objection')
+            await self.invoke(channel, player, 'points')
+
+        await self.invoke(channel, players[0], 'board')
+        if end:
+            await self.invoke(channel, players[0], 'end')
+        return channel
+
+    async def run(self, guild_count, rounds=10, end=True, first=0, concurrency=None):
+        guilds = self.guilds(guild_count, first)
+        semaphore = asyncio.Semaphore(concurrency or len(guilds) or 1)
+        rounds = min(rounds, category_count * len(supported_values))
+
+        async def play(guild):
+            async with semaphore:
+                await self.play(guild, rounds, end)
+
+        started = time.monotonic()
+        await asyncio.gather(*(play(guild) for guild in guilds))
+        elapsed = max(time.monotonic() - started, 1e-9)
+        logging.info('fake gateway for shards {} played {} guilds: {} commands, {} errors ({:.0f} commands/s)'.format(
+            sorted(self.shard_ids), len(guilds), self.commands, self.errors, self.commands / elapsed))
+        return guilds
+
+
+class FakeQuestionApi:
+    """Serves generated questions in the format of the jService and Open Trivia DB apis."""
+
+    difficulties = ('easy', 'medium', 'hard')
+
+    def __init__(self, category_count=1000, host='127.0.0.1', port=0, seed=0, trivia_count=10, missing=(),
+                 short=()):
+        self.category_count = category_count
+        # jservice categories that answer with 404
+        self.missing = set(missing)
+        self.trivia_count = trivia_count
+        # trivia categories without hard questions
+        self.short = set(short)
+        self.host = host
+        self.port = port
+        self.seed = seed
+        self.runner = None
+        self.requests = 0
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(self.host, self.port)
+
+    def jservice_category(self, category_id):
+        rng = random.Random(self.seed * 1000003 + category_id)
+        # like in jservice, some categories miss a value
+        values = supported_values if rng.random() > 0.2 else rng.sample(supported_values, len(supported_values) - 1)
+        clues = [{'id': category_id * 100 + i, 'question': 'Question {} of category {}'.format(i, category_id),
+                  'answer': 'answer {}'.format(rng.randint(1, 1000)), 'value': value,
+                  'invalid_count': None if rng.random() > 0.05 else 1}
+                 for i, value in enumerate(values * 2)]
+        return {'id': category_id, 'title': 'category {}'.format(category_id), 'clues_count': len(clues),
+                'clues': clues}
+
+    async def handle(self, request):
+        from aiohttp import web
+
+        self.requests += 1
+        query = request.query
+        if request.path == '/api/categories':
+            offset, count = int(query.get('offset', 0)), int(query.get('count', 1))
+            ids = range(offset + 1, min(offset + count, self.category_count) + 1)
+            return web.json_response([{k: v for k, v in self.jservice_category(i).items() if k != 'clues'}
+                                      for i in ids])
+        if request.path == '/api/category':
+            if int(query['id']) in self.missing:
+                return web.json_response({}, status=404)
+            return web.json_response(self.jservice_category(int(query['id'])))
+        if request.path == '/api_category.php':
+            return web.json_response({'trivia_categories': [{'id': i, 'name': 'trivia {}'.format(i)}
+                                                            for i in range(9, 9 + self.category_count)]})
+        if request.path == '/api_token.php':
+            return web.json_response({'response_code': 0, 'token': 'fake'})
+        if request.path == '/api_count.php':
+            return web.json_response({'category_id': int(query['category']),
+                                      'category_question_count': {'total_question_count': self.trivia_count}})
+        if request.path == '/api.php':
+            category, difficulty = int(query['category']), query.get('difficulty', 'easy')
+            if category in self.short and difficulty == 'hard':
+                # opentdb answers with code 1 when it has fewer questions than asked for
+                return web.json_response({'response_code': 1, 'results': []})
+            return web.json_response({'response_code': 0, 'results': [
+                {'category': 'trivia {}'.format(category), 'type': 'multiple', 'difficulty': difficulty,
+                 'question': 'Trivia question {} ({}) of category {}'.format(i, difficulty, category),
+                 'correct_answer': 'right {}'.format(i), 'incorrect_answers': ['wrong a', 'wrong b', 'wrong c']}
+                for i in range(min(int(query.get('amount', 1)), self.trivia_count))]})
+        return web.json_response({}, status=404)
+
+    async def start(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get('/{tail:.*}', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = self.runner.addresses[0][1]
+
+    def patch_urls(self):
+        categories_url['JeopardyGame'] = self.url + '/api/categories?count={count}&offset={offset}'
+        category_url['JeopardyGame'] = self.url + '/api/category?id={id}'
+        categories_url['TriviaGame'] = self.url + '/api_category.php'
+        category_url['TriviaGame'] = self.url + '/api.php?amount={amount}&category={category_id}' \
+                                                '&difficulty={difficulty}'
+
+    async def close(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
@@ -0,0 +1,92 @@
+import asyncio
+import hashlib
+import logging
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+import metrics
+
+default_timeout = 10
+default_retries = 3
+default_concurrency = 8
+retry_status_codes = {429, 500, 502, 503, 504}
+
+
+class FetchError(ConnectionError):
+    pass
+
+
+class Fetcher:
+    def __init__(self, concurrency=default_concurrency, timeout=default_timeout, retries=default_retries,
+                 backoff=0.5):
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.session = None
+
+    async def get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self.session
+
+    async def get_json(self, url):
+        return await self.request(url, lambda r: r.json(content_type=None))
+
+    async def get_text(self, url):
+        return await self.request(url, lambda r: r.text())
+
+    async def get_bytes(self, url, max_bytes):
+        async def read(response):
+            digest = hashlib.sha256()
+            data = bytearray()
+            async for chunk in response.content.iter_chunked(1 << 14):
+                data += chunk
+                digest.update(chunk)
+                if len(data) > max_bytes:
+                    raise ValueError('response from {} is larger than {} bytes'.format(url, max_bytes))
+            return bytes(data), digest.hexdigest()
+
+        return await self.request(url, read)
+
+    async def request(self, url, read):
+        session = await self.get_session()
+        source = urlsplit(url).hostname
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.semaphore:
+                    started = time.perf_counter()
+                    async with session.get(url) as response:
+                        logging.debug('made web request to {} ({})'.format(url, response.status))
+                        metrics.upstream_requests_total.inc(source=source, status=response.status)
+                        if response.status <= 399:
+                            data = await read(response)
+                            metrics.upstream_seconds.observe(time.perf_counter() - started, source=source)
+                            return data
+                        if response.status not in retry_status_codes:
+                            raise FetchError('request to {} failed with status {}'.format(url, response.status))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.debug('web request to {} failed: {!r}'.format(url, e))
+                metrics.upstream_requests_total.inc(source=source, status='error')
+                if attempt == self.retries:
+                    raise FetchError('request to {} failed: {!r}'.format(url, e)) from e
+
+            if attempt < self.retries:
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+
+        raise FetchError('request to {} failed after {} retries'.format(url, self.retries))
+
+    async def gather_json(self, urls, return_exceptions=False):
+        return await asyncio.gather(*[self.get_json(url) for url in urls], return_exceptions=return_exceptions)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+fetcher = Fetcher()
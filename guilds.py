@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from collections import deque
+
+default_queue_size = 20
+
+
+class GuildBusy(Exception):
+    pass
+
+
+class GuildSession:
+    __slots__ = ('data', 'changed', 'deleted', 'replaced')
+
+    def __init__(self, data):
+        self.data = data
+        self.changed = False
+        self.deleted = False
+        # a game saved after the previous one was deleted in the same batch, e.g. by !end and !start
+        self.replaced = False
+
+    def save(self, data=None):
+        if data is not None:
+            self.data = data
+        self.changed = True
+        self.replaced = self.replaced or self.deleted
+        self.deleted = False
+
+    def delete(self):
+        self.data = None
+        self.changed = False
+        self.deleted = True
+
+
+class GuildActors:
+    """Runs the commands of a guild one after another, while different guilds run in parallel.
+
+    Commands that arrive while a guild is busy are handled in one batch and their changes are persisted once.
+    A guild with too many waiting commands gets GuildBusy instead of a longer queue.
+    """
+
+    def __init__(self, state, queue_size=default_queue_size):
+        self.state = state
+        self.queue_size = queue_size
+        self.queues = dict()
+        self.workers = dict()
+        self.rejected = 0
+
+    async def submit(self, guild_id, handler):
+        queue = self.queues.get(guild_id)
+        if queue is None:
+            queue = self.queues[guild_id] = deque()
+            self.workers[guild_id] = asyncio.get_running_loop().create_task(self.run(guild_id, queue))
+        elif len(queue) >= self.queue_size:
+            self.rejected += 1
+            raise GuildBusy(guild_id)
+
+        future = asyncio.get_running_loop().create_future()
+        queue.append((handler, future))
+        return await future
+
+    async def run(self, guild_id, queue):
+        try:
+            while queue:
+                await self.run_batch(guild_id, queue)
+        finally:
+            del self.queues[guild_id]
+            del self.workers[guild_id]
+
+    async def run_batch(self, guild_id, queue):
+        done = list()
+        try:
+            session = GuildSession(await self.state.get_game(guild_id))
+            while queue and len(done) < self.queue_size:
+                handler, future = queue.popleft()
+                try:
+                    done.append((future, await handler(session), None))
+                except Exception as e:
+                    done.append((future, None, e))
+
+            # the stored game is removed before a new one is saved, so its board is written instead of kept
+            if session.deleted or session.replaced:
+                await self.state.delete_game(guild_id)
+            if session.changed:
+                await self.state.save_game(guild_id, session.data)
+        except Exception as e:
+            logging.exception('could not run the commands of guild {}'.format(guild_id))
+            done = [(future, None, e) for future, _, _ in done]
+            done.extend((future, None, e) for _, future in queue)
+            queue.clear()
+
+        for future, result, error in done:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    async def close(self):
+        await asyncio.gather(*self.workers.values(), return_exceptions=True)
@@ -0,0 +1,170 @@
+import asyncio
+import functools
+import hashlib
+import logging
+import math
+import struct
+from collections import OrderedDict
+
+from answers import normalize
+
+initial_capacity = 256
+error_rate = 0.01
+max_filters = 4
+default_cache_size = 1000
+# the same clues are hashed when a board is drawn, compared with a history and played
+clue_key_cache_size = 4096
+
+header = struct.Struct('<BB')
+filter_header = struct.Struct('<IIBI')
+format_version = 1
+
+
+@functools.lru_cache(maxsize=clue_key_cache_size)
+def clue_key(question, answer):
+    return hashlib.blake2b('{}\n{}'.format(normalize(question), normalize(answer)).encode(), digest_size=16).digest()
+
+
+class BloomFilter:
+    __slots__ = ('capacity', 'count', 'hashes', 'bits')
+
+    def __init__(self, capacity, error, count=0, hashes=None, bits=None):
+        size = math.ceil(-capacity * math.log(error) / math.log(2) ** 2)
+        self.capacity = capacity
+        self.count = count
+        self.hashes = hashes or max(1, round(size / capacity * math.log(2)))
+        self.bits = bits if bits is not None else bytearray((size + 7) // 8)
+
+    def positions(self, key):
+        first, second = struct.unpack('<QQ', key)
+        size = len(self.bits) * 8
+        return ((first + i * second) % size for i in range(self.hashes))
+
+    def __contains__(self, key):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self.positions(key))
+
+    def add(self, key):
+        for p in self.positions(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def full(self):
+        return self.count >= self.capacity
+
+
+class ClueHistory:
+    """Remembers the clues a guild has seen in a scalable bloom filter.
+
+    Every filter holds twice as many clues as the one before with half the error rate, so the error rate of the whole
+    history stays below error_rate. When max_filters are full, the oldest one is dropped and its clues can come again,
+    which bounds the size of a history to about 16 kB.
+    """
+
+    __slots__ = ('filters', 'changed')
+
+    def __init__(self, filters=None):
+        self.filters = filters or list()
+        self.changed = False
+
+    def __contains__(self, key):
+        return any(key in f for f in self.filters)
+
+    def add(self, key):
+        if key in self:
+            return
+        if not self.filters or self.filters[-1].full():
+            if len(self.filters) >= max_filters:
+                self.filters.pop(0)
+            capacity = min(self.filters[-1].capacity * 2, initial_capacity << (max_filters - 1)) \
+                if self.filters else initial_capacity
+            self.filters.append(BloomFilter(capacity, error_rate / 2 ** (len(self.filters) + 1)))
+        self.filters[-1].add(key)
+        self.changed = True
+
+    def add_clue(self, clue):
+        self.add(clue_key(clue.question, clue.answer))
+
+    def seen(self, game):
+        return sum(1 for clue in game.clues.values() if clue_key(clue.question, clue.answer) in self)
+
+    def dump(self):
+        parts = [header.pack(format_version, len(self.filters))]
+        for f in self.filters:
+            parts.append(filter_header.pack(f.capacity, f.count, f.hashes, len(f.bits)))
+            parts.append(bytes(f.bits))
+        return b''.join(parts)
+
+    @classmethod
+    def load(cls, data):
+        version, count = header.unpack_from(data)
+        if version != format_version:
+            raise ValueError('unsupported clue history version {}'.format(version))
+        offset = header.size
+        filters = list()
+        for _ in range(count):
+            capacity, clue_count, hashes, size = filter_header.unpack_from(data, offset)
+            offset += filter_header.size
+            bits = bytearray(data[offset:offset + size])
+            filters.append(BloomFilter(capacity, error_rate, clue_count, hashes, bits))
+            offset += size
+        return cls(filters)
+
+
+class GuildHistories:
+    """Keeps the clue histories of recently active guilds in memory and writes changed ones back to the storage."""
+
+    def __init__(self, db, max_size=default_cache_size):
+        self.db = db
+        self.max_size = max_size
+        self.histories = OrderedDict()
+        self.writes = set()
+
+    async def get(self, guild_id):
+        history = self.histories.get(guild_id)
+        if history is None:
+            data = await self.db.get_history(guild_id)
+            history = self.histories.get(guild_id)
+            if history is None:
+                history = ClueHistory.load(data) if data else ClueHistory()
+                self.put(guild_id, history)
+        self.histories.move_to_end(guild_id)
+        return history
+
+    def put(self, guild_id, history):
+        self.histories[guild_id] = history
+        while len(self.histories) > self.max_size:
+            evicted, evicted_history = self.histories.popitem(last=False)
+            if evicted_history.changed:
+                self.schedule(self.write(evicted, evicted_history))
+
+    def schedule(self, coroutine):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self.writes.add(task)
+        task.add_done_callback(self.writes.discard)
+
+    async def record(self, guild_id, clue):
+        (await self.get(guild_id)).add_clue(clue)
+
+    async def save(self, guild_id):
+        history = self.histories.get(guild_id)
+        if history is not None and history.changed:
+            await self.write(guild_id, history)
+
+    async def write(self, guild_id, history):
+        history.changed = False
+        try:
+            await self.db.save_history(guild_id, history.dump())
+        except Exception:
+            logging.exception('could not save the clue history of guild {}'.format(guild_id))
+            history.changed = True
+
+    async def reset(self, guild_id):
+        self.histories.pop(guild_id, None)
+        # a write of the evicted history must not store it again after the delete
+        await asyncio.gather(*self.writes)
+        await self.db.delete_history(guild_id)
+
+    async def close(self):
+        await asyncio.gather(*[self.write(guild_id, history) for guild_id, history in self.histories.items()
+                               if history.changed])
+        await asyncio.gather(*self.writes)
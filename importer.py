@@ -0,0 +1,195 @@
+import csv
+import itertools
+import json
+import logging
+import os
+import re
+import time
+from argparse import ArgumentParser
+from collections import OrderedDict
+
+from sqlite import SQLiteInstance
+
+import_category_offset = 2000000
+default_batch_size = 5000
+default_commit_size = 100000
+category_cache_size = 10000
+read_size = 1 << 16
+csv_delimiters = ',;\t'
+
+value_regex = re.compile(r'[^0-9]')
+
+field_names = {
+    'category': ('category', 'category_name', 'title'),
+    'question': ('question', 'clue'),
+    'answer': ('answer', 'correct_answer', 'response'),
+    'value': ('value', 'clue_value', 'points')
+}
+
+
+def sniff_delimiter(f):
+    sample = f.read(read_size)
+    f.seek(0)
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=csv_delimiters).delimiter
+    except csv.Error:
+        return ','
+
+
+def read_csv(path, delimiter=None):
+    with open(path, newline='', encoding='utf-8') as f:
+        # the custom game format uses semicolons, most dumps commas
+        reader = csv.reader(f, delimiter=delimiter or sniff_delimiter(f))
+        first = next(reader, [])
+        header = [h.strip().lower() for h in first]
+        if all(any(name in header for name in names) for names in field_names.values()):
+            columns = {field: next(header.index(n) for n in names if n in header)
+                       for field, names in field_names.items()}
+            rows = reader
+        else:
+            # files without a header use the custom game format Category;Question;Answer;Value
+            columns = {'category': 0, 'question': 1, 'answer': 2, 'value': 3}
+            rows = itertools.chain([first], reader)
+
+        width = max(columns.values())
+        for row in rows:
+            yield {field: row[i] for field, i in columns.items()} if len(row) > width else None
+
+
+def read_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_json(path):
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8') as f:
+        buffer = f.read(read_size).lstrip()
+        if not buffer.startswith('['):
+            raise ValueError('{} does not contain a json array'.format(path))
+        buffer = buffer[1:]
+
+        while True:
+            buffer = buffer.lstrip().lstrip(',').lstrip()
+            if buffer.startswith(']'):
+                return
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                chunk = f.read(read_size)
+                if not chunk:
+                    raise
+                buffer += chunk
+                continue
+            yield item
+            buffer = buffer[end:]
+
+
+def normalize_row(row):
+    if not isinstance(row, dict):
+        return None
+    fields = dict()
+    for field, names in field_names.items():
+        fields[field] = next((row[n] for n in names if row.get(n) not in (None, '')), None)
+    if None in fields.values():
+        return None
+
+    value = value_regex.sub('', str(fields['value']))
+    if not value:
+        return None
+    return str(fields['category']).strip(), str(fields['question']).strip(), str(fields['answer']).strip(), int(value)
+
+
+class QuestionImporter:
+    def __init__(self, bank, batch_size=default_batch_size, commit_size=default_commit_size):
+        self.bank = bank
+        self.batch_size = batch_size
+        self.commit_size = commit_size
+        self.categories = OrderedDict()
+        self.read = 0
+        self.inserted = 0
+        self.skipped = 0
+
+    def category_id(self, name):
+        if name in self.categories:
+            self.categories.move_to_end(name)
+        else:
+            self.categories[name] = self.bank.find_category(name, import_category_offset)
+            if len(self.categories) > category_cache_size:
+                self.categories.popitem(last=False)
+        return self.categories[name]
+
+    def run(self, rows):
+        started = time.monotonic()
+        batch = list()
+        uncommitted = 0
+
+        with self.bank.conn:
+            for row in rows:
+                self.read += 1
+                row = normalize_row(row)
+                if row is None:
+                    self.skipped += 1
+                    continue
+
+                category, question, answer, value = row
+                batch.append((self.category_id(category), question, answer, value))
+
+                if len(batch) >= self.batch_size:
+                    self.inserted += self.bank.insert_questions(batch)
+                    uncommitted += len(batch)
+                    batch.clear()
+                    if uncommitted >= self.commit_size:
+                        self.bank.conn.commit()
+                        uncommitted = 0
+                    self.report(started)
+
+            if batch:
+                self.inserted += self.bank.insert_questions(batch)
+
+        self.report(started)
+
+    def report(self, started):
+        elapsed = max(time.monotonic() - started, 1e-9)
+        logging.info('read {} rows, inserted {}, duplicates {}, skipped {} ({:.0f} rows/s)'.format(
+            self.read, self.inserted, self.read - self.inserted - self.skipped, self.skipped, self.read / elapsed))
+
+
+def read_rows(path, file_format, delimiter):
+    if file_format == 'auto':
+        file_format = os.path.splitext(path)[1].lstrip('.').lower()
+    if file_format == 'csv':
+        return read_csv(path, delimiter)
+    if file_format == 'json':
+        return read_json(path)
+    if file_format == 'jsonl':
+        return read_jsonl(path)
+    raise ValueError('unknown file format {}'.format(file_format))
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--database', '-d', type=str, dest='database', default='games.db')
+    parser.add_argument('--format', '-f', choices=['auto', 'csv', 'json', 'jsonl'], default='auto', dest='format')
+    parser.add_argument('--delimiter', type=str, help='csv delimiter, detected from the file by default')
+    parser.add_argument('--batch-size', type=int, dest='batch_size', default=default_batch_size)
+    parser.add_argument('--commit-size', type=int, dest='commit_size', default=default_commit_size)
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    bank = SQLiteInstance(args.database)
+    try:
+        for path in args.files:
+            logging.info('importing {}'.format(path))
+            QuestionImporter(bank, args.batch_size, args.commit_size).run(read_rows(path, args.format, args.delimiter))
+    finally:
+        bank.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,11 @@
-import sqlite3
+from sqlite import SQLiteInstance
 
-with sqlite3.connect('games.db') as conn:
-    cur = conn.cursor()
+bank = SQLiteInstance('games.db')
 
-    for c in range(5):
-        cur.execute('insert into categories values (?, ?)', (c, 'Category ' + str(c)))
+for c in range(5):
+    bank.save_category(c, 'Category ' + str(c))
+    bank.save_questions(c, [{'question': 'Question category {}, value {}'.format(c, value),
+                             'answer': 'Answer category {}, value {}'.format(c, value), 'value': value}
+                            for value in range(200, 1200, 200)])
 
-        for value in range(200, 1200, 200):
-            insert = (value + c, 'Question category {}, value {}'.format(c, value),
-                      'Answer category {}, value {}'.format(c, value), value, c)
-            cur.execute('insert into questions values (?, ?, ?, ?, null, null, ?)', insert)
-    conn.commit()
+bank.close()
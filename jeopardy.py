@@ -1,12 +1,15 @@
+import asyncio
 import csv
 import html
+import io
 import logging
 import random
+from collections import OrderedDict
 
-import requests
-from tabulate import tabulate
-
-import sqlite
+from answers import AnswerKey, default_strictness
+from board import BoardRenderer, answered_cell
+from fetch import fetcher
+from history import clue_key
 
 categories_url = {
     'JeopardyGame': 'https://jservice.io/api/categories?count={count}&offset={offset}',
@@ -23,173 +26,397 @@ category_url = {
 
 category_count = 5
 supported_values = [200, 400, 600, 800, 1000]
+# without a category index, boards are built from random pages of the jservice category list,
+# fetching only as many categories per round as are still missing
+jservice_page_size = 20
+jservice_max_rounds = 5
+# opentdb returns fewer questions than asked for when a category has too few of a difficulty,
+# such categories are replaced by other random ones for a limited number of rounds
+trivia_max_rounds = 3
+# clues drawn from the question bank per category and value, to find one a guild hasn't seen
+database_candidates = 5
+
+custom_max_bytes = 256 * 1024
+custom_max_rows = 5000
+custom_cache_size = 32
+custom_cache = OrderedDict()
+
+trivia_options = '\nPossible answers:\n'
+
+
+def trivia_clue(clue, value):
+    answers = clue['incorrect_answers'] + [clue['correct_answer']]
+
+    # shuffled the same way every time, so a question that is fetched again keeps its text
+    random.Random(clue['question']).shuffle(answers)
+
+    question = clue['question'] + trivia_options
+    question += '\n'.join(['  - {}'.format(a) for a in answers])
+
+    return {'question': html.unescape(question), 'answer': html.unescape(clue['correct_answer']), 'value': value}
+
+
+def jservice_clues(clues):
+    # one valid clue per supported value, a category is complete if it has all of them
+    clue_list = list()
+    for clue in clues:
+        if clue['value'] in supported_values \
+                and clue['value'] not in [c['value'] for c in clue_list] \
+                and not clue['invalid_count']:
+            clue_list.append(clue)
+    clue_list.sort(key=lambda c: c['value'])
+    return clue_list
+
+
+async def fetch_jservice_categories(ids, index=None):
+    """Fetches jservice categories and returns the complete ones, recording which are complete in the index."""
+    results = await fetcher.gather_json([category_url['JeopardyGame'].format(id=i) for i in ids],
+                                        return_exceptions=True)
+
+    # a category that can't be fetched doesn't stop the others, it is indexed as failed and fetched again later
+    failed = [i for i, result in zip(ids, results) if isinstance(result, BaseException)]
+    for i in failed:
+        logging.debug('could not fetch jservice category {}'.format(i))
+    full_categories = [result for result in results if not isinstance(result, BaseException)]
+
+    categories = list()
+    for full_category in full_categories:
+        full_category['clues'] = jservice_clues(full_category['clues'])
+        if len(full_category['clues']) == len(supported_values):
+            categories.append(full_category)
+            logging.debug('added category {}'.format(full_category['title']))
+        else:
+            logging.debug('skipped category {}'.format(full_category['title']))
+
+    if index is not None:
+        complete = {c['id'] for c in categories}
+        await index.run(index.mark_jservice_categories,
+                        [(c['id'], c['id'] in complete) for c in full_categories] + [(i, None) for i in failed])
+    return categories
+
+
+class Clue:
+    __slots__ = ('question', 'answer', 'value', 'key', 'media')
+
+    def __init__(self, question, answer, value, media=None):
+        self.question = question
+        self.answer = answer
+        self.value = value
+        self.key = AnswerKey(answer)
+        # the id of the question bank row that holds the image or sound of the clue
+        self.media = media
+
+    def dump(self):
+        document = {'question': self.question, 'answer': self.answer, 'value': self.value}
+        if self.media is not None:
+            document['media'] = self.media
+        return document
 
 
 class Game(object):
-    def __init__(self, game_id):
+    __slots__ = ('id', 'titles', 'clues', 'answered', 'current', 'board')
 
-        class_name = self.__class__.__name__
-        self.categories_url = categories_url[class_name]
-        self.category_url = category_url[class_name]
+    def __init__(self, game_id):
         self.id = game_id
-        self.categories = list()
-        self.get_new_categories()
-        self.current_clue = None
-        self.current_category = 0
-        self.current_category_clue = (0, 0)
-        self.answered_clue_values = list()
-        self.board = list()
-
-        for i in range(0, len(self.categories)):
-            self.board.append(list())
-            for _ in range(0, len(supported_values)):
-                self.board[i].append(str(supported_values[i]))
-
-    def get_new_categories(self):
-        pass
+        self.titles = ()
+        self.clues = dict()
+        self.answered = 0
+        self.current = None
+        self.board = None
 
-    def get_new_question(self, category, value):
-        self.current_category = self.categories[category]
-        for i in range(0, len(self.current_category['clues'])):
-            if value == self.current_category['clues'][i]['value']:
-                self.current_category_clue = (category, i)
-                self.current_clue = self.current_category['clues'][i]
+    @property
+    def categories_url(self):
+        return categories_url[self.__class__.__name__]
+
+    @property
+    def category_url(self):
+        return category_url[self.__class__.__name__]
+
+    @property
+    def current_clue(self):
+        return self.clues[self.current] if self.current else None
+
+    @classmethod
+    async def create(cls, game_id, *args, history=None, **kwargs):
+        game = cls(game_id, *args, **kwargs)
+        game.load_categories(await game.get_new_categories(history))
+        return game
+
+    def load_categories(self, categories):
+        self.titles = tuple(c['title'] for c in categories)
+        self.clues = {(i, clue['value']): Clue(clue['question'], clue['answer'], clue['value'], clue.get('media'))
+                      for i, category in enumerate(categories) for clue in category['clues']}
+        self.board = BoardRenderer(self.titles, supported_values)
+
+    async def get_new_categories(self, history=None):
+        return list()
 
-        return self.current_clue['question']
+    def bit(self, category, value):
+        return 1 << (category * len(supported_values) + supported_values.index(value))
+
+    def has_clue(self, category, value):
+        return (category, value) in self.clues
+
+    def is_answered(self, category, value):
+        return bool(self.answered & self.bit(category, value))
+
+    def get_new_question(self, category, value):
+        self.current = (category, value)
+        return self.clues[self.current].question
 
     def get_answer(self):
-        self.board[self.current_category_clue[1]][self.current_category_clue[0]] = '----'
-        self.answered_clue_values.append((self.current_category_clue[0], self.current_clue['value']))
-        return self.current_clue['answer']
+        category, value = self.current
+        self.answered |= self.bit(category, value)
+        self.board.set_cell(category, supported_values.index(value), answered_cell)
+        return self.clues[self.current].answer
+
+    def check_answer(self, answer, strictness=default_strictness):
+        return self.clues[self.current].key.matches(answer, strictness)
+
+    def dump_board(self):
+        return {'kind': self.__class__.__name__,
+                'categories': [{'title': title,
+                                'clues': [self.clues[(i, v)].dump() for v in supported_values]}
+                               for i, title in enumerate(self.titles)]}
+
+    def dump_state(self):
+        # the set bits in board order, which is the order the journal keeps answered clues in
+        answered, bits, count = list(), self.answered, len(supported_values)
+        while bits:
+            bit = (bits & -bits).bit_length() - 1
+            answered.append([bit // count, supported_values[bit % count]])
+            bits &= bits - 1
+        return {'answered': answered,
+                'current': [self.current[0], supported_values.index(self.current[1])] if self.current else None}
+
+    @staticmethod
+    def restore(game_id, board, state):
+        cls = game_classes[board['kind']]
+        game = cls.__new__(cls)
+        Game.__init__(game, game_id)
+        game.load_categories(board['categories'])
+
+        for category, value in state['answered']:
+            game.current = (category, value)
+            game.get_answer()
+
+        if state['current']:
+            category, index = state['current']
+            game.current = (category, board['categories'][category]['clues'][index]['value'])
+        else:
+            game.current = None
+
+        return game
+
+    def __setstate__(self, state):
+        # games pickled before the slotted model keep their attributes in a dict
+        if isinstance(state, tuple):
+            state = dict(state[0] or {}, **state[1])
+        Game.__init__(self, state['id'])
+        self.load_categories(state['categories'])
+        for category, value in state['answered_clue_values']:
+            self.current = (category, value)
+            self.get_answer()
+        if state['current_clue']:
+            self.current = (state['current_category_clue'][0], state['current_clue']['value'])
+        else:
+            self.current = None
 
     def get_board(self):
-        titles = ["{}. {}".format(self.categories.index(c) + 1, c['title']) for c in self.categories]
-
-        return tabulate(self.board, headers=titles, disable_numparse=True)
+        return self.board.render()
 
 
 class JeopardyGame(Game):
-
-    def get_new_categories(self):
-        while len(self.categories) < category_count:
-            r_cat = requests.get(
-                self.categories_url.format(count=category_count - len(self.categories),
-                                           offset=random.randint(1, 500)))
-            logging.debug('made web request')
-
-            if r_cat.status_code <= 399:
-                data = r_cat.json()
-
-                for category in data:
-                    r = requests.get(self.category_url.format(id=category['id']))
-                    if r.status_code <= 399:
-                        full_category = r.json()
-
-                        clue_list = list()
-
-                        for clue in full_category['clues']:
-                            if clue['value'] in supported_values \
-                                    and clue['value'] not in [c['value'] for c in clue_list] \
-                                    and not clue['invalid_count']:
-                                clue_list.append(clue)
-
-                        clue_list.sort(key=lambda c: c['value'])
-                        full_category['clues'] = clue_list
-
-                        if len(full_category['clues']) == len(supported_values):
-                            self.categories.append(full_category)
-                            logging.debug('added category', full_category['title'])
-                        else:
-                            logging.debug('skipped category', full_category['title'])
-                    else:
-                        raise ConnectionError()
-            else:
-                raise ConnectionError()
+    __slots__ = ()
+    # a question bank that knows which jservice categories are complete
+    category_index = None
+
+    async def get_new_categories(self, history=None):
+        index = self.category_index
+        categories = list()
+        if index is not None:
+            ids = await index.run(index.draw_jservice_categories, category_count)
+            if len(ids) == category_count:
+                categories = await fetch_jservice_categories(ids, index)
+
+        candidates = list()
+        for _ in range(jservice_max_rounds):
+            if len(categories) >= category_count:
+                break
+            if not candidates:
+                data = await fetcher.get_json(self.categories_url.format(count=jservice_page_size,
+                                                                         offset=random.randint(1, 500)))
+                # categories with fewer clues than values can't be complete, so they aren't fetched
+                short = {c['id'] for c in data
+                         if c.get('clues_count', len(supported_values)) < len(supported_values)}
+                if index is not None and short:
+                    await index.run(index.mark_jservice_categories, [(i, False) for i in short])
+                known = {c['id'] for c in categories}
+                candidates = [c['id'] for c in data if c['id'] not in known and c['id'] not in short]
+
+            needed = category_count - len(categories)
+            ids, candidates = candidates[:needed], candidates[needed:]
+            categories.extend(await fetch_jservice_categories(ids, index))
+
+        if len(categories) < category_count:
+            raise LookupError('found only {} complete jservice categories'.format(len(categories)))
+        return categories
 
 
 class TriviaGame(Game):
+    __slots__ = ()
     category_config = {
         'easy': 2,
         'medium': 2,
         'hard': 1
     }
 
-    def get_new_categories(self):
-
-        r = requests.get(self.categories_url)
-        if r.status_code <= 399:
-            categories = r.json()['trivia_categories']
-            categories = random.sample(categories, k=category_count)
-            categories.sort(key=lambda e: e['id'])
-            for category in categories:
-                category['clues'] = list()
-                logging.debug('adding category', category['name'])
-                category['title'] = category['name']
-                for diff in TriviaGame.category_config.keys():
-                    cr = requests.get(self.category_url.format(category_id=category['id'],
-                                                               amount=TriviaGame.category_config[diff],
-                                                               difficulty=diff))
-                    cr_data = cr.json()
-                    for clue in cr_data['results']:
-                        value = supported_values[len(category['clues'])]
+    async def get_new_categories(self, history=None):
+        candidates = (await fetcher.get_json(self.categories_url))['trivia_categories']
+        candidates = random.sample(candidates, k=len(candidates))
+
+        categories = list()
+        for _ in range(trivia_max_rounds):
+            needed = category_count - len(categories)
+            if not needed or not candidates:
+                break
+            batch, candidates = candidates[:needed], candidates[needed:]
+            categories.extend(c for c in await self.fetch_categories(batch)
+                              if [clue['value'] for clue in c['clues']] == supported_values)
+
+        if len(categories) < category_count:
+            raise LookupError('found only {} complete trivia categories'.format(len(categories)))
+        categories.sort(key=lambda e: e['id'])
+        return categories
 
-                        answers = clue['incorrect_answers']
-                        answers.append(clue['correct_answer'])
+    async def fetch_categories(self, categories):
+        urls = [self.category_url.format(category_id=category['id'], amount=amount, difficulty=diff)
+                for category in categories for diff, amount in TriviaGame.category_config.items()]
+        results = iter(await fetcher.gather_json(urls))
 
-                        random.shuffle(answers)
+        for category in categories:
+            category['clues'] = list()
+            category['title'] = category['name']
+            for _ in TriviaGame.category_config:
+                cr_data = next(results)
+                for clue in cr_data['results'][:len(supported_values) - len(category['clues'])]:
+                    category['clues'].append(trivia_clue(clue, supported_values[len(category['clues'])]))
+            if len(category['clues']) == len(supported_values):
+                logging.debug('adding category {}'.format(category['name']))
+            else:
+                logging.debug('skipped category {} with {} questions'.format(category['name'], len(category['clues'])))
+        return categories
 
-                        question = clue['question'] + '\n'
-                        question += 'Possible answers:\n'
-                        question += '\n'.join(['  - {}'.format(a) for a in answers])
 
-                        category['clues'].append(
-                            {'question': html.unescape(question), 'answer': html.unescape(clue['correct_answer']),
-                             'value': value})
-                self.categories.append(category)
+class DatabaseGame(Game):
+    __slots__ = ()
+    question_bank = None
 
+    async def get_new_categories(self, history=None):
+        candidates = database_candidates if history is not None else 1
+        categories = await self.question_bank.run(self.question_bank.draw_board, category_count, candidates)
+        if len(categories) < category_count:
+            raise LookupError('the question bank has only {} complete categories'.format(len(categories)))
 
-class DatabaseGame(Game):
-    def get_new_categories(self):
-        categories = random.sample(sqlite.get_categories(), k=category_count)
-        categories.sort(key=lambda e: e['id'])
         for category in categories:
-            for value in supported_values:
-                clue = random.choice(sqlite.get_questions(category['id'], value))
-                category['clues'].append(clue)
-            self.categories.append(category)
+            clues = category['clues']
+            # the first clue of every value the guild hasn't seen, or any if it has seen them all
+            category['clues'] = [next((c for c in clues if c['value'] == value
+                                       and (history is None or clue_key(c['question'], c['answer']) not in history)),
+                                      next(c for c in clues if c['value'] == value))
+                                 for value in supported_values]
+        return categories
+
+
+class CustomQuestionsError(ValueError):
+    def __init__(self, errors):
+        super().__init__('\n'.join(errors))
+        self.errors = errors
+
+
+def parse_custom_questions(text):
+    categories = dict()
+    errors = list()
+
+    reader = csv.reader(io.StringIO(text), delimiter=';')
+    for count, row in enumerate(reader, 1):
+        line = reader.line_num
+        if not any(c.strip() for c in row):
+            continue
+        if count > custom_max_rows:
+            errors.append('the file has more than {} rows'.format(custom_max_rows))
+            break
+        if len(row) != 4:
+            errors.append('line {}: expected 4 columns but found {}'.format(line, len(row)))
+            continue
+
+        title, question, answer, value = (c.strip() for c in row)
+        if not title or not question or not answer:
+            errors.append('line {}: category, question and answer must not be empty'.format(line))
+            continue
+        if not value.isdigit() or int(value) not in supported_values:
+            errors.append('line {}: value must be one of {}'.format(line, ', '.join(map(str, supported_values))))
+            continue
+
+        clues = categories.setdefault(title, dict())
+        clues.setdefault(int(value), list()).append({'question': question, 'answer': answer, 'value': int(value)})
+
+    complete = {title: clues for title, clues in categories.items() if len(clues) == len(supported_values)}
+    if not errors and len(complete) < category_count:
+        errors.append('at least {} categories need a question for every value, found {}'.format(category_count,
+                                                                                                len(complete)))
+    if errors:
+        raise CustomQuestionsError(errors)
+
+    return complete
 
 
 class CustomGame(Game):
+    __slots__ = ('csv_attachment_url',)
 
     def __init__(self, game_id, csv_attachment_url):
         self.csv_attachment_url = csv_attachment_url
         super().__init__(game_id)
 
-    def get_new_categories(self):
-        request_data = requests.get(self.csv_attachment_url)
-        if request_data.status_code <= 399:
-
-            csv_data = request_data.text.strip().split('\n')
-
-            rows = csv.reader(csv_data, delimiter=';')
-
-            csv_list = [r for r in rows]
-
-            categories = [r[0] for r in csv_list]
-            categories = random.sample(list(dict.fromkeys(categories)), k=category_count)
-            categories = [{'title': c, 'clues': list()} for c in categories]
-            categories.sort(key=lambda c: c['title'])
-
-            for category in categories:
-                for q in csv_list:
-                    if q[0] == category['title']:
-                        question = {'question': q[1], 'answer': q[2], 'value': int(q[3])}
-                        category['clues'].append(question)
-                self.categories.append(category)
-
-
-if __name__ == '__main__':
-    j = DatabaseGame(1)
+    async def get_new_categories(self, history=None):
+        try:
+            data, digest = await fetcher.get_bytes(self.csv_attachment_url, custom_max_bytes)
+        except ValueError:
+            raise CustomQuestionsError(['the file is larger than {} kB'.format(custom_max_bytes // 1024)])
+
+        if digest in custom_cache:
+            custom_cache.move_to_end(digest)
+            logging.debug('reusing parsed questions {}'.format(digest))
+        else:
+            try:
+                text = data.decode('utf-8-sig')
+            except UnicodeDecodeError:
+                raise CustomQuestionsError(['the file is not utf-8 encoded'])
+            custom_cache[digest] = parse_custom_questions(text)
+            if len(custom_cache) > custom_cache_size:
+                custom_cache.popitem(last=False)
+
+        categories = custom_cache[digest]
+        titles = random.sample(list(categories), k=len(categories))
+        unseen = categories
+        if history is not None:
+            # categories with the most clues the guild hasn't seen come first, and their unseen clues are used
+            unseen = {title: {value: [c for c in clues if clue_key(c['question'], c['answer']) not in history]
+                              for value, clues in categories[title].items()} for title in titles}
+            titles.sort(key=lambda t: -sum(1 for clues in unseen[t].values() if clues))
+        return [{'title': title, 'clues': [random.choice(unseen[title][value] or categories[title][value])
+                                           for value in supported_values]}
+                for title in sorted(titles[:category_count])]
+
+
+game_classes = {c.__name__: c for c in (JeopardyGame, TriviaGame, DatabaseGame, CustomGame)}
+
+
+async def _main():
+    from sqlite import SQLiteInstance
+
+    DatabaseGame.question_bank = SQLiteInstance('games.db')
+    j = await DatabaseGame.create(1)
 
     print(j.get_new_question(0, 600))
     print(j.get_answer())
@@ -197,3 +424,10 @@ if __name__ == '__main__':
     print(j.get_answer())
 
     print(j.get_board())
+
+    await fetcher.close()
+    DatabaseGame.question_bank.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(_main())
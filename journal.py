@@ -0,0 +1,104 @@
+import copy
+
+from jeopardy import supported_values
+
+# events that change these fields carry their new values in 'set'
+state_fields = ('active_player', 'objection_possible', 'timer')
+
+
+def scalar_changes(old, new):
+    changes = {key: new[key] for key in state_fields if old[key] != new[key]}
+    if old['game']['current'] != new['game']['current']:
+        changes['current'] = new['game']['current']
+    return changes
+
+
+def clue_text(board, clue):
+    category, value = clue
+    clues = board['categories'][category]['clues'] if board is not None else ()
+    found = next((c for c in clues if c['value'] == value), None)
+    return {'question': found['question'], 'answer': found['answer']} if found else {}
+
+
+def game_events(old, new, board=None):
+    """Describes the changes from the state document old to new as a list of (kind, data) events.
+
+    Changes that can't be told apart, like several answers handled in one batch, give a single state event,
+    which means the whole state has to be written as a new snapshot.
+    """
+    events = list()
+    old_players = {p[0]: p for p in old['players']}
+    new_players = {p[0]: p for p in new['players']}
+
+    for player_id, player in new_players.items():
+        if player_id not in old_players:
+            events.append(('join', {'player': player}))
+        elif old_players[player_id][1] != player[1]:
+            events.append(('rename', {'player': player_id, 'name': player[1]}))
+
+    scored = [(player_id, player[2] - old_players[player_id][2]) for player_id, player in new_players.items()
+              if player_id in old_players and player[2] != old_players[player_id][2]]
+    answered = [clue for clue in new['game']['answered'] if clue not in old['game']['answered']]
+    changes = scalar_changes(old, new)
+
+    if len(answered) == 1 and len(scored) <= 1:
+        player_id, points = scored[0] if scored else (old['active_player'], 0)
+        data = {'clue': answered[0], 'player': player_id, 'points': points, 'set': changes}
+        data.update(clue_text(board, answered[0]))
+        events.append(('answer', data))
+    elif not answered and len(scored) == 1:
+        # the clue stays current after it was answered, until the next one is chosen
+        player_id, points = scored[0]
+        current = old['game']['current']
+        clue = [current[0], supported_values[current[1]]] if current else None
+        data = {'clue': clue, 'player': player_id, 'points': points, 'set': changes}
+        if clue is not None:
+            data.update(clue_text(board, clue))
+        events.append(('objection', data))
+    elif answered or scored:
+        return [('state', {})]
+    elif 'current' in changes:
+        events.append(('choose', {'set': changes}))
+    elif changes:
+        events.append(('update', {'set': changes}))
+
+    for player_id in old_players:
+        if player_id not in new_players:
+            events.append(('leave', {'player': player_id}))
+
+    if apply_events(old, events) != new:
+        return [('state', {})]
+    return events
+
+
+def apply_event(state, kind, data):
+    # state events are followed by a snapshot, so they are never replayed
+    if kind == 'join':
+        state['players'].append(list(data['player']))
+    elif kind == 'leave':
+        state['players'] = [p for p in state['players'] if p[0] != data['player']]
+    elif kind == 'rename':
+        for player in state['players']:
+            if player[0] == data['player']:
+                player[1] = data['name']
+    elif kind in ('answer', 'objection'):
+        if kind == 'answer':
+            # answered clues are kept in board order
+            state['game']['answered'] = sorted(state['game']['answered'] + [list(data['clue'])])
+        for player in state['players']:
+            if player[0] == data['player']:
+                player[2] += data['points']
+
+    for key, value in data.get('set', {}).items():
+        if key == 'current':
+            state['game']['current'] = value
+        else:
+            state[key] = value
+    return state
+
+
+def apply_events(state, events):
+    state = copy.deepcopy(state)
+    for kind, data in events:
+        state = apply_event(state, kind, data)
+    return state
@@ -0,0 +1,104 @@
+import asyncio
+import functools
+import logging
+import mimetypes
+import tempfile
+import time
+from collections import OrderedDict
+
+from discord import File
+
+import metrics
+
+# media up to this size is buffered in memory, larger files go to a temporary file
+spool_size = 1024 * 1024
+# discord signs attachment urls for about a day, older uploads are uploaded again
+url_ttl = 20 * 3600
+upload_wait = 5.0
+default_cache_size = 10000
+
+
+class MediaUploads:
+    """Sends the images and sounds of clues from the question bank.
+
+    The first time a media item is sent it is streamed out of the question bank and uploaded with the question. The
+    url of the upload is stored in the question bank under the content hash of the media, so every later question
+    with the same media, in any guild and in any question row, links to it instead of uploading the file again.
+    """
+
+    def __init__(self, bank, max_size=default_cache_size):
+        self.bank = bank
+        self.max_size = max_size
+        # content hashes by question id, and upload urls by content hash
+        self.keys = OrderedDict()
+        self.urls = OrderedDict()
+        self.uploads = dict()
+
+    def remember(self, cache, key, value):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > self.max_size:
+            cache.popitem(last=False)
+
+    async def key(self, media):
+        key = self.keys.get(media)
+        if key is None:
+            key = await self.bank.run(self.bank.media_key, media)
+            self.remember(self.keys, media, key)
+        return key
+
+    async def url(self, key):
+        stored = self.urls.get(key)
+        if stored is None:
+            stored = await self.bank.run(self.bank.load_media_url, key)
+            if stored is not None:
+                self.remember(self.urls, key, stored)
+        if stored is not None and stored[1] > time.time() - url_ttl:
+            return stored[0]
+        return None
+
+    async def open(self, media):
+        target = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        try:
+            mediatype = await self.bank.run(self.bank.copy_media, media, target)
+        except Exception:
+            logging.exception('could not read the media of question {}'.format(media))
+            target.close()
+            return None
+        target.seek(0)
+        extension = mimetypes.guess_extension(mediatype or '') or ''
+        return File(target, filename='clue{}{}'.format(media, extension))
+
+    async def send(self, outbox, channel, content, media):
+        try:
+            key = await self.key(media)
+        except Exception:
+            logging.exception('could not read the media of question {}'.format(media))
+            return await outbox.send(channel, content)
+
+        url = await self.url(key)
+        upload = self.uploads.get(key)
+        if url is None and upload is not None:
+            # the same media chosen in several guilds at once is uploaded only once
+            await asyncio.wait({upload}, timeout=upload_wait)
+            url = await self.url(key)
+        if url is not None:
+            metrics.media_messages.inc(result='linked')
+            return await outbox.send(channel, '{}\n{}'.format(content, url))
+
+        upload = self.uploads[key] = asyncio.get_running_loop().create_future()
+        try:
+            message = await outbox.send(channel, content, attachment=functools.partial(self.open, media))
+            if message is not None and message.attachments:
+                metrics.media_messages.inc(result='uploaded')
+                url, uploaded = message.attachments[0].url, time.time()
+                self.remember(self.urls, key, (url, uploaded))
+                try:
+                    await self.bank.run(self.bank.store_media_url, key, url, uploaded)
+                except Exception:
+                    logging.exception('could not store the upload of question {}'.format(media))
+            return message
+        finally:
+            upload.set_result(None)
+            if self.uploads.get(key) is upload:
+                del self.uploads[key]
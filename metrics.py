@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+size_buckets = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=None):
+    pairs = ['{}="{}"'.format(n, escape(v)) for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) and value != int(value) else str(int(value))
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.values = dict()
+        self.function = None
+
+    def set_function(self, function):
+        # values collected from elsewhere: the function returns the value, or a dict of label tuples to values
+        self.function = function
+
+    def key(self, labels):
+        return tuple(labels[n] for n in self.labels)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} {}'.format(self.name, self.kind)]
+        lines.extend(self.samples())
+        return lines
+
+    def samples(self):
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                logging.exception('could not collect metric {}'.format(self.name))
+                return []
+            self.values = value if isinstance(value, dict) else {(): value}
+        return ['{}{} {}'.format(self.name, format_labels(self.labels, key), format_value(value))
+                for key, value in sorted(self.values.items())]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=latency_buckets):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = [[0] * (len(self.buckets) + 1), 0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        lines = list()
+        for key, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append('{}_bucket{} {}'.format(
+                    self.name, format_labels(self.labels, key, 'le="{}"'.format(bound)), cumulative))
+            lines.append('{}_sum{} {}'.format(self.name, format_labels(self.labels, key), repr(float(total))))
+            lines.append('{}_count{} {}'.format(self.name, format_labels(self.labels, key), count))
+        return lines
+
+    def quantile(self, q, **labels):
+        counts, _, count = self.values.get(self.key(labels), (None, 0, 0))
+        if not count:
+            return None
+        rank = q * count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return bound
+        return float('inf')
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = list()
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = list()
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+command_seconds = registry.register(Histogram(
+    'trivicord_command_seconds', 'Time to handle a command.', ('command',)))
+commands_total = registry.register(Counter(
+    'trivicord_commands_total', 'Handled commands by outcome.', ('command', 'outcome')))
+storage_seconds = registry.register(Histogram(
+    'trivicord_storage_seconds', 'Time of game storage operations.', ('backend', 'operation')))
+storage_bytes = registry.register(Histogram(
+    'trivicord_storage_bytes', 'Serialized size of stored game documents.', ('backend', 'document'),
+    buckets=size_buckets))
+upstream_seconds = registry.register(Histogram(
+    'trivicord_upstream_seconds', 'Latency of question api requests.', ('source',)))
+upstream_requests_total = registry.register(Counter(
+    'trivicord_upstream_requests_total', 'Question api requests by status.', ('source', 'status')))
+active_games = registry.register(Gauge(
+    'trivicord_active_games', 'Games held in the state cache.'))
+guild_queue_rejections = registry.register(Counter(
+    'trivicord_guild_queue_rejections_total', 'Commands rejected because their guild was busy.'))
+outbox_messages = registry.register(Counter(
+    'trivicord_outbox_messages_total', 'Outgoing messages by what happened to them.', ('result',)))
+expired_games = registry.register(Counter(
+    'trivicord_expired_games_total', 'Stored games removed or archived after being idle.'))
+pool_boards = registry.register(Gauge(
+    'trivicord_pool_boards', 'Prebuilt boards waiting in the pool.', ('source',)))
+media_messages = registry.register(Counter(
+    'trivicord_media_messages_total', 'Clue media sent, uploaded or linked to an earlier upload.', ('result',)))
+
+
+class MetricsServer:
+    """Serves the registry in the prometheus text format on every http request."""
+
+    def __init__(self, host, port, registry=registry):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        logging.info('serving metrics on {}:{}'.format(self.host, self.port))
+
+    async def handle(self, reader, writer):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+            if request.split()[1:2] in ([b'/metrics'], [b'/']):
+                status, body = '200 OK', self.registry.render().encode()
+            else:
+                status, body = '404 Not Found', b''
+            writer.write('HTTP/1.1 {}\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {}\r\n'
+                         'Connection: close\r\n\r\n'.format(status, len(body)).encode() + body)
+            await writer.drain()
+        except (ConnectionError, IndexError):
+            pass
+        finally:
+            writer.close()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
@@ -1,65 +1,223 @@
+import logging
 import pickle
+import threading
+import time
+from collections import OrderedDict
 
+import bson
 from bson.binary import Binary, USER_DEFINED_SUBTYPE
-from bson.codec_options import TypeDecoder, CodecOptions, TypeRegistry
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
 
+import metrics
+from state import game_documents, legacy_documents, load_game_data, state_version
+from storage import AsyncStorage, StaleGameError
 
-def fallback_pickle_encoder(value):
-    return Binary(pickle.dumps(value), USER_DEFINED_SUBTYPE)
+stored_cache_size = 10000
+expire_batch_size = 500
 
 
-class PickledBinaryDecoder(TypeDecoder):
-    bson_type = Binary
+def load_pickled(value):
+    if isinstance(value, Binary) and value.subtype == USER_DEFINED_SUBTYPE:
+        return pickle.loads(value)
+    return value
 
-    def transform_bson(self, value):
-        if value.subtype == USER_DEFINED_SUBTYPE:
-            return pickle.loads(value)
-        return value
 
+def state_update(old, new):
+    """Returns the field level update that turns the stored state document old into new."""
+    update = {'$set': dict(), '$inc': dict(), '$addToSet': dict()}
 
-class MongoInstance:
-    def __init__(self, mongodb_uri):
-        codec_options = CodecOptions(
-            type_registry=TypeRegistry([PickledBinaryDecoder()], fallback_encoder=fallback_pickle_encoder))
+    for key in ('active_player', 'objection_possible', 'timer'):
+        if old[key] != new[key]:
+            update['$set']['state.' + key] = new[key]
 
-        self.client = MongoClient(mongodb_uri)
-        self.db = self.client['trivicord']
-        self.collection = self.db.get_collection('games', codec_options=codec_options)
+    if old['game']['current'] != new['game']['current']:
+        update['$set']['state.game.current'] = new['game']['current']
+
+    old_answered, new_answered = old['game']['answered'], new['game']['answered']
+    added = [clue for clue in new_answered if clue not in old_answered]
+    if len(old_answered) + len(added) != len(new_answered):
+        update['$set']['state.game.answered'] = new_answered
+    elif added:
+        update['$addToSet']['state.game.answered'] = {'$each': added}
+
+    old_players, new_players = old['players'], new['players']
+    if [p[0] for p in old_players] != [p[0] for p in new_players]:
+        update['$set']['state.players'] = new_players
+    else:
+        for i, (old_player, new_player) in enumerate(zip(old_players, new_players)):
+            if old_player[1] != new_player[1]:
+                update['$set']['state.players.{}.1'.format(i)] = new_player[1]
+            if old_player[2] != new_player[2]:
+                update['$inc']['state.players.{}.2'.format(i)] = new_player[2] - old_player[2]
+
+    return {operator: fields for operator, fields in update.items() if fields}
+
+
+class MongoInstance(AsyncStorage):
+    executor_workers = 4
+    backend = 'mongodb'
 
-    def get_game(self, game_id):
-        result = self.collection.find_one({'game_id': game_id}, {'_id': 0, 'game_id': 0})
+    def __init__(self, mongodb_uri, client=None):
+        super().__init__()
+        self.client = client or MongoClient(mongodb_uri)
+        self.db = self.client['trivicord']
+        self.collection = self.db.get_collection('games')
+        self.archive = self.db.get_collection('archived_games')
+        self.history = self.db.get_collection('guild_history')
+        # the last written state and revision of each game, used to write only the fields that changed
+        self.stored = OrderedDict()
+        self.stored_lock = threading.Lock()
+        self.create_indexes()
+        # games from before the last activity was recorded get the full time to live from now on
+        self.collection.update_many({'updated': {'$exists': False}}, {'$set': {'updated': time.time()}})
+
+    def migrate_game(self, document):
+        # pickled games are migrated when they are loaded, so startup doesn't depend on how many games were stored
+        board, state = legacy_documents(load_pickled(document['game']))
+        result = self.collection.find_one_and_update({'game_id': document['game_id']},
+                                                     {'$set': {'version': state_version, 'board': board,
+                                                               'state': state},
+                                                      '$unset': {'game': ''}, '$inc': {'rev': 1}},
+                                                     projection={'rev': 1},
+                                                     return_document=ReturnDocument.BEFORE)
+        logging.info('migrated pickled game {} to version {}'.format(document['game_id'], state_version))
+        return {'board': board, 'state': state, 'rev': result.get('rev', 0) + 1 if result else 1}
+
+    def create_indexes(self):
+        if 'game_id_unique' not in self.collection.index_information():
+            self.remove_duplicates()
+            self.collection.create_index('game_id', unique=True, name='game_id_unique')
+        self.collection.create_index('updated', name='updated')
+        self.collection.create_index('state.timer', name='timer', sparse=True)
+        self.history.create_index('guild_id', unique=True, name='guild_id_unique')
+
+    def remove_duplicates(self):
+        duplicates = self.collection.aggregate([
+            {'$group': {'_id': '$game_id', 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+            {'$match': {'count': {'$gt': 1}}}])
+        for duplicate in duplicates:
+            # older versions updated the first document of a game, so that one is kept
+            self.collection.delete_many({'_id': {'$in': duplicate['ids'][1:]}})
+            logging.info('removed {} duplicate documents of game {}'.format(duplicate['count'] - 1, duplicate['_id']))
+
+    def remember(self, game_id, rev, state):
+        with self.stored_lock:
+            self.stored[game_id] = (rev, state)
+            self.stored.move_to_end(game_id)
+            while len(self.stored) > stored_cache_size:
+                self.stored.popitem(last=False)
+
+    def forget(self, game_id):
+        with self.stored_lock:
+            return self.stored.pop(game_id, None)
+
+    def load_game(self, game_id):
+        result = self.collection.find_one({'game_id': game_id},
+                                          {'_id': 0, 'game_id': 1, 'game': 1, 'board': 1, 'state': 1, 'rev': 1})
+        if result and 'game' in result:
+            result = self.migrate_game(result)
         if result:
-            return result['game']
+            # documents of older versions are upgraded on load, so their first save rewrites them completely
+            if result['state']['version'] == state_version:
+                self.remember(game_id, result.get('rev', 0), result['state'])
+            return load_game_data(game_id, result['board'], result['state'])
         else:
             return None
 
-    def save_game(self, game_id, game):
-        ids = [c['game_id'] for c in self.collection.find({}, {'game_id': 1})]
-        if game_id not in ids:
-            self.collection.insert_one({'game_id': game_id, 'game': game})
-        else:
-            self.collection.update_one({'game_id': game_id}, {'$set': {'game': game}})
-
-    def delete_game(self, game_id):
-        self.collection.delete_many({'game_id': game_id})
-
-    def get_games(self):
-        return [(g['game_id'], g['game']) for g in self.collection.find({}, {'_id': 0})]
+    def store_game(self, game_id, board, state):
+        stored = self.forget(game_id)
+
+        if stored is not None:
+            rev, old = stored
+            update = state_update(old, state)
+            if not update:
+                self.remember(game_id, rev, state)
+                return
+            update.setdefault('$inc', dict())['rev'] = 1
+            update.setdefault('$set', dict())['updated'] = time.time()
+            metrics.storage_bytes.observe(len(bson.encode(update)), backend=self.backend, document='update')
+            result = self.collection.find_one_and_update({'game_id': game_id, 'rev': rev}, update,
+                                                         projection={'_id': 0, 'rev': 1},
+                                                         return_document=ReturnDocument.BEFORE)
+            if result is not None:
+                self.remember(game_id, rev + 1, state)
+                return
+            # later writes based on the same revision fail as well, until the game is loaded again
+            self.remember(game_id, rev, old)
+            raise StaleGameError('game {} was changed elsewhere since revision {}'.format(game_id, rev))
+
+        metrics.storage_bytes.observe(len(bson.encode(board)), backend=self.backend, document='board')
+        metrics.storage_bytes.observe(len(bson.encode(state)), backend=self.backend, document='state')
+        result = self.collection.find_one_and_update({'game_id': game_id},
+                                                     {'$set': {'version': state_version, 'board': board,
+                                                               'state': state, 'updated': time.time()},
+                                                      '$inc': {'rev': 1}},
+                                                     projection={'_id': 0, 'rev': 1}, upsert=True,
+                                                     return_document=ReturnDocument.BEFORE)
+        self.remember(game_id, result.get('rev', 0) + 1 if result else 1, state)
+
+    def remove_game(self, game_id):
+        self.forget(game_id)
+        self.collection.delete_one({'game_id': game_id})
+
+    def load_games(self):
+        return [(g['game_id'], self.load_game(g['game_id']))
+                for g in self.collection.find({}, {'_id': 0, 'game_id': 1})]
+
+    def load_deadlines(self):
+        games = self.collection.find({'state.timer': {'$type': 'array'}}, {'_id': 0, 'game_id': 1, 'state.timer': 1})
+        return [(g['game_id'], g['state']['timer'][1]) for g in games]
+
+    def load_history(self, guild_id):
+        result = self.history.find_one({'guild_id': guild_id}, {'_id': 0, 'filter': 1})
+        return bytes(result['filter']) if result else None
+
+    def store_history(self, guild_id, data):
+        metrics.storage_bytes.observe(len(data), backend=self.backend, document='history')
+        self.history.update_one({'guild_id': guild_id}, {'$set': {'filter': Binary(data)}}, upsert=True)
+
+    def remove_history(self, guild_id):
+        self.history.delete_one({'guild_id': guild_id})
+
+    def remove_expired(self, ttl, archive=False):
+        cutoff = time.time() - ttl
+        expired = list(self.collection.find({'updated': {'$lt': cutoff}}, {'_id': 0} if archive else {'game_id': 1},
+                                            limit=expire_batch_size))
+        for document in expired:
+            self.forget(document['game_id'])
+            if archive:
+                document['archived'] = time.time()
+                self.archive.replace_one({'game_id': document['game_id']}, document, upsert=True)
+            # a game that was played in the meantime stays
+            self.collection.delete_one({'game_id': document['game_id'], 'updated': {'$lt': cutoff}})
+        if expired:
+            logging.info('{} {} games idle for more than {} seconds'.format(
+                'archived' if archive else 'removed', len(expired), ttl))
+        return [document['game_id'] for document in expired]
+
+    def close(self):
+        super().close()
+        self.client.close()
 
 
 if __name__ == '__main__':
+    import asyncio
+
     from jeopardy import TriviaGame
+    from players import PlayerRegistry
 
-    game = TriviaGame(1)
+    game_data = {'game': asyncio.run(TriviaGame.create(1)), 'players': PlayerRegistry(), 'active_player': None,
+                 'objection_possible': False, 'timer': None}
 
     mongo = MongoInstance('mongodb://localhost')
 
-    mongo.save_game('1', game)
+    mongo.store_game('1', *game_documents(game_data))
 
-    print(mongo.get_games())
+    print(mongo.load_games())
 
-    for a in mongo.get_games():
+    for a in mongo.load_games():
         print(a)
 
-    # mongo.delete_game_from_db('1')
+    # mongo.remove_game('1')
+
+    mongo.close()
@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from discord import HTTPException
+
+message_limit = 2000
+default_window = 0.5
+sweep_size = 1000
+
+# discord allows about 5 messages per 5 seconds in a channel and 50 requests per second in total
+channel_rate = (5, 5.0)
+global_rate = (50, 1.0)
+
+
+class TokenBucket:
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def delay(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        delay = self.delay()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self.delay()
+        self.tokens -= 1
+
+    def drain(self):
+        self.delay()
+        self.tokens = 0
+
+
+class Outgoing:
+    __slots__ = ('parts', 'key', 'merge', 'board', 'due', 'attachment', 'futures')
+
+    def __init__(self, content, key=None, merge=None, board=False, due=0, attachment=None):
+        self.parts = [content]
+        self.key = key
+        self.merge = merge
+        self.board = board
+        self.due = due
+        # opens the file to upload with the message, every attempt needs a fresh one
+        self.attachment = attachment
+        self.futures = list()
+
+    def plain(self):
+        return not self.board and self.merge is None and self.attachment is None
+
+    def content(self):
+        return self.merge(self.parts) if self.merge else '\n'.join(self.parts)
+
+
+def resolve(futures, message):
+    for future in futures:
+        if not future.done():
+            future.set_result(message)
+
+
+class ChannelQueue:
+    def __init__(self, outbox, channel):
+        self.outbox = outbox
+        self.channel = channel
+        self.bucket = TokenBucket(*outbox.channel_rate)
+        self.pending = deque()
+        self.task = None
+
+    def add(self, outgoing):
+        if outgoing.key is not None:
+            for queued in self.pending:
+                if queued.key == outgoing.key:
+                    if queued.board:
+                        queued.parts = outgoing.parts
+                    else:
+                        queued.parts.extend(outgoing.parts)
+                    self.outbox.coalesced += 1
+                    return queued
+        self.pending.append(outgoing)
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+        return outgoing
+
+    async def run(self):
+        try:
+            while self.pending:
+                delay = self.pending[0].due - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await self.bucket.acquire()
+                await self.outbox.bucket.acquire()
+
+                outgoing = self.pending.popleft()
+                # messages that piled up behind a plain message go out together
+                while outgoing.plain() and self.pending and self.pending[0].plain() \
+                        and self.pending[0].due <= time.monotonic() \
+                        and len(outgoing.content()) + len(self.pending[0].content()) < message_limit:
+                    following = self.pending.popleft()
+                    outgoing.parts.extend(following.parts)
+                    outgoing.futures.extend(following.futures)
+                    self.outbox.coalesced += 1
+
+                message = None
+                try:
+                    message = await self.deliver(outgoing)
+                finally:
+                    resolve(outgoing.futures, message)
+        finally:
+            # command handlers wait for their messages inside the guild's queue, so none may be left waiting
+            while self.pending:
+                resolve(self.pending.popleft().futures, None)
+
+    def drop_boards(self):
+        boards = [outgoing for outgoing in self.pending if outgoing.board]
+        for outgoing in boards:
+            self.pending.remove(outgoing)
+            resolve(outgoing.futures, None)
+
+    def idle(self):
+        return not self.pending and self.bucket.delay() == 0 and self.bucket.tokens >= self.bucket.capacity
+
+    async def deliver(self, outgoing):
+        for attempt in range(2):
+            try:
+                if outgoing.board:
+                    return await self.outbox.show_board(self.channel, outgoing.content())
+                self.outbox.sent += 1
+                if outgoing.attachment is not None:
+                    return await self.channel.send(outgoing.content(), file=await outgoing.attachment())
+                return await self.channel.send(outgoing.content())
+            except HTTPException as e:
+                if e.status == 429 and attempt == 0:
+                    logging.warning('rate limited in channel {}'.format(self.channel.id))
+                    self.bucket.drain()
+                    await self.bucket.acquire()
+                    continue
+                logging.exception('could not send message to channel {}'.format(self.channel.id))
+                return None
+            except Exception:
+                # e.g. a connection reset, the message is lost but the messages behind it are still sent
+                logging.exception('could not send message to channel {}'.format(self.channel.id))
+                return None
+
+
+class Outbox:
+    """Queues the messages of the bot per channel and paces them to stay within discord's rate limits.
+
+    Messages with the same key that are sent within the coalescing window are merged into one message,
+    and board updates edit the board message of the channel instead of sending a new one.
+    """
+
+    def __init__(self, window=default_window, channel_rate=channel_rate, global_rate=global_rate):
+        self.window = window
+        self.channel_rate = channel_rate
+        self.bucket = TokenBucket(*global_rate)
+        self.channels = dict()
+        self.boards = dict()
+        self.unpins = set()
+        self.sweep_at = sweep_size
+        self.sent = 0
+        self.edited = 0
+        self.coalesced = 0
+
+    def queue(self, channel, outgoing):
+        queue = self.channels.get(channel.id)
+        if queue is None:
+            if len(self.channels) >= self.sweep_at:
+                self.sweep()
+            queue = self.channels[channel.id] = ChannelQueue(self, channel)
+        future = asyncio.get_running_loop().create_future()
+        queue.add(outgoing).futures.append(future)
+        return future
+
+    def sweep(self):
+        # queues are kept until their rate limit bucket has refilled, so a new queue can't exceed the limit
+        for channel_id in [c for c, queue in self.channels.items() if queue.idle()]:
+            del self.channels[channel_id]
+        self.sweep_at = max(sweep_size, len(self.channels) * 2)
+
+    def send(self, channel, content, key=None, merge=None, attachment=None):
+        due = time.monotonic() + self.window if key is not None else 0
+        return self.queue(channel, Outgoing(content, key, merge, due=due, attachment=attachment))
+
+    def update_board(self, channel, content, new=False):
+        if new:
+            self.forget_board(channel)
+            return self.queue(channel, Outgoing(content, board=True))
+        return self.queue(channel, Outgoing(content, key='board', board=True, due=time.monotonic() + self.window))
+
+    def forget_board(self, channel):
+        # updates of the old game that are still queued would send and pin its board again
+        queue = self.channels.get(channel.id)
+        if queue is not None:
+            queue.drop_boards()
+        message = self.boards.pop(channel.id, None)
+        if message is not None:
+            # a channel can only have 50 pinned messages
+            task = asyncio.get_running_loop().create_task(self.unpin(message))
+            self.unpins.add(task)
+            task.add_done_callback(self.unpins.discard)
+
+    async def unpin(self, message):
+        await self.bucket.acquire()
+        try:
+            await message.unpin()
+        except HTTPException:
+            logging.debug('could not unpin the board message in channel {}'.format(message.channel.id))
+
+    async def show_board(self, channel, content):
+        message = self.boards.get(channel.id)
+        if message is not None:
+            try:
+                await message.edit(content=content)
+                self.edited += 1
+                return message
+            except HTTPException as e:
+                if e.status == 429:
+                    raise
+                logging.debug('board message in channel {} is gone, sending a new one'.format(channel.id))
+
+        message = await channel.send(content)
+        self.sent += 1
+        self.boards[channel.id] = message
+        try:
+            await message.pin()
+        except HTTPException:
+            logging.debug('could not pin the board message in channel {}'.format(channel.id))
+        return message
+
+    async def close(self):
+        await asyncio.gather(*(queue.task for queue in list(self.channels.values()) if queue.task),
+                             *self.unpins, return_exceptions=True)
@@ -0,0 +1,89 @@
+from bisect import bisect_left, insort
+
+
+class Player:
+    __slots__ = ('id', 'name', 'points', 'seq')
+
+    def __init__(self, player_id, name, points, seq):
+        self.id = player_id
+        self.name = name
+        self.points = points
+        self.seq = seq
+
+    def rank_key(self):
+        return -self.points, self.seq
+
+
+class PlayerRegistry:
+    def __init__(self):
+        self.players = dict()
+        self.ranking = list()
+        self.next_seq = 0
+
+    def __len__(self):
+        return len(self.players)
+
+    def __contains__(self, player_id):
+        return player_id in self.players
+
+    def __iter__(self):
+        return iter(self.players.values())
+
+    def get(self, player_id):
+        return self.players.get(player_id)
+
+    def identify(self, player_id, name, username=None):
+        player = self.players.get(player_id)
+        if player is None and username is not None and isinstance(self.players.get(username), Player):
+            # players stored before ids were known are keyed by their discord username, not their nickname
+            player = self.players.pop(username)
+            player.id = player_id
+            self.players[player_id] = player
+            self.ranking[self.position(player)] = (player.rank_key(), player_id)
+        if player is not None:
+            player.name = name
+        return player
+
+    def add(self, player_id, name, points=0):
+        if player_id in self.players:
+            return None
+        player = Player(player_id, name, points, self.next_seq)
+        self.next_seq += 1
+        self.players[player_id] = player
+        insort(self.ranking, (player.rank_key(), player_id))
+        return player
+
+    def remove(self, player_id):
+        player = self.players.pop(player_id, None)
+        if player is not None:
+            del self.ranking[self.position(player)]
+        return player
+
+    def add_points(self, player_id, points):
+        player = self.players.get(player_id)
+        if player is None:
+            return None
+        del self.ranking[self.position(player)]
+        player.points += points
+        insort(self.ranking, (player.rank_key(), player_id))
+        return player.points
+
+    def position(self, player):
+        return bisect_left(self.ranking, (player.rank_key(),))
+
+    def rank(self, player_id):
+        return self.position(self.players[player_id]) + 1
+
+    def top(self, count=None):
+        ranking = self.ranking if count is None else self.ranking[:count]
+        return [self.players[player_id] for _, player_id in ranking]
+
+    def dump(self):
+        return [[p.id, p.name, p.points] for p in self.players.values()]
+
+    @classmethod
+    def load(cls, rows):
+        registry = cls()
+        for player_id, name, points in rows:
+            registry.add(player_id, name, points)
+        return registry
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+
+default_pool_size = 2
+default_ttl = 60 * 60
+refill_retry_delay = 30
+# boards built for a guild that has seen some of their clues before a board is taken anyway
+history_attempts = 3
+
+
+class BoardPool:
+    def __init__(self, size=default_pool_size, ttl=default_ttl):
+        self.size = size
+        self.ttl = ttl
+        self.factories = dict()
+        self.boards = dict()
+        self.refills = dict()
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def register(self, source, factory):
+        self.factories[source] = factory
+        self.boards[source] = deque()
+
+    def start(self):
+        for source in self.factories:
+            self.refill(source)
+
+    async def get(self, source, game_id, history=None):
+        self.expire(source)
+        game = self.take(source, history)
+
+        if game is not None:
+            game.id = game_id
+            self.hits[source] += 1
+        else:
+            self.misses[source] += 1
+            game = await self.build(source, game_id, history)
+
+        logging.debug('board pool {}: {}'.format(source, self.stats()[source]))
+        self.refill(source)
+        return game
+
+    def take(self, source, history):
+        # the first board without clues the guild has already seen, boards that don't fit stay for other guilds
+        boards = self.boards[source]
+        for i, (_, game) in enumerate(boards):
+            if history is None or not history.seen(game):
+                del boards[i]
+                return game
+        return None
+
+    async def build(self, source, game_id, history):
+        best, best_seen = None, None
+        for _ in range(history_attempts if history is not None else 1):
+            game = await self.factories[source](game_id, history=history)
+            seen = history.seen(game) if history is not None else 0
+            if best is None or seen < best_seen:
+                if best is not None and len(self.boards[source]) < self.size:
+                    self.boards[source].append((time.monotonic(), best))
+                best, best_seen = game, seen
+            elif len(self.boards[source]) < self.size:
+                self.boards[source].append((time.monotonic(), game))
+            if not best_seen:
+                break
+        return best
+
+    def refill(self, source):
+        if self.size <= 0:
+            return
+        task = self.refills.get(source)
+        if task is None or task.done():
+            self.refills[source] = asyncio.get_running_loop().create_task(self._refill(source))
+
+    async def _refill(self, source):
+        boards = self.boards[source]
+        while len(boards) < self.size:
+            try:
+                game = await self.factories[source](None)
+            except LookupError as e:
+                # e.g. an empty question bank, the next board built on demand starts another refill
+                logging.debug('stopped refilling the {} pool: {}'.format(source, e))
+                return
+            except Exception:
+                logging.exception('could not build a board for the {} pool'.format(source))
+                await asyncio.sleep(refill_retry_delay)
+                continue
+            boards.append((time.monotonic(), game))
+            self.expire(source)
+
+    def expire(self, source):
+        boards = self.boards[source]
+        now = time.monotonic()
+        while boards and now - boards[0][0] > self.ttl:
+            boards.popleft()
+
+    def stats(self):
+        return {source: {'size': len(self.boards[source]), 'hits': self.hits[source], 'misses': self.misses[source]}
+                for source in self.factories}
+
+    async def close(self):
+        for task in self.refills.values():
+            task.cancel()
+        await asyncio.gather(*self.refills.values(), return_exceptions=True)
+        self.refills.clear()
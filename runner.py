@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import os
+import signal
+import sys
+import time
+
+bot_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot.py')
+restart_delay = 5
+max_restart_delay = 300
+
+
+def worker_arguments(argv):
+    args = list()
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in ('--workers', '--shard-count', '--shard-ids'):
+            skip = True
+        elif not arg.startswith(('--workers=', '--shard-count=', '--shard-ids=')):
+            args.append(arg)
+    return args
+
+
+class Supervisor:
+    """Runs the bot in several worker processes that each own a fixed subset of the shards.
+
+    Discord delivers the events of a guild to exactly one shard, so every guild is served by exactly one worker
+    and the workers never share a game. Workers that crash are restarted with an increasing delay.
+    """
+
+    def __init__(self, worker_count, shard_count, worker_args):
+        self.worker_count = worker_count
+        self.shard_count = max(shard_count, worker_count)
+        self.worker_args = worker_args
+        self.processes = dict()
+        self.restarts = 0
+        self.stopping = False
+        self.stopped = None
+
+    def shard_ids(self, worker):
+        return list(range(worker, self.shard_count, self.worker_count))
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+        try:
+            await asyncio.gather(*(self.supervise(worker) for worker in range(self.worker_count)))
+        finally:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(sig)
+
+    async def supervise(self, worker):
+        delay = restart_delay
+        shard_ids = ','.join(map(str, self.shard_ids(worker)))
+
+        while not self.stopping:
+            started = time.monotonic()
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, bot_path, *self.worker_args,
+                '--shard-count', str(self.shard_count), '--shard-ids', shard_ids)
+            self.processes[worker] = process
+            logging.info('started worker {} (pid {}) for shards {}'.format(worker, process.pid, shard_ids))
+
+            code = await process.wait()
+            del self.processes[worker]
+            if self.stopping or code == 0:
+                logging.info('worker {} exited with {}'.format(worker, code))
+                return
+
+            if time.monotonic() - started > max_restart_delay:
+                delay = restart_delay
+            logging.warning('worker {} exited with {}, restarting in {}s'.format(worker, code, delay))
+            self.restarts += 1
+            try:
+                await asyncio.wait_for(self.stopped.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            delay = min(delay * 2, max_restart_delay)
+
+    def stop(self):
+        self.stopping = True
+        self.stopped.set()
+        for process in self.processes.values():
+            if process.returncode is None:
+                process.terminate()
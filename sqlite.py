@@ -1,68 +1,501 @@
+import hashlib
+import html
+import json
+import logging
 import pickle
+import re
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
 
+import metrics
+from jeopardy import supported_values, trivia_options
+from journal import apply_event, game_events
+from state import legacy_documents, load_game_data, encode, decode, state_version, \
+    upgrade
+from storage import AsyncStorage
 
-class SQLiteInstance:
-    def __init__(self, database_name):
+tag_regex = re.compile(r'<[^>]+>')
+word_regex = re.compile(r'\w+')
+
+snapshot_interval = 50
+journal_cache_size = 10000
+journal_retention = 30 * 24 * 3600
+expire_batch_size = 500
+media_chunk_size = 64 * 1024
+# jservice categories that could not be fetched are fetched again by the crawler after this delay
+jservice_retry_delay = 24 * 3600
+
+
+def question_key(question):
+    # trivia questions are keyed without their answer options
+    question = (question or '').split(trivia_options)[0]
+    return ' '.join(word_regex.findall(tag_regex.sub(' ', html.unescape(question)).lower()))
+
+
+def timer_deadline(game):
+    # works for game data and state documents alike
+    return game['timer'][1] if game['timer'] else None
+
+
+class SQLiteInstance(AsyncStorage):
+    backend = 'sqlite'
+
+    def __init__(self, database_name, journal=False):
+        super().__init__()
         self.db = database_name
-        with sqlite3.connect(self.db) as conn:
+        self.journal = journal
+        # the last event id, snapshot event id and state of each journaled game
+        self.heads = OrderedDict()
+        self.heads_lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db, check_same_thread=False)
+        self.conn.execute('pragma journal_mode = wal')
+        self.conn.execute('pragma synchronous = normal')
+        self.conn.create_function('question_key', 1, question_key, deterministic=True)
+        with self.conn as conn:
             cur = conn.cursor()
-            cur.execute('create table if not exists games (guild int primary key, game_data blob)')
+            cur.execute('create table if not exists games (guild int primary key, game_data blob,'
+                        + ' version int, board text, state text)')
             cur.execute('create table if not exists categories (id int primary key, name text)')
-            cur.execute('create table if not exists questions (id int, question text,'
-                        + ' answer text, value int, media blob, mediatype text, category_id int)')
-            conn.commit()
+            cur.execute('create table if not exists sync_state (source text primary key, cursor text)')
+            cur.execute('create table if not exists jservice_categories (id integer primary key, complete int,'
+                        + ' checked real)')
+            cur.execute('create index if not exists jservice_categories_complete'
+                        + ' on jservice_categories (complete) where complete')
+            cur.execute('create table if not exists game_events (id integer primary key, guild int, kind text,'
+                        + ' data text, time real)')
+            cur.execute('create index if not exists game_events_guild on game_events (guild, id)')
+            cur.execute('create table if not exists guild_history (guild int primary key, filter blob)')
+            cur.execute('create table if not exists archived_games (guild int primary key, game_data blob,'
+                        + ' version int, board text, state text, updated real, archived real)')
+        self.migrate_questions()
+        self.migrate_media()
+        self.migrate_games()
 
-    def save_game(self, guild_id, game):
-        with sqlite3.connect(self.db) as conn:
+    def migrate_questions(self):
+        columns = {c[1]: c[5] for c in self.conn.execute('pragma table_info(questions)')}
+        with self.conn as conn:
             cur = conn.cursor()
-            cur.execute('select guild from games')
-            ids = [r[0] for r in cur.fetchall()]
-
-        if guild_id not in ids:
-            with sqlite3.connect(self.db) as conn:
-                cur = conn.cursor()
-                cur.execute('insert into games values (?, ?)', (guild_id, pickle.dumps(game)))
-                conn.commit()
-        else:
-            with sqlite3.connect(self.db) as conn:
-                cur = conn.cursor()
-                cur.execute('update games set game_data = ? where guild = ?', (pickle.dumps(game), guild_id))
-                conn.commit()
+            if columns and not columns['id']:
+                logging.info('migrating questions table to the indexed schema')
+                cur.execute('drop index if exists questions_unique')
+                cur.execute('alter table questions rename to questions_old')
 
-    def delete_game(self, guild_id):
-        with sqlite3.connect(self.db) as conn:
-            cur = conn.cursor()
-            cur.execute('delete from games where guild = ?', (guild_id,))
-            conn.commit()
+            cur.execute('create table if not exists questions (id integer primary key, question text,'
+                        + ' answer text, value int, media blob, mediatype text, category_id int)')
+            cur.execute('create unique index if not exists questions_unique on questions (category_id, question)')
+            cur.execute('create index if not exists questions_category_value on questions (category_id, value)')
+            cur.execute('create index if not exists categories_name on categories (name)')
 
-    def get_game(self, guild_id):
-        with sqlite3.connect(self.db) as conn:
-            cur = conn.cursor()
-            cur.execute('select game_data from games where guild = ?', (guild_id,))
-            result = cur.fetchone()
-        if result:
-            return pickle.loads(result[0])
-        else:
+            question_columns = [c[1] for c in cur.execute('pragma table_info(questions)')]
+            if 'question_key' not in question_columns:
+                cur.execute('alter table questions add column question_key text')
+            if 'media_hash' not in question_columns:
+                cur.execute('alter table questions add column media_hash text')
+            cur.execute('create table if not exists category_values (category_id int, value int, clue_count int,'
+                        + ' primary key (category_id, value))')
+
+            cur.execute('create trigger if not exists questions_count_insert after insert on questions begin'
+                        + ' insert into category_values values (new.category_id, new.value, 1)'
+                        + ' on conflict (category_id, value) do update set clue_count = clue_count + 1; end')
+            cur.execute('create trigger if not exists questions_count_delete after delete on questions begin'
+                        + ' update category_values set clue_count = clue_count - 1'
+                        + ' where category_id = old.category_id and value = old.value; end')
+            cur.execute('create trigger if not exists questions_count_update after update of category_id, value'
+                        + ' on questions begin'
+                        + ' update category_values set clue_count = clue_count - 1'
+                        + ' where category_id = old.category_id and value = old.value;'
+                        + ' insert into category_values values (new.category_id, new.value, 1)'
+                        + ' on conflict (category_id, value) do update set clue_count = clue_count + 1; end')
+
+            # replaced media is hashed again when it is sent next
+            cur.execute('create trigger if not exists questions_media_update after update of media on questions begin'
+                        + ' update questions set media_hash = null where id = new.id; end')
+
+            if columns and not columns['id']:
+                cur.execute('delete from category_values')
+                cur.execute('insert or ignore into questions (question, answer, value, media, mediatype, category_id)'
+                            + ' select question, answer, value, media, mediatype, category_id from questions_old')
+                cur.execute('drop table questions_old')
+
+            if not cur.execute("select 1 from sqlite_master where type = 'index'"
+                               + " and name = 'questions_category_key'").fetchone():
+                # older keys of trivia questions contained their shuffled options, which let duplicates in,
+                # and keys were unique across categories, which kept the same question out of other categories
+                logging.info('rebuilding the question keys')
+                cur.execute('drop index if exists questions_key')
+                cur.execute('drop index if exists questions_question_key')
+                cur.execute('update questions set question_key = question_key(question)')
+                cur.execute('delete from questions where id not in'
+                            + ' (select min(id) from questions group by category_id, question_key)')
+                cur.execute('create unique index questions_category_key on questions (category_id, question_key)')
+
+            values = ', '.join(map(str, supported_values))
+            complete = ('select category_id from category_values where clue_count > 0 and value in ({})'.format(values)
+                        + ' group by category_id having count(*) = {}'.format(len(supported_values)))
+            if cur.execute("select 1 from sqlite_master where type = 'view' and name = 'complete_categories'").fetchone():
+                cur.execute('drop view complete_categories')
+            cur.execute('create table if not exists complete_categories (category_id integer primary key)')
+            cur.execute('delete from complete_categories')
+            cur.execute('insert into complete_categories ' + complete)
+
+            for event in ('insert', 'update of clue_count'):
+                trigger = 'category_values_{}'.format(event.split()[0])
+                cur.execute('drop trigger if exists {}'.format(trigger))
+                cur.execute('create trigger {} after {} on category_values begin'.format(trigger, event)
+                            + ' delete from complete_categories'
+                            + ' where category_id = new.category_id and new.clue_count <= 0;'
+                            + ' insert into complete_categories'
+                            + ' select category_id from category_values where category_id = new.category_id'
+                            + ' and clue_count > 0 and value in ({})'.format(values)
+                            + ' and not exists (select 1 from complete_categories where category_id = new.category_id)'
+                            + ' group by category_id having count(*) = {}; end'.format(len(supported_values)))
+
+    def migrate_media(self):
+        # uploads used to be stored per question row, so rows with the same media were uploaded once each
+        columns = [c[1] for c in self.conn.execute('pragma table_info(media_uploads)')]
+        with self.conn as conn:
+            if 'question_id' in columns:
+                conn.execute('alter table media_uploads rename to media_uploads_old')
+            conn.execute('create table if not exists media_uploads (media_hash text primary key, url text,'
+                         + ' uploaded real)')
+        if 'question_id' in columns:
+            logging.info('migrating media uploads to content hashes')
+            uploads = self.conn.execute('select question_id, url, uploaded from media_uploads_old'
+                                        + ' order by uploaded').fetchall()
+            for question_id, url, uploaded in uploads:
+                try:
+                    self.store_media_url(self.media_key(question_id), url, uploaded)
+                except LookupError:
+                    pass
+            with self.conn as conn:
+                conn.execute('drop table media_uploads_old')
+
+    def migrate_games(self):
+        # pickled games are migrated when they are loaded, so startup doesn't depend on how many games were stored
+        columns = [c[1] for c in self.conn.execute('pragma table_info(games)')]
+        with self.conn as conn:
+            for column, column_type in (('version', 'int'), ('board', 'text'), ('state', 'text'), ('seq', 'int'),
+                                        ('updated', 'real'), ('deadline', 'real')):
+                if column not in columns:
+                    conn.execute('alter table games add column {} {}'.format(column, column_type))
+            conn.execute('create index if not exists games_updated on games (updated)')
+            conn.execute('create index if not exists games_deadline on games (deadline) where deadline is not null')
+            # games from before the last activity was recorded get the full time to live from now on
+            conn.execute('update games set updated = ? where updated is null', (time.time(),))
+
+    def read_game(self, guild_id):
+        """Returns the board, state and snapshot event id of a stored game, or None."""
+        result = self.conn.execute('select board, state, seq, version, game_data from games where guild = ?',
+                                   (guild_id,)).fetchone()
+        if result is None:
             return None
+        board, state, snapshot, version, game_data = result
+        if version is None:
+            board, state = legacy_documents(pickle.loads(game_data))
+            with self.conn as conn:
+                conn.execute('update games set game_data = null, version = ?, board = ?, state = ? where guild = ?',
+                             (state_version, encode(board), encode(state), guild_id))
+            logging.info('migrated pickled game of guild {} to version {}'.format(guild_id, state_version))
+            return board, state, None
+        return decode(board), upgrade(decode(state)), snapshot
 
-    def get_games(self):
-        with sqlite3.connect(self.db) as conn:
-            cur = conn.cursor()
-            cur.execute('select guild, game_data from games')
-            games = [(g[0], pickle.loads(g[1])) for g in cur.fetchall()]
+    def store_game(self, guild_id, board, state):
+        if self.journal:
+            return self.append_events(guild_id, board, state)
+        deadline = timer_deadline(state)
+        state = encode(state)
+        metrics.storage_bytes.observe(len(state), backend=self.backend, document='state')
+        with self.conn as conn:
+            # seq is only kept for journaled games, a null seq means the state is complete
+            cur = conn.execute('update games set version = ?, state = ?, seq = null, updated = ?, deadline = ?'
+                               + ' where guild = ?', (state_version, state, time.time(), deadline, guild_id))
+            if cur.rowcount == 0:
+                board = encode(board)
+                metrics.storage_bytes.observe(len(board), backend=self.backend, document='board')
+                conn.execute('insert into games (guild, version, board, state, updated, deadline)'
+                             + ' values (?, ?, ?, ?, ?, ?)', (guild_id, state_version, board, state, time.time(),
+                                                              deadline))
+
+    def remember(self, guild_id, head):
+        with self.heads_lock:
+            self.heads[guild_id] = head
+            self.heads.move_to_end(guild_id)
+            while len(self.heads) > journal_cache_size:
+                self.heads.popitem(last=False)
+
+    def forget(self, guild_id):
+        with self.heads_lock:
+            return self.heads.pop(guild_id, None)
+
+    def insert_event(self, conn, guild_id, kind, data):
+        data = encode(data)
+        metrics.storage_bytes.observe(len(data), backend=self.backend, document='event')
+        cur = conn.execute('insert into game_events (guild, kind, data, time) values (?, ?, ?, ?)',
+                           (guild_id, kind, data, time.time()))
+        return cur.lastrowid
+
+    def append_events(self, guild_id, board, state):
+        head = self.forget(guild_id) or self.read_head(guild_id)
+
+        with self.conn as conn:
+            if head is None:
+                titles = [category['title'] for category in board['categories']]
+                board = encode(board)
+                encoded = encode(state)
+                metrics.storage_bytes.observe(len(board), backend=self.backend, document='board')
+                metrics.storage_bytes.observe(len(encoded), backend=self.backend, document='state')
+                seq = self.insert_event(conn, guild_id, 'start', {'titles': titles})
+                conn.execute('insert or replace into games (guild, version, board, state, seq, updated, deadline)'
+                             + ' values (?, ?, ?, ?, ?, ?, ?)',
+                             (guild_id, state_version, board, encoded, seq, time.time(), timer_deadline(state)))
+                self.remember(guild_id, (seq, seq, state))
+                return
+
+            seq, snapshot, old = head
+            events = game_events(old, state, board)
+            for kind, data in events:
+                seq = self.insert_event(conn, guild_id, kind, data)
+            if old['timer'] != state['timer']:
+                # the deadlines of running questions are kept in a column to reschedule them after a restart
+                conn.execute('update games set deadline = ? where guild = ?', (timer_deadline(state), guild_id))
+            if seq - snapshot >= snapshot_interval or any(kind == 'state' for kind, _ in events):
+                self.write_snapshot(conn, guild_id, seq, state)
+                snapshot = seq
+        self.remember(guild_id, (seq, snapshot, state))
+
+    def write_snapshot(self, conn, guild_id, seq, state):
+        encoded = encode(state)
+        metrics.storage_bytes.observe(len(encoded), backend=self.backend, document='state')
+        conn.execute('update games set version = ?, state = ?, seq = ?, updated = ? where guild = ?',
+                     (state_version, encoded, seq, time.time(), guild_id))
+
+    def replay(self, guild_id, snapshot, state):
+        """Applies the events written after the snapshot to its state and returns the last event id and state."""
+        seq = snapshot
+        cur = self.conn.execute('select id, kind, data from game_events where guild = ? and id > ? order by id',
+                                (guild_id, snapshot))
+        for seq, kind, data in cur.fetchall():
+            state = apply_event(state, kind, decode(data))
+        return seq, state
+
+    def read_head(self, guild_id):
+        stored = self.read_game(guild_id)
+        return self.journal_head(guild_id, stored[1], stored[2]) if stored else None
 
-        return games
+    def journal_head(self, guild_id, state, snapshot):
+        if snapshot is None:
+            # written without the journal, so the events up to now are part of the state already
+            snapshot = self.conn.execute('select coalesce(max(id), 0) from game_events').fetchone()[0]
+            with self.conn as conn:
+                conn.execute('update games set seq = ? where guild = ?', (snapshot, guild_id))
+            return snapshot, snapshot, state
+        seq, state = self.replay(guild_id, snapshot, state)
+        return seq, snapshot, state
+
+    def remove_old_events(self):
+        # events before the snapshot of a running game or of finished games are only kept for the audit trail
+        with self.conn as conn:
+            cur = conn.execute('delete from game_events where id in (select id from game_events where time < ?'
+                               + ' and id <= coalesce((select seq from games where games.guild = game_events.guild),'
+                               + ' id) limit ?)', (time.time() - journal_retention, expire_batch_size * 100))
+        if cur.rowcount:
+            logging.info('removed {} old game events'.format(cur.rowcount))
+        return cur.rowcount
+
+    def remove_game(self, guild_id):
+        self.forget(guild_id)
+        with self.conn as conn:
+            if self.journal:
+                self.insert_event(conn, guild_id, 'end', {})
+            conn.execute('delete from games where guild = ?', (guild_id,))
+
+    def load_game(self, guild_id):
+        stored = self.read_game(guild_id)
+        if stored is None:
+            return None
+        board, state, snapshot = stored
+        if self.journal:
+            head = self.journal_head(guild_id, state, snapshot)
+            self.remember(guild_id, head)
+            state = head[2]
+        elif snapshot is not None:
+            # the game was journaled before, so its pending events are written into the state
+            seq, state = self.replay(guild_id, snapshot, state)
+            with self.conn as conn:
+                conn.execute('update games set state = ?, seq = null, deadline = ? where guild = ?',
+                             (encode(state), timer_deadline(state), guild_id))
+        return load_game_data(guild_id, board, state)
+
+    def load_games(self):
+        guilds = [g[0] for g in self.conn.execute('select guild from games').fetchall()]
+        return [(g, self.load_game(g)) for g in guilds]
+
+    def load_deadlines(self):
+        cur = self.conn.execute('select guild, deadline from games where deadline is not null')
+        return cur.fetchall()
+
+    def load_history(self, guild_id):
+        result = self.conn.execute('select filter from guild_history where guild = ?', (guild_id,)).fetchone()
+        return result[0] if result else None
+
+    def store_history(self, guild_id, data):
+        metrics.storage_bytes.observe(len(data), backend=self.backend, document='history')
+        with self.conn as conn:
+            conn.execute('insert or replace into guild_history values (?, ?)', (guild_id, data))
+
+    def remove_history(self, guild_id):
+        with self.conn as conn:
+            conn.execute('delete from guild_history where guild = ?', (guild_id,))
+
+    def remove_expired(self, ttl, archive=False):
+        cutoff = time.time() - ttl
+        # journaled games are only active if they have events after their snapshot
+        guilds = [g[0] for g in self.conn.execute(
+            'select guild from games where updated < ? and not exists (select 1 from game_events'
+            + ' where game_events.guild = games.guild and id > coalesce(games.seq, id) and time >= ?) limit ?',
+            (cutoff, cutoff, expire_batch_size)).fetchall()]
+
+        for guild_id in guilds:
+            self.forget(guild_id)
+            with self.conn as conn:
+                if archive:
+                    # the archive only keeps complete states, so pending events are written into them
+                    stored = self.read_game(guild_id)
+                    state = self.replay(guild_id, stored[2], stored[1])[1] if stored[2] is not None else stored[1]
+                    conn.execute('insert or replace into archived_games (guild, version, board, state, updated,'
+                                 + ' archived) select guild, ?, ?, ?, updated, ? from games where guild = ?',
+                                 (state_version, encode(stored[0]), encode(state), time.time(), guild_id))
+                if self.journal:
+                    self.insert_event(conn, guild_id, 'expire', {'archived': archive})
+                conn.execute('delete from games where guild = ?', (guild_id,))
+        if guilds:
+            logging.info('{} {} games idle for more than {} seconds'.format(
+                'archived' if archive else 'removed', len(guilds), ttl))
+        return guilds
 
     def get_categories(self):
-        with sqlite3.connect(self.db) as conn:
-            cur = conn.cursor()
-            cur.execute('select id, name from categories')
-            return [{'id': c[0], 'title': c[1], 'clues': list()} for c in cur.fetchall()]
+        cur = self.conn.execute('select id, name from categories')
+        return [{'id': c[0], 'title': c[1], 'clues': list()} for c in cur.fetchall()]
 
     def get_questions(self, category_id, value):
-        with sqlite3.connect(self.db) as conn:
-            cur = conn.cursor()
-            cur.execute('select question, answer, value from questions where category_id = ? and value = ?',
-                        (category_id, value))
-            return [{'question': q[0], 'answer': q[1], 'value': q[2]} for q in cur.fetchall()]
+        cur = self.conn.execute('select question, answer, value from questions where category_id = ? and value = ?',
+                                (category_id, value))
+        return [{'question': q[0], 'answer': q[1], 'value': q[2]} for q in cur.fetchall()]
+
+    def draw_board(self, count, candidates=1):
+        """Returns count random complete categories with up to candidates random clues for every value."""
+        cur = self.conn.execute(
+            'select c.id, c.name, q.question, q.answer, q.value, case when q.media is not null then q.id end'
+            + ' from (select category_id from complete_categories order by random() limit ?) p'
+            + ' join categories c on c.id = p.category_id'
+            + ' join category_values cv on cv.category_id = p.category_id and cv.value in ({})'.format(
+                ', '.join('?' * len(supported_values)))
+            + ' join questions q on q.id in (select id from questions where category_id = cv.category_id'
+            + ' and value = cv.value order by random() limit ?)'
+            + ' order by c.id, q.value', (count, *supported_values, candidates))
+
+        categories = dict()
+        for category_id, name, question, answer, value, media in cur.fetchall():
+            category = categories.setdefault(category_id, {'id': category_id, 'title': name, 'clues': list()})
+            clue = {'question': question, 'answer': answer, 'value': value}
+            if media is not None:
+                clue['media'] = media
+            category['clues'].append(clue)
+        return list(categories.values())
+
+    def copy_media(self, question_id, target):
+        """Writes the media of a question to the file target chunk by chunk and returns its media type."""
+        result = self.conn.execute('select mediatype from questions where id = ? and media is not null',
+                                   (question_id,)).fetchone()
+        if result is None:
+            raise LookupError('question {} has no media'.format(question_id))
+        with self.conn.blobopen('questions', 'media', question_id, readonly=True) as blob:
+            for chunk in iter(lambda: blob.read(media_chunk_size), b''):
+                target.write(chunk)
+        return result[0]
+
+    def media_key(self, question_id):
+        """Returns the content hash of the media of a question, rows with the same media share their uploads."""
+        result = self.conn.execute('select media_hash from questions where id = ? and media is not null',
+                                   (question_id,)).fetchone()
+        if result is None:
+            raise LookupError('question {} has no media'.format(question_id))
+        if result[0] is not None:
+            return result[0]
+        # media is written into the bank by other tools, so the hash is computed when it is first sent
+        digest = hashlib.sha256()
+        with self.conn.blobopen('questions', 'media', question_id, readonly=True) as blob:
+            for chunk in iter(lambda: blob.read(media_chunk_size), b''):
+                digest.update(chunk)
+        with self.conn as conn:
+            conn.execute('update questions set media_hash = ? where id = ?', (digest.hexdigest(), question_id))
+        return digest.hexdigest()
+
+    def load_media_url(self, media_hash):
+        return self.conn.execute('select url, uploaded from media_uploads where media_hash = ?',
+                                 (media_hash,)).fetchone()
+
+    def store_media_url(self, media_hash, url, uploaded):
+        with self.conn as conn:
+            conn.execute('insert into media_uploads values (?, ?, ?) on conflict (media_hash)'
+                         + ' do update set url = excluded.url, uploaded = excluded.uploaded',
+                         (media_hash, url, uploaded))
+
+    def save_category(self, category_id, name):
+        with self.conn as conn:
+            conn.execute('insert into categories values (?, ?) on conflict (id) do update set name = excluded.name',
+                         (category_id, name))
+
+    def save_questions(self, category_id, questions):
+        with self.conn:
+            return self.insert_questions([(category_id, q['question'], q['answer'], q['value']) for q in questions])
+
+    def insert_questions(self, rows):
+        cur = self.conn.executemany('insert or ignore into questions'
+                                    + ' (question, answer, value, category_id, question_key) values (?, ?, ?, ?, ?)',
+                                    ((q, a, v, c, question_key(q)) for c, q, a, v in rows))
+        return cur.rowcount
+
+    def find_category(self, name, first_id):
+        result = self.conn.execute('select id from categories where name = ? and id >= ?', (name, first_id)).fetchone()
+        if result:
+            return result[0]
+        cur = self.conn.execute('insert into categories (id, name) select coalesce(max(id) + 1, ?), ? from categories'
+                                + ' where id >= ? returning id', (first_id, name, first_id))
+        return cur.fetchone()[0]
+
+    def mark_jservice_categories(self, categories):
+        # complete is None for categories that could not be fetched, they are neither drawn nor known for a while
+        with self.conn as conn:
+            conn.executemany('insert or replace into jservice_categories values (?, ?, ?)',
+                             ((category_id, None if complete is None else int(complete), time.time())
+                              for category_id, complete in categories))
+
+    def draw_jservice_categories(self, count):
+        cur = self.conn.execute('select id from jservice_categories where complete order by random() limit ?',
+                                (count,))
+        return [c[0] for c in cur.fetchall()]
+
+    def known_jservice_categories(self, ids):
+        cur = self.conn.execute('select id from jservice_categories where id in ({})'.format(', '.join('?' * len(ids)))
+                                + ' and (complete is not null or checked > ?)',
+                                (*ids, time.time() - jservice_retry_delay))
+        return {c[0] for c in cur.fetchall()}
+
+    def get_sync_cursor(self, source):
+        cur = self.conn.execute('select cursor from sync_state where source = ?', (source,))
+        result = cur.fetchone()
+        if result:
+            return json.loads(result[0])
+        else:
+            return None
+
+    def set_sync_cursor(self, source, cursor):
+        with self.conn as conn:
+            conn.execute('insert or replace into sync_state values (?, ?)', (source, json.dumps(cursor)))
+
+    def close(self):
+        super().close()
+        self.conn.close()
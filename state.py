@@ -0,0 +1,91 @@
+import json
+
+from jeopardy import Game
+from players import PlayerRegistry
+
+state_version = 3
+
+
+def players_by_id(document):
+    if 'players' in document:
+        document['players'] = [[p['name'], p['name'], p['points']] for p in document['players']]
+        document['active_player'] = None
+    document['version'] = 2
+    return document
+
+
+def question_timers(document):
+    if 'players' in document:
+        document['timer'] = None
+    document['version'] = 3
+    return document
+
+
+# upgrades a document from the version in the key to the next one
+migrations = {
+    1: players_by_id,
+    2: question_timers
+}
+
+
+def board_document(game_data):
+    return dict(version=state_version, **game_data['game'].dump_board())
+
+
+def game_documents(game_data):
+    """Returns the board and state documents of a game.
+
+    They are built on the event loop, so the storage threads that write them never read a game that is being changed.
+    """
+    return board_document(game_data), state_document(game_data)
+
+
+def state_document(game_data):
+    return {
+        'version': state_version,
+        'game': game_data['game'].dump_state(),
+        'players': game_data['players'].dump(),
+        'active_player': game_data['active_player'],
+        'objection_possible': game_data['objection_possible'],
+        'timer': game_data['timer']
+    }
+
+
+def legacy_documents(game_data):
+    board = dict(version=1, **game_data['game'].dump_board())
+    state = {
+        'version': 1,
+        'game': game_data['game'].dump_state(),
+        'players': game_data['players'],
+        'active_player': game_data['active_player'],
+        'objection_possible': game_data['objection_possible']
+    }
+    return upgrade(board), upgrade(state)
+
+
+def upgrade(document):
+    while document['version'] < state_version:
+        document = migrations[document['version']](document)
+    if document['version'] != state_version:
+        raise ValueError('unsupported game state version {}'.format(document['version']))
+    return document
+
+
+def load_game_data(guild_id, board, state):
+    board = upgrade(board)
+    state = upgrade(state)
+    return {
+        'game': Game.restore(guild_id, board, state['game']),
+        'players': PlayerRegistry.load(state['players']),
+        'active_player': state['active_player'],
+        'objection_possible': state['objection_possible'],
+        'timer': state['timer']
+    }
+
+
+def encode(document):
+    return json.dumps(document, separators=(',', ':'))
+
+
+def decode(data):
+    return json.loads(data)
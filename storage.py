@@ -0,0 +1,104 @@
+import asyncio
+import functools
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from state import game_documents
+
+
+class StaleGameError(Exception):
+    """Raised when a game was changed elsewhere since it was loaded, so writing it would undo those changes."""
+
+
+class AsyncStorage(ABC):
+    executor_workers = 1
+    backend = 'storage'
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.executor_workers,
+                                           thread_name_prefix=self.__class__.__name__)
+
+    async def run(self, func, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.executor,
+                                                                functools.partial(func, *args, **kwargs))
+
+    async def get_game(self, guild_id):
+        with metrics.storage_seconds.time(backend=self.backend, operation='get'):
+            return await self.run(self.load_game, guild_id)
+
+    async def save_game(self, guild_id, game):
+        with metrics.storage_seconds.time(backend=self.backend, operation='save'):
+            await self.run(self.store_game, guild_id, *game_documents(game))
+
+    async def delete_game(self, guild_id):
+        with metrics.storage_seconds.time(backend=self.backend, operation='delete'):
+            await self.run(self.remove_game, guild_id)
+
+    async def get_games(self):
+        return await self.run(self.load_games)
+
+    async def get_deadlines(self):
+        return await self.run(self.load_deadlines)
+
+    async def get_history(self, guild_id):
+        return await self.run(self.load_history, guild_id)
+
+    async def save_history(self, guild_id, data):
+        await self.run(self.store_history, guild_id, data)
+
+    async def delete_history(self, guild_id):
+        await self.run(self.remove_history, guild_id)
+
+    async def expire_games(self, ttl, archive=False):
+        with metrics.storage_seconds.time(backend=self.backend, operation='expire'):
+            return await self.run(self.remove_expired, ttl, archive)
+
+    async def prune_events(self):
+        return await self.run(self.remove_old_events)
+
+    @abstractmethod
+    def load_game(self, guild_id):
+        pass
+
+    @abstractmethod
+    def store_game(self, guild_id, board, state):
+        # board and state are the documents of game_documents, only the state changes during a game
+        pass
+
+    @abstractmethod
+    def remove_game(self, guild_id):
+        pass
+
+    @abstractmethod
+    def load_games(self):
+        pass
+
+    @abstractmethod
+    def load_deadlines(self):
+        # the guild ids and deadlines of all games with a running question timer
+        pass
+
+    @abstractmethod
+    def load_history(self, guild_id):
+        pass
+
+    @abstractmethod
+    def store_history(self, guild_id, data):
+        pass
+
+    @abstractmethod
+    def remove_history(self, guild_id):
+        pass
+
+    @abstractmethod
+    def remove_expired(self, ttl, archive=False):
+        # removes a batch of games that weren't changed for ttl seconds and returns their ids
+        pass
+
+    def remove_old_events(self):
+        # only storages that journal game events have any, returns how many were removed
+        return 0
+
+    def close(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import zlib
+from argparse import ArgumentParser
+
+from fetch import Fetcher, fetcher
+from jeopardy import categories_url, fetch_jservice_categories, jservice_clues, supported_values, trivia_clue
+from sqlite import SQLiteInstance
+
+jservice_url = 'https://jservice.io'
+opentdb_url = 'https://opentdb.com'
+
+opentdb_category_offset = 1000000
+opentdb_batch_size = 50
+opentdb_request_delay = 5
+opentdb_difficulty_values = {
+    'easy': (200, 400),
+    'medium': (600, 800),
+    'hard': (1000,)
+}
+
+default_crawl_interval = 10
+crawl_page_size = 100
+# jservice hardly changes, so the crawler starts over only after a week
+recrawl_delay = 7 * 24 * 3600
+
+
+class QuestionBankSync:
+    def __init__(self, bank, fetcher, jservice=jservice_url, opentdb=opentdb_url, page_size=100,
+                 request_delay=opentdb_request_delay):
+        self.bank = bank
+        self.fetcher = fetcher
+        self.jservice_url = jservice.rstrip('/')
+        self.opentdb_url = opentdb.rstrip('/')
+        self.page_size = page_size
+        self.request_delay = request_delay
+
+    async def sync_jservice(self, pages):
+        cursor = self.bank.get_sync_cursor('jservice') or {'offset': 0}
+
+        for _ in range(pages):
+            categories = await self.fetcher.get_json('{}/api/categories?count={}&offset={}'.format(
+                self.jservice_url, self.page_size, cursor['offset']))
+            if not categories:
+                logging.info('jservice sync reached the end of the category list')
+                break
+
+            results = await self.fetcher.gather_json(
+                ['{}/api/category?id={}'.format(self.jservice_url, c['id']) for c in categories],
+                return_exceptions=True)
+            for category, result in zip(categories, results):
+                if isinstance(result, BaseException):
+                    logging.warning('skipped jservice category {}: {}'.format(category['id'], result))
+            full_categories = [result for result in results if not isinstance(result, BaseException)]
+
+            inserted = 0
+            for category in full_categories:
+                clues = [{'question': c['question'], 'answer': c['answer'], 'value': c['value']}
+                         for c in category['clues']
+                         if c['value'] in supported_values and c['question'] and not c.get('invalid_count')]
+                self.bank.save_category(category['id'], category['title'])
+                inserted += self.bank.save_questions(category['id'], clues)
+            self.bank.mark_jservice_categories(
+                [(c['id'], len(jservice_clues(c['clues'])) == len(supported_values)) for c in full_categories])
+
+            cursor['offset'] += len(categories)
+            self.bank.set_sync_cursor('jservice', cursor)
+            logging.info('jservice sync at offset {}, {} new clues'.format(cursor['offset'], inserted))
+
+    async def sync_opentdb(self):
+        cursor = self.bank.get_sync_cursor('opentdb') or {'token': None, 'done': list()}
+        if not cursor['token']:
+            cursor['token'] = await self.request_token()
+
+        categories = (await self.fetcher.get_json('{}/api_category.php'.format(self.opentdb_url)))['trivia_categories']
+
+        for category in categories:
+            if category['id'] in cursor['done']:
+                continue
+
+            category_id = opentdb_category_offset + category['id']
+            self.bank.save_category(category_id, category['name'])
+
+            count = await self.opentdb_get('{}/api_count.php?category={}'.format(self.opentdb_url, category['id']))
+            remaining = count['category_question_count']['total_question_count']
+            inserted = 0
+
+            while remaining > 0:
+                data = await self.opentdb_get('{}/api.php?amount={}&category={}&token={}'.format(
+                    self.opentdb_url, min(remaining, opentdb_batch_size), category['id'], cursor['token']))
+
+                if data['response_code'] == 3:
+                    cursor['token'] = await self.request_token()
+                    continue
+                if data['response_code'] != 0 or not data['results']:
+                    break
+
+                clues = [trivia_clue(c, opentdb_value(c)) for c in data['results']]
+                inserted += self.bank.save_questions(category_id, clues)
+                remaining -= len(data['results'])
+
+            cursor['done'].append(category['id'])
+            self.bank.set_sync_cursor('opentdb', cursor)
+            logging.info('opentdb sync finished category {}, {} new clues'.format(category['name'], inserted))
+
+    async def request_token(self):
+        return (await self.opentdb_get('{}/api_token.php?command=request'.format(self.opentdb_url)))['token']
+
+    async def opentdb_get(self, url):
+        while True:
+            data = await self.fetcher.get_json(url)
+            await asyncio.sleep(self.request_delay)
+            if data.get('response_code') != 5:
+                return data
+            logging.debug('opentdb rate limit hit, waiting')
+
+
+class CategoryIndexCrawler:
+    """Walks through the jservice category list in the background and records which categories are complete."""
+
+    def __init__(self, bank, interval=default_crawl_interval, page_size=crawl_page_size):
+        self.bank = bank
+        self.interval = interval
+        self.page_size = page_size
+        self.task = None
+        self.indexed = 0
+
+    def start(self):
+        if self.interval and (self.task is None or self.task.done()):
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        while True:
+            try:
+                more = await self.crawl_page()
+            except Exception:
+                logging.exception('could not crawl the jservice categories')
+                more = True
+            await asyncio.sleep(self.interval if more else recrawl_delay)
+
+    async def crawl_page(self):
+        cursor = await self.bank.run(self.bank.get_sync_cursor, 'jservice_index') or {'offset': 0}
+        data = await fetcher.get_json(categories_url['JeopardyGame'].format(count=self.page_size,
+                                                                            offset=cursor['offset']))
+        if not data:
+            logging.info('indexed the complete jservice category list')
+            await self.bank.run(self.bank.set_sync_cursor, 'jservice_index', {'offset': 0})
+            return False
+
+        ids = [c['id'] for c in data]
+        known = await self.bank.run(self.bank.known_jservice_categories, ids)
+        short = [i for i, c in zip(ids, data) if c.get('clues_count', len(supported_values)) < len(supported_values)]
+        await self.bank.run(self.bank.mark_jservice_categories, [(i, False) for i in short if i not in known])
+        await fetch_jservice_categories([i for i in ids if i not in known and i not in short], self.bank)
+        self.indexed += len(ids) - len(known)
+
+        cursor['offset'] += len(data)
+        await self.bank.run(self.bank.set_sync_cursor, 'jservice_index', cursor)
+        return True
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+
+def opentdb_value(clue):
+    values = opentdb_difficulty_values[clue['difficulty']]
+    return values[zlib.crc32(clue['question'].encode()) % len(values)]
+
+
+async def run(args):
+    fetcher = Fetcher()
+    bank = SQLiteInstance(args.database)
+    sync = QuestionBankSync(bank, fetcher, jservice=args.jservice_url,
+                            opentdb=args.opentdb_url, request_delay=args.request_delay)
+    try:
+        if args.source in ('jeopardy', 'all'):
+            await sync.sync_jservice(args.pages)
+        if args.source in ('trivia', 'all'):
+            await sync.sync_opentdb()
+    finally:
+        await fetcher.close()
+        bank.close()
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--database', '-d', type=str, dest='database', default='games.db')
+    parser.add_argument('--source', '-s', choices=['jeopardy', 'trivia', 'all'], default='all')
+    parser.add_argument('--pages', '-p', type=int, default=10)
+    parser.add_argument('--jservice-url', type=str, dest='jservice_url', default=jservice_url)
+    parser.add_argument('--opentdb-url', type=str, dest='opentdb_url', default=opentdb_url)
+    parser.add_argument('--request-delay', type=float, dest='request_delay', default=opentdb_request_delay)
+    parser.add_argument('--verbose', '-v', action='count', default=0)
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose >= 2 else logging.INFO)
+
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+import pytest
+
+from answers import AnswerKey
+
+
+@pytest.mark.parametrize('answer, given', [
+    ('AC/DC', 'AC/DC'),
+    ('To Be or Not to Be', 'To Be or Not to Be'),
+    ('1/2', '1/2'),
+    ('24/7', '24/7'),
+    ('The Beatles', 'Beatles'),
+    ('The Beatles', 'the beatles!'),
+    ('<i>The Old Man and the Sea</i>', 'old man and the see'),
+    ('Crème brûlée', 'creme brulee'),
+    ('Mississippi', 'missisippi'),
+    ('(Franklin) Roosevelt', 'Roosevelt'),
+    ('Seven', '7'),
+    ('Burma (or Myanmar)', 'Myanmar'),
+    ('Lion/Tiger', 'tiger'),
+])
+def test_answer_matches(answer, given):
+    assert AnswerKey(answer).matches(given)
+
+
+@pytest.mark.parametrize('answer, given', [
+    ('AC/DC', 'ac'),
+    ('To Be or Not to Be', 'to be'),
+    ('24/7', '24'),
+    ('1/2', '1'),
+    ('Antidisestablishmentarianism', 'something completely different'),
+    ('John F. Kennedy', 'kennedy'),
+    ('Mississippi', ''),
+])
+def test_answer_does_not_match(answer, given):
+    assert not AnswerKey(answer).matches(given)
+
+
+def test_lenient_matching_accepts_a_last_name():
+    assert AnswerKey('John F. Kennedy').matches('kennedy', 'lenient')
+    assert not AnswerKey('Mississippi').matches('missisippi', 'strict')
@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+import pytest
+
+import bot
+from cache import GameStateCache
+from fakes import FakeChannel, FakeGateway, FakeGuild, FakeUser
+from guilds import GuildActors
+from history import GuildHistories
+from outbox import Outbox
+from sqlite import SQLiteInstance
+from state import game_documents
+from tests.test_guilds import new_game
+from timers import TimerScheduler
+
+
+@pytest.fixture
+def game_bot(tmp_path, monkeypatch):
+    db = SQLiteInstance(str(tmp_path / 'games.db'))
+    state = GameStateCache(db)
+    monkeypatch.setattr(bot, 'db', db)
+    monkeypatch.setattr(bot, 'state', state)
+    monkeypatch.setattr(bot, 'guild_actors', GuildActors(state))
+    monkeypatch.setattr(bot, 'histories', GuildHistories(db))
+    monkeypatch.setattr(bot, 'timers', TimerScheduler(bot.question_timeout))
+    monkeypatch.setattr(bot, 'outbox', Outbox(window=0))
+    yield bot
+    db.close()
+
+
+def steal_phase(guild_id, players, timed_out):
+    game_data = new_game(guild_id, 'board')
+    for player in players:
+        game_data['players'].add(player.id, player.name)
+    game_data['game'].get_new_question(0, 200)
+    game_data['timer'] = ['steal', time.time() + 60, guild_id, [timed_out.id]]
+    return game_data
+
+
+def test_only_other_players_can_steal(game_bot):
+    alice, bob, carol, dave = (FakeUser(i, name) for i, name in enumerate(['alice', 'bob', 'carol', 'dave'], 1))
+
+    async def steal():
+        channel = FakeChannel(FakeGuild(1), FakeUser(0, 'TriviCord', bot=True))
+        game_data = steal_phase(1, [alice, bob, carol], alice)
+        await game_bot.state.save_game(1, game_data)
+        answer = game_data['game'].current_clue.answer
+
+        gateway = FakeGateway(game_bot.bot)
+        for user, text in [(dave, answer), (alice, answer), (bob, 'something else'), (bob, answer), (carol, answer)]:
+            await gateway.invoke(channel, user, 'answer', text)
+        await game_bot.guild_actors.close()
+        await game_bot.outbox.close()
+        await game_bot.state.close()
+        # boards are queued in the outbox and may arrive before or after the replies
+        return [m.content for m in channel.sent if not m.content.startswith('```')], game_data
+
+    messages, game_data = asyncio.run(steal())
+    assert messages[0].startswith('Only players can answer')
+    assert messages[1].startswith('You already had your chance')
+    assert messages[2] == "That's not it. Anyone else?"
+    assert messages[3].startswith('You already had your chance')
+    assert messages[4].startswith("That's correct! You earned 200 points.")
+    assert [(p.name, p.points) for p in game_data['players'].top()] == [('carol', 200), ('alice', 0), ('bob', 0)]
+    assert game_data['timer'] is None
+
+
+def test_wrong_steal_on_a_timer_without_excluded_players(game_bot):
+    alice, bob = FakeUser(1, 'alice'), FakeUser(2, 'bob')
+
+    async def steal():
+        channel = FakeChannel(FakeGuild(1), FakeUser(0, 'TriviCord', bot=True))
+        game_data = steal_phase(1, [alice, bob], alice)
+        # written before the steal phase remembered who can't answer
+        game_data['timer'] = game_data['timer'][:3]
+        await game_bot.state.save_game(1, game_data)
+
+        gateway = FakeGateway(game_bot.bot)
+        await gateway.invoke(channel, bob, 'answer', 'something else')
+        await game_bot.guild_actors.close()
+        await game_bot.outbox.close()
+        await game_bot.state.close()
+        return [m.content for m in channel.sent], game_data
+
+    messages, game_data = asyncio.run(steal())
+    assert messages == ["That's not it. Anyone else?"]
+    assert game_data['timer'][3] == [bob.id]
+
+
+def test_workers_restore_only_the_timers_of_their_guilds(game_bot, monkeypatch):
+    guilds = [(i << 22) | 1 for i in range(4)]
+
+    async def restore():
+        for guild_id in guilds:
+            game_data = new_game(guild_id, 'board')
+            game_data['timer'] = ['answer', time.time() + 60, guild_id, []]
+            game_bot.db.store_game(guild_id, *game_documents(game_data))
+        monkeypatch.setattr(game_bot.bot, 'shard_ids', [1])
+        monkeypatch.setattr(game_bot.bot, 'shard_count', 2)
+        await game_bot.start_timers()
+        await game_bot.timers.close()
+        return [guild_id for guild_id in guilds if guild_id in game_bot.timers.wheel]
+
+    assert asyncio.run(restore()) == [guilds[1], guilds[3]]
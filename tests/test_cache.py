@@ -0,0 +1,132 @@
+import asyncio
+import threading
+import time
+
+from cache import GameStateCache, IdleGameSweeper
+import sqlite
+from sqlite import SQLiteInstance
+from tests.test_guilds import new_game
+
+
+class FlakyStorage:
+    def __init__(self, failures, delay=0):
+        self.failures = failures
+        self.delay = delay
+        self.games = dict()
+
+    async def get_game(self, guild_id):
+        return self.games.get(guild_id)
+
+    async def save_game(self, guild_id, game_data):
+        await asyncio.sleep(self.delay)
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('storage is down')
+        self.games[guild_id] = game_data
+
+    async def delete_game(self, guild_id):
+        self.games.pop(guild_id, None)
+
+
+def test_failed_eviction_is_written_later():
+    async def evict():
+        db = FlakyStorage(failures=1)
+        cache = GameStateCache(db, max_size=1, flush_interval=60)
+        await cache.save_game(1, {'round': 1})
+        await cache.save_game(2, {'round': 1})
+        await asyncio.gather(*cache.evictions)
+        assert 1 not in db.games
+        # the game is still there for its guild instead of the older stored state
+        assert await cache.get_game(1) == {'round': 1}
+        await cache.close()
+        return db.games
+
+    assert asyncio.run(evict()) == {1: {'round': 1}, 2: {'round': 1}}
+
+
+def test_failed_eviction_is_retried_by_flush():
+    async def evict():
+        db = FlakyStorage(failures=1)
+        cache = GameStateCache(db, max_size=1, flush_interval=60)
+        await cache.save_game(1, {'round': 1})
+        await cache.save_game(2, {'round': 1})
+        await asyncio.gather(*cache.evictions)
+        await cache.flush()
+        assert not cache.unwritten
+        await cache.close()
+        return db.games
+
+    assert asyncio.run(evict()) == {1: {'round': 1}, 2: {'round': 1}}
+
+
+def test_failed_flush_is_retried():
+    async def flush():
+        db = FlakyStorage(failures=1)
+        cache = GameStateCache(db, flush_interval=0.01)
+        await cache.save_game(1, {'round': 1})
+        for _ in range(100):
+            if 1 in db.games:
+                break
+            await asyncio.sleep(0.01)
+        # written by the retry, not by the final flush of close
+        games = dict(db.games)
+        await cache.close()
+        return games
+
+    assert asyncio.run(flush()) == {1: {'round': 1}}
+
+
+def test_close_waits_for_a_running_flush():
+    async def close():
+        db = FlakyStorage(failures=0, delay=0.05)
+        cache = GameStateCache(db, flush_interval=0)
+        await cache.save_game(1, {'round': 1})
+        # the flush took the dirty game and is writing it when the cache is closed
+        await asyncio.sleep(0.01)
+        await cache.close()
+        return db.games
+
+    assert asyncio.run(close()) == {1: {'round': 1}}
+
+
+def test_saved_game_is_the_state_at_the_time_of_the_save(tmp_path):
+    async def save():
+        db = SQLiteInstance(str(tmp_path / 'games.db'))
+        game_data = new_game(1, 'board')
+        # keeps the storage thread busy, so the save is written after the game has changed
+        release = threading.Event()
+        loop = asyncio.get_running_loop()
+        busy = loop.create_task(db.run(release.wait))
+        save = loop.create_task(db.save_game(1, game_data))
+        await asyncio.sleep(0.01)
+        game_data['players'].add(2, 'bob', 400)
+        release.set()
+        await asyncio.gather(busy, save)
+        stored = db.load_game(1)
+        db.close()
+        return stored
+
+    assert not list(asyncio.run(save())['players'])
+
+
+def test_old_journal_events_are_removed_when_games_never_expire(tmp_path):
+    async def prune():
+        db = SQLiteInstance(str(tmp_path / 'games.db'), journal=True)
+        cache = GameStateCache(db)
+        game_data = new_game(1, 'board')
+        await cache.save_game(1, game_data)
+        await cache.flush()
+        await cache.delete_game(1)
+        with db.conn as conn:
+            conn.execute('update game_events set time = ?', (time.time() - sqlite.journal_retention - 1,))
+
+        sweeper = IdleGameSweeper(cache, ttl=0)
+        sweeper.start()
+        await asyncio.sleep(0.1)
+        await sweeper.close()
+        await cache.close()
+        events = db.conn.execute('select count(*) from game_events').fetchone()[0]
+        db.close()
+        return events
+
+    assert asyncio.run(prune()) == 0
@@ -0,0 +1,13 @@
+import random
+
+from benchmarks.game_memory import memory_per_game
+
+# the slotted model takes about 14 kB per game, the model before it about 29 kB
+max_game_bytes = 16 * 1024
+
+
+def test_memory_per_game():
+    random.seed(0)
+    memory, games = memory_per_game(500)
+    assert len(games) == 500
+    assert memory < max_game_bytes
@@ -0,0 +1,64 @@
+import asyncio
+
+import mongomock
+import pytest
+
+from benchmarks.game_memory import random_board
+from cache import GameStateCache
+from guilds import GuildActors
+from jeopardy import DatabaseGame
+from mongo import MongoInstance
+from players import PlayerRegistry
+from sqlite import SQLiteInstance
+
+
+def new_game(guild_id, title):
+    game = DatabaseGame(guild_id)
+    board = random_board()
+    for i, category in enumerate(board):
+        category['title'] = '{} {}'.format(title, i)
+    game.load_categories(board)
+    return {'game': game, 'players': PlayerRegistry(), 'active_player': None, 'objection_possible': False,
+            'timer': None}
+
+
+@pytest.fixture(params=['sqlite', 'sqlite-journal', 'mongodb'])
+def open_storage(request, tmp_path):
+    client = mongomock.MongoClient()
+
+    def open_storage():
+        if request.param == 'mongodb':
+            return MongoInstance('mongodb://localhost', client=client)
+        return SQLiteInstance(str(tmp_path / 'games.db'), journal=request.param == 'sqlite-journal')
+    return open_storage
+
+
+def test_game_started_in_the_batch_that_ended_the_old_one(open_storage):
+    async def end_and_start():
+        db = open_storage()
+        state = GameStateCache(db)
+        actors = GuildActors(state)
+
+        def start(title):
+            async def handle(session):
+                if not session.data:
+                    session.save(new_game(1, title))
+            return handle
+
+        async def end(session):
+            session.delete()
+
+        await actors.submit(1, start('old'))
+        await state.flush()
+        # both commands arrive while the guild is busy, so they are handled in one batch
+        await asyncio.gather(actors.submit(1, end), actors.submit(1, start('new')))
+        await actors.close()
+        await state.close()
+        db.close()
+
+        db = open_storage()
+        game_data = await db.get_game(1)
+        db.close()
+        return game_data['game'].titles
+
+    assert asyncio.run(end_and_start()) == tuple('new {}'.format(i) for i in range(5))
@@ -0,0 +1,83 @@
+import asyncio
+
+from history import ClueHistory, GuildHistories, clue_key
+from jeopardy import Clue, DatabaseGame, supported_values
+from pool import BoardPool
+from sqlite import SQLiteInstance
+
+
+class HistoryStorage:
+    def __init__(self):
+        self.histories = dict()
+
+    async def get_history(self, guild_id):
+        return self.histories.get(guild_id)
+
+    async def save_history(self, guild_id, data):
+        self.histories[guild_id] = data
+
+    async def delete_history(self, guild_id):
+        self.histories.pop(guild_id, None)
+
+
+def test_forget_is_a_registered_command():
+    import bot
+
+    assert bot.bot.get_command('forget') is not None
+
+
+def test_reset_is_not_undone_by_an_eviction_write():
+    async def forget():
+        db = HistoryStorage()
+        histories = GuildHistories(db, max_size=1)
+        await histories.record(1, Clue('Longest river?', 'Nile', 200))
+        # the history of guild 1 is evicted and written in the background
+        await histories.record(2, Clue('Longest river?', 'Nile', 200))
+        await histories.reset(1)
+        await histories.close()
+        return db.histories
+
+    assert 1 not in asyncio.run(forget())
+
+
+def test_reset_history_forgets_clues():
+    async def forget():
+        db = HistoryStorage()
+        histories = GuildHistories(db)
+        clue = Clue('Longest river?', 'Nile', 200)
+        await histories.record(1, clue)
+        await histories.save(1)
+        await histories.reset(1)
+        return clue_key(clue.question, clue.answer) in await histories.get(1)
+
+    assert not asyncio.run(forget())
+
+
+
+def test_database_board_avoids_clues_the_guild_has_seen(tmp_path, monkeypatch):
+    bank = SQLiteInstance(str(tmp_path / 'bank.db'))
+    history = ClueHistory()
+    for category in range(5):
+        bank.save_category(category, 'category {}'.format(category))
+        clues = [{'question': 'Question {} of {} for {}'.format(i, category, value), 'answer': 'answer {}'.format(i),
+                  'value': value} for value in supported_values for i in range(3)]
+        bank.save_questions(category, clues)
+        # two of the three clues of every value were played before
+        for clue in clues:
+            if not clue['answer'].endswith('2'):
+                history.add(clue_key(clue['question'], clue['answer']))
+    monkeypatch.setattr(DatabaseGame, 'question_bank', bank)
+
+    async def start():
+        pool = BoardPool(size=0)
+        pool.register('db', DatabaseGame.create)
+        game = await pool.get('db', 1, history)
+        await pool.close()
+        return game
+
+    try:
+        game = asyncio.run(start())
+    finally:
+        bank.close()
+    assert len(game.clues) == 25
+    assert history.seen(game) == 0
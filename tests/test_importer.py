@@ -0,0 +1,36 @@
+from importer import QuestionImporter, read_rows
+from sqlite import SQLiteInstance
+
+
+def import_file(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text, encoding='utf-8')
+    bank = SQLiteInstance(str(tmp_path / 'bank.db'))
+    importer = QuestionImporter(bank)
+    importer.run(read_rows(str(path), 'auto', None))
+    rows = bank.conn.execute('select c.name, q.question, q.answer, q.value from questions q'
+                             + ' join categories c on c.id = q.category_id order by c.name, q.value').fetchall()
+    bank.close()
+    return importer, rows
+
+
+def test_custom_format_is_read_without_a_delimiter(tmp_path):
+    importer, rows = import_file(tmp_path, 'custom.csv', 'Rivers;Longest river, by most counts?;Nile;200\n'
+                                                         'Rivers;River through Vienna?;Danube;400\n')
+    assert importer.skipped == 0
+    assert rows == [('Rivers', 'Longest river, by most counts?', 'Nile', 200),
+                    ('Rivers', 'River through Vienna?', 'Danube', 400)]
+
+
+def test_comma_separated_dump_with_header(tmp_path):
+    _, rows = import_file(tmp_path, 'dump.csv', 'category,question,answer,value\n'
+                                                'Rivers,"Longest river; by most counts?",Nile,$200\n')
+    assert rows == [('Rivers', 'Longest river; by most counts?', 'Nile', 200)]
+
+
+def test_same_question_in_two_categories(tmp_path):
+    importer, rows = import_file(tmp_path, 'custom.csv', 'Rivers;Longest river?;Nile;200\n'
+                                                         'Africa;Longest river?;Nile;400\n'
+                                                         'Africa;Longest river?;Nile;600\n')
+    assert [row[0] for row in rows] == ['Africa', 'Rivers']
+    assert importer.inserted == 2
@@ -0,0 +1,55 @@
+import asyncio
+import sqlite3
+
+from fakes import FakeChannel, FakeGuild, FakeUser
+from media import MediaUploads
+from outbox import Outbox
+from sqlite import SQLiteInstance
+
+image = b'\x89PNG' + bytes(range(256)) * 1024
+
+
+def media_bank(path, rows):
+    bank = SQLiteInstance(str(path))
+    with bank.conn as conn:
+        conn.executemany('insert into questions (question, answer, value, media, mediatype, category_id)'
+                         + ' values (?, ?, 200, ?, ?, 1)', rows)
+    return bank
+
+
+def test_rows_with_the_same_media_share_one_upload(tmp_path):
+    bank = media_bank(tmp_path / 'bank.db', [('What is this?', 'A', image, 'image/png'),
+                                              ('And this?', 'B', image, 'image/png'),
+                                              ('Who is this?', 'C', image[::-1], 'image/png')])
+
+    async def send():
+        uploads = MediaUploads(bank)
+        outbox = Outbox(window=0)
+        channels = [FakeChannel(FakeGuild(i), FakeUser(0, 'TriviCord', bot=True)) for i in range(3)]
+        # the first two rows are chosen at the same time, the third row has other media
+        await asyncio.gather(*(uploads.send(outbox, c, 'clue', media) for c, media in zip(channels, [1, 2, 3])))
+        await uploads.send(outbox, channels[0], 'clue', 2)
+        await outbox.close()
+        return [m for c in channels for m in c.sent]
+
+    messages = asyncio.run(send())
+    bank.close()
+    assert sum(len(m.attachments) for m in messages) == 2
+    links = [m.content.split('\n')[1] for m in messages if not m.attachments]
+    assert len(links) == 2 and len(set(links)) == 1
+
+
+def test_uploads_of_question_rows_are_migrated_to_content_hashes(tmp_path):
+    path = tmp_path / 'bank.db'
+    media_bank(path, [('What is this?', 'A', image, 'image/png'), ('And this?', 'B', image, 'image/png')]).close()
+    with sqlite3.connect(str(path)) as conn:
+        conn.execute('drop table media_uploads')
+        conn.execute('create table media_uploads (question_id integer primary key, url text, uploaded real)')
+        conn.execute("insert into media_uploads values (1, 'https://cdn.example/clue1.png', 1)")
+
+    bank = SQLiteInstance(str(path))
+    try:
+        assert bank.media_key(1) == bank.media_key(2)
+        assert bank.load_media_url(bank.media_key(2)) == ('https://cdn.example/clue1.png', 1)
+    finally:
+        bank.close()
@@ -0,0 +1,49 @@
+import asyncio
+
+import mongomock
+import pytest
+
+from cache import GameStateCache
+from mongo import MongoInstance
+from state import game_documents
+from storage import StaleGameError
+from tests.test_guilds import new_game
+
+
+def test_write_based_on_an_old_revision_fails():
+    client = mongomock.MongoClient()
+    first, second = MongoInstance('mongodb://localhost', client), MongoInstance('mongodb://localhost', client)
+    first.store_game(1, *game_documents(new_game(1, 'board')))
+
+    stale, current = first.load_game(1), second.load_game(1)
+    current['players'].add(2, 'bob', 400)
+    second.store_game(1, *game_documents(current))
+
+    stale['players'].add(3, 'carol', 200)
+    with pytest.raises(StaleGameError):
+        first.store_game(1, *game_documents(stale))
+    with pytest.raises(StaleGameError):
+        first.store_game(1, *game_documents(stale))
+    assert [p.id for p in first.load_game(1)['players']] == [2]
+
+
+def test_cache_reloads_a_game_changed_elsewhere():
+    async def conflict():
+        client = mongomock.MongoClient()
+        first, second = MongoInstance('mongodb://localhost', client), MongoInstance('mongodb://localhost', client)
+        first.store_game(1, *game_documents(new_game(1, 'board')))
+        cache = GameStateCache(first)
+
+        stale = await cache.get_game(1)
+        current = second.load_game(1)
+        current['players'].add(2, 'bob', 400)
+        second.store_game(1, *game_documents(current))
+
+        stale['players'].add(3, 'carol', 200)
+        await cache.save_game(1, stale)
+        await cache.flush()
+        reloaded = await cache.get_game(1)
+        await cache.close()
+        return [p.id for p in reloaded['players']]
+
+    assert asyncio.run(conflict()) == [2]
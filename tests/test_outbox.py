@@ -0,0 +1,62 @@
+import asyncio
+
+from fakes import FakeChannel, FakeGuild, FakeUser
+from outbox import Outbox
+
+
+def channel():
+    return FakeChannel(FakeGuild(1), FakeUser(0, 'TriviCord', bot=True))
+
+
+def test_ended_game_drops_queued_board_updates():
+    async def end():
+        outbox = Outbox(window=0.05)
+        board = channel()
+        first = await outbox.update_board(board, 'board', new=True)
+        update = outbox.update_board(board, 'board with an answered clue')
+        outbox.forget_board(board)
+        assert await update is None
+        await outbox.close()
+        return board, first
+
+    board, first = asyncio.run(end())
+    assert [m.content for m in board.sent] == ['board']
+    assert not first.pinned
+
+
+def test_new_board_unpins_the_previous_one():
+    async def restart():
+        outbox = Outbox(window=0)
+        board = channel()
+        first = await outbox.update_board(board, 'old board', new=True)
+        second = await outbox.update_board(board, 'new board', new=True)
+        await outbox.close()
+        return first, second
+
+    first, second = asyncio.run(restart())
+    assert not first.pinned
+    assert second.pinned
+
+
+class FlakyChannel(FakeChannel):
+    failed = False
+
+    async def send(self, content=None, **kwargs):
+        if not self.sent and not self.failed:
+            self.failed = True
+            raise ConnectionResetError('connection reset by peer')
+        return await super().send(content, **kwargs)
+
+
+def test_send_errors_do_not_stop_the_channel_queue():
+    async def send():
+        outbox = Outbox(window=0)
+        flaky = FlakyChannel(FakeGuild(1), FakeUser(0, 'TriviCord', bot=True))
+        first = await asyncio.wait_for(outbox.send(flaky, 'first'), timeout=1)
+        second = await asyncio.wait_for(outbox.send(flaky, 'second'), timeout=1)
+        await outbox.close()
+        return first, second
+
+    first, second = asyncio.run(send())
+    assert first is None
+    assert second is not None and second.content == 'second'
@@ -0,0 +1,21 @@
+from players import PlayerRegistry
+
+
+def legacy_registry():
+    # players of games stored before ids were known, keyed by their username
+    return PlayerRegistry.load([['alice', 'alice', 400], ['bob', 'bob', 200]])
+
+
+def test_legacy_player_is_migrated_by_username():
+    players = legacy_registry()
+    player = players.identify(1, 'Ally', 'alice')
+    assert player.points == 400
+    assert player.name == 'Ally'
+    assert 1 in players and 'alice' not in players
+    assert [p.id for p in players.top()] == [1, 'bob']
+
+
+def test_nickname_does_not_take_over_a_legacy_player():
+    players = legacy_registry()
+    assert players.identify(2, 'alice', 'mallory') is None
+    assert players.get('alice').points == 400
@@ -0,0 +1,153 @@
+import asyncio
+
+import pytest
+
+import jeopardy
+import sqlite
+from fakes import FakeQuestionApi
+from fetch import Fetcher, fetcher
+from jeopardy import JeopardyGame, TriviaGame
+from state import board_document
+from sqlite import SQLiteInstance
+from sync import CategoryIndexCrawler, QuestionBankSync
+
+
+def question_count(bank):
+    return bank.conn.execute('select count(*) from questions').fetchone()[0]
+
+
+def test_opentdb_sync_skips_questions_fetched_again(tmp_path):
+    async def sync_twice():
+        api = FakeQuestionApi(category_count=3, trivia_count=10)
+        await api.start()
+        fetcher = Fetcher()
+        bank = SQLiteInstance(str(tmp_path / 'bank.db'))
+        try:
+            sync = QuestionBankSync(bank, fetcher, opentdb=api.url, request_delay=0)
+            await sync.sync_opentdb()
+            first = question_count(bank)
+            # like after a token reset, every category is fetched again and the options come in another order
+            bank.set_sync_cursor('opentdb', None)
+            await sync.sync_opentdb()
+            return first, question_count(bank)
+        finally:
+            bank.close()
+            await fetcher.close()
+            await api.close()
+
+    first, second = asyncio.run(sync_twice())
+    assert first == 30
+    assert second == first
+
+
+def test_question_bank_removes_duplicate_trivia_questions(tmp_path):
+    path = str(tmp_path / 'bank.db')
+    bank = SQLiteInstance(path)
+    with bank.conn:
+        bank.conn.execute('drop index questions_category_key')
+        bank.conn.executemany('insert into questions (question, answer, value, category_id) values (?, ?, 200, 1)',
+                              [('Capital of France?\nPossible answers:\n  - Paris\n  - Rome', 'Paris'),
+                               ('Capital of France?\nPossible answers:\n  - Rome\n  - Paris', 'Paris')])
+    bank.close()
+
+    bank = SQLiteInstance(path)
+    try:
+        assert question_count(bank) == 1
+        assert bank.conn.execute('select clue_count from category_values').fetchone()[0] == 1
+    finally:
+        bank.close()
+
+
+
+@pytest.fixture
+def restore_urls(monkeypatch):
+    # the fake api points the question urls at itself
+    for urls in (jeopardy.categories_url, jeopardy.category_url):
+        for key, url in list(urls.items()):
+            monkeypatch.setitem(urls, key, url)
+
+
+def test_crawler_moves_past_a_category_that_fails(tmp_path, restore_urls):
+    async def crawl():
+        api = FakeQuestionApi(category_count=30, missing={3})
+        await api.start()
+        api.patch_urls()
+        bank = SQLiteInstance(str(tmp_path / 'bank.db'))
+        try:
+            assert await CategoryIndexCrawler(bank).crawl_page()
+            return bank.get_sync_cursor('jservice_index'), bank.conn.execute(
+                'select complete from jservice_categories where id = 3').fetchone()
+        finally:
+            bank.close()
+            await fetcher.close()
+            await api.close()
+
+    cursor, missing = asyncio.run(crawl())
+    assert cursor == {'offset': 30}
+    assert missing == (None,)
+
+
+def test_crawler_fetches_a_failed_category_again(tmp_path, restore_urls, monkeypatch):
+    async def crawl():
+        api = FakeQuestionApi(category_count=30, missing={2})
+        await api.start()
+        api.patch_urls()
+        bank = SQLiteInstance(str(tmp_path / 'bank.db'))
+        try:
+            await CategoryIndexCrawler(bank).crawl_page()
+            # category 2 was only down for a while
+            api.missing.clear()
+            bank.set_sync_cursor('jservice_index', None)
+            monkeypatch.setattr(sqlite, 'jservice_retry_delay', 0)
+            await CategoryIndexCrawler(bank).crawl_page()
+            return bank.conn.execute('select complete from jservice_categories where id = 2').fetchone()
+        finally:
+            bank.close()
+            await fetcher.close()
+            await api.close()
+
+    assert asyncio.run(crawl()) == (1,)
+
+
+def test_indexed_board_falls_back_when_a_category_fails(tmp_path, restore_urls, monkeypatch):
+    async def build():
+        api = FakeQuestionApi(category_count=600, missing={3})
+        await api.start()
+        api.patch_urls()
+        bank = SQLiteInstance(str(tmp_path / 'bank.db'))
+        monkeypatch.setattr(JeopardyGame, 'category_index', bank)
+        # the index still has category 3 as complete from before it went missing
+        bank.mark_jservice_categories([(i, True) for i in range(1, 6)])
+        try:
+            game = await JeopardyGame.create(1)
+            return game.titles, bank.conn.execute('select complete from jservice_categories where id = 3').fetchone()
+        finally:
+            bank.close()
+            await fetcher.close()
+            await api.close()
+
+    titles, missing = asyncio.run(build())
+    assert len(titles) == 5 and 'category 3' not in titles
+    assert missing == (None,)
+
+
+def test_trivia_board_replaces_categories_without_enough_questions(restore_urls, monkeypatch):
+    async def build():
+        api = FakeQuestionApi(category_count=8, short={9, 10, 11})
+        await api.start()
+        api.patch_urls()
+        fetcher = Fetcher()
+        monkeypatch.setattr(jeopardy, 'fetcher', fetcher)
+        try:
+            game = await TriviaGame.create(1)
+            api.short = set(range(9, 17))
+            with pytest.raises(LookupError):
+                await TriviaGame.create(2)
+            return game, board_document({'game': game})
+        finally:
+            await fetcher.close()
+            await api.close()
+
+    game, board = asyncio.run(build())
+    assert sorted(game.titles) == ['trivia {}'.format(i) for i in range(12, 17)]
+    assert all(len(category['clues']) == 5 for category in board['categories'])
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import math
+import time
+
+default_tick = 1.0
+wheel_slots = 64
+wheel_levels = 3
+
+
+class TimerWheel:
+    """A hierarchical timing wheel that keeps at most one deadline per key.
+
+    Level 0 has a slot per tick, every higher level a slot per full turn of the level below. Timers start in the
+    lowest level that reaches their deadline and move down a level whenever the level below has turned once, so
+    scheduling, cancelling and every tick take constant time however many timers are running.
+    """
+
+    def __init__(self, tick=default_tick, slots=wheel_slots, levels=wheel_levels, now=None):
+        self.tick = tick
+        self.slots = slots
+        self.wheels = [[dict() for _ in range(slots)] for _ in range(levels)]
+        self.overflow = dict()
+        self.timers = dict()
+        self.current = int((time.time() if now is None else now) / tick)
+
+    def __len__(self):
+        return len(self.timers)
+
+    def __contains__(self, key):
+        return key in self.timers
+
+    def schedule(self, key, deadline):
+        self.cancel(key)
+        self.place(key, deadline, self.current + 1)
+
+    def place(self, key, deadline, earliest):
+        target = max(math.ceil(deadline / self.tick), earliest)
+        delta = target - self.current
+        for level, wheel in enumerate(self.wheels):
+            if delta < self.slots ** (level + 1):
+                bucket = wheel[(target // self.slots ** level) % self.slots]
+                break
+        else:
+            bucket = self.overflow
+        bucket[key] = deadline
+        self.timers[key] = bucket
+
+    def cancel(self, key):
+        bucket = self.timers.pop(key, None)
+        if bucket is not None:
+            del bucket[key]
+
+    def advance(self, now):
+        """Moves the wheel to the time now and returns the keys whose deadline has passed."""
+        expired = list()
+        target = int(now / self.tick)
+        while self.current < target:
+            self.current += 1
+            for level in range(1, len(self.wheels) + 1):
+                span = self.slots ** level
+                if self.current % span:
+                    break
+                if level < len(self.wheels):
+                    wheel = self.wheels[level]
+                    index = (self.current // span) % self.slots
+                    bucket, wheel[index] = wheel[index], dict()
+                else:
+                    bucket, self.overflow = self.overflow, dict()
+                for key, deadline in bucket.items():
+                    self.place(key, deadline, self.current)
+
+            wheel = self.wheels[0]
+            index = self.current % self.slots
+            bucket, wheel[index] = wheel[index], dict()
+            for key in bucket:
+                del self.timers[key]
+            expired.extend(bucket)
+        return expired
+
+
+class TimerScheduler:
+    """Drives a timer wheel from a single task and runs the handler with the key of every timer that expires."""
+
+    def __init__(self, handler, tick=default_tick):
+        self.handler = handler
+        self.wheel = TimerWheel(tick)
+        self.task = None
+        self.running = set()
+
+    def schedule(self, key, deadline):
+        self.wheel.schedule(key, deadline)
+
+    def cancel(self, key):
+        self.wheel.cancel(key)
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.wheel.tick)
+            for key in self.wheel.advance(time.time()):
+                task = asyncio.get_running_loop().create_task(self.expire(key))
+                self.running.add(task)
+                task.add_done_callback(self.running.discard)
+
+    async def expire(self, key):
+        try:
+            await self.handler(key)
+        except Exception:
+            logging.exception('timer {} failed'.format(key))
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        await asyncio.gather(*self.running, return_exceptions=True)